@@ -31,6 +31,7 @@ from ralph_assets.models import (
     SoftwareCategory,
     Warehouse,
 )
+from ralph_assets.models_util import get_choices_map
 
 THROTTLE_AT = settings.API_THROTTLING['throttle_at']
 TIMEFRAME = settings.API_THROTTLING['timeframe']
@@ -51,7 +52,9 @@ class ChoicesField(fields.ApiField):
         field_name = self.field_name or self.instance_name
         field_value = getattr(bundle.obj, field_name)
         if field_value:
-            return self.choices_class.from_id(field_value).name
+            return get_choices_map(self.choices_class).from_id(
+                field_value,
+            ).name
         else:
             return None
 
@@ -281,7 +284,7 @@ class AssetsResource(ModelResource):
     )
 
     class Meta:
-        queryset = Asset.objects.all()
+        queryset = Asset.objects.with_ralph_devices()
         authentication = ApiKeyAuthentication()
         filtering = {
             'barcode': ALL,
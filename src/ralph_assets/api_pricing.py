@@ -5,9 +5,17 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import datetime
+
 from django.db.models import Q
+from ralph.middleware import get_actual_regions
 
-from ralph_assets.models_assets import Asset, Warehouse
+from ralph_assets.models_assets import (
+    Asset,
+    AssetType,
+    Warehouse,
+    is_deprecated_on,
+)
 
 
 def get_warehouses():
@@ -24,7 +32,9 @@ def get_assets(date):
     for asset in Asset.objects_dc.filter(
         Q(invoice_date=None) | Q(invoice_date__lte=date),
         part_info=None,
-    ):
+    ).select_related(
+        'device_info', 'model__category',
+    ).with_ralph_devices():
         device_info = asset.device_info
 
         venture_info = asset.venture
@@ -35,7 +45,9 @@ def get_assets(date):
         yield {
             'asset_id': asset.id,
             'barcode': asset.barcode,
-            'is_deprecated': asset.is_deprecated(date=date),
+            'is_deprecated': is_deprecated_on(
+                asset.effective_deprecation_end_date, date,
+            ),
             'price': asset.price,
             'ralph_id': device_info.ralph_device_id if device_info else None,
             'slots': asset.slots,
@@ -53,17 +65,34 @@ def get_assets(date):
 
 def get_asset_parts():
     """Yields dicts describing parts of assets"""
-    for asset in Asset.objects_dc.all():
-        for part in asset.get_parts():
-            device_info = asset.device_info
-            yield {
-                'asset_id': part.id,
-                'barcode': asset.barcode,
-                'is_deprecated': part.is_deprecated(),
-                'model': part.model.name if part.model else None,
-                'price': part.price,
-                'ralph_id': device_info.ralph_device_id if device_info else None,  # noqa
-                'sn': asset.sn,
-                'deprecation_rate': asset.deprecation_rate,
-                'is_deprecated': part.is_deprecated(),
-            }
+    today = datetime.date.today()
+    # parts and their (not deleted DC) devices are fetched together, only
+    # assets having parts are visited
+    parts = Asset.objects.filter(
+        part_info__device__type__in=AssetType.DC.choices,
+        part_info__device__deleted=False,
+        part_info__device__region__in=get_actual_regions(),
+    ).values_list(
+        'id',
+        'effective_deprecation_end_date',
+        'model__name',
+        'price',
+        'part_info__device__barcode',
+        'part_info__device__sn',
+        'part_info__device__deprecation_rate',
+        'part_info__device__device_info__ralph_device_id',
+    ).order_by('part_info__device', 'id')
+    for (
+        part_id, end_date, model_name, price, barcode, sn, deprecation_rate,
+        ralph_id,
+    ) in parts.iterator():
+        yield {
+            'asset_id': part_id,
+            'barcode': barcode,
+            'is_deprecated': is_deprecated_on(end_date, today),
+            'model': model_name,
+            'price': price,
+            'ralph_id': ralph_id,
+            'sn': sn,
+            'deprecation_rate': deprecation_rate,
+        }
@@ -15,6 +15,7 @@ from ralph_assets.models import (
     DCDeviceLookup,
     AssetLookupFuzzy,
 )
+from ralph_assets.models_util import get_choices_map
 
 
 class AssetLookup(DCDeviceLookup):
@@ -36,7 +37,9 @@ def _create_asset_dict(asset):
     if asset.model.manufacturer:
         manufacturer_name = asset.model.manufacturer.name
     try:
-        asset_source = AssetSource.from_id(asset.source).raw
+        asset_source = get_choices_map(AssetSource).from_id(
+            asset.source,
+        ).raw
     except ValueError:
         asset_source = None
     category = asset.model.category.name if asset.model.category else ''
@@ -57,7 +60,7 @@ def _create_asset_dict(asset):
         'support_type': asset.support_type,
         'support_void_reporting': asset.support_void_reporting,
         'provider': asset.provider,
-        'status': AssetStatus.from_id(asset.status).raw,
+        'status': get_choices_map(AssetStatus).from_id(asset.status).raw,
         'remarks': asset.remarks,
         'niw': asset.niw,
         'warehouse': asset.warehouse.name,
@@ -5,19 +5,68 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import itertools
 import logging
+from collections import defaultdict
 
+from django.conf import settings
 from django.db.models import Q
 
 from ralph.util.api import Getter
-from ralph_assets.licences.models import Licence
-from ralph_assets.models_assets import Asset, AssetModel, AssetType, Warehouse
+from ralph_assets.licences.models import Licence, LicenceAsset
+from ralph_assets.models_assets import (
+    Asset,
+    AssetModel,
+    AssetType,
+    Warehouse,
+    attach_ralph_core_counts,
+    attach_ralph_devices,
+    is_deprecated_on,
+    split_by_deprecation,
+)
 from ralph_assets.models_support import Support
 
 logger = logging.getLogger(__name__)
 
+SCROOGE_CHUNK_SIZE = 500
 
-class DatedGetter(Getter):
+
+class IdListsGetter(Getter):
+    """
+    Getter which fills ``id_lists`` fields with ids of related objects read
+    from many-to-many through tables, one query per field instead of one
+    query per item.
+
+    ``id_lists`` maps field name to (through model, field pointing to the
+    item, field pointing to the related object)."""
+
+    id_lists = {}
+
+    def get_id_lists(self, name):
+        """Returns {item id: [related object ids]} for *name* field."""
+        through, item_field, related_field = self.id_lists[name]
+        related_model = through._meta.get_field(related_field).rel.to
+        id_lists = defaultdict(list)
+        for item_id, related_id in through.objects.filter(**{
+            item_field + '__in': self.get_queryset().values('pk'),
+            # the same objects as the related manager of the item returns
+            related_field + '__in': related_model._default_manager.values(
+                'pk',
+            ),
+        }).values_list(item_field, related_field).order_by(related_field):
+            id_lists[item_id].append(related_id)
+        return id_lists
+
+    def __iter__(self):
+        id_lists = {name: self.get_id_lists(name) for name in self.id_lists}
+        for item in self.get_queryset():
+            ret = self.format_item(item)
+            for name, ids in id_lists.iteritems():
+                ret[name] = ids.get(item.pk, [])
+            yield ret
+
+
+class DatedGetter(IdListsGetter):
     """
     Returns only items that have a timespan (marked by begin_field and
     end_field) that contains given date"""
@@ -26,11 +75,39 @@ class DatedGetter(Getter):
         self.date = date
         super(DatedGetter, self).__init__(*args, **kwargs)
 
-    def get_queryset(self):
-        return super(DatedGetter, self).get_queryset().filter(**{
+    def get_date_filter(self):
+        return {
             self.begin_field + '__lte': self.date,
             self.end_field + '__gte': self.date,
-        })
+        }
+
+    def get_queryset(self):
+        return super(DatedGetter, self).get_queryset().filter(
+            **self.get_date_filter()
+        )
+
+
+class DatedRangeGetter(DatedGetter):
+    """
+    Returns items that have a timespan overlapping days from start to end
+    (both included), with the part of the range covered by the timespan
+    (``period_start`` and ``period_end``), so the range is read at once."""
+
+    def __init__(self, start, end, *args, **kwargs):
+        self.end = end
+        super(DatedRangeGetter, self).__init__(start, *args, **kwargs)
+
+    def get_date_filter(self):
+        return {
+            self.begin_field + '__lte': self.end,
+            self.end_field + '__gte': self.date,
+        }
+
+    def format_item(self, item):
+        ret = super(DatedRangeGetter, self).format_item(item)
+        ret['period_start'] = max(self.date, getattr(item, self.begin_field))
+        ret['period_end'] = min(self.end, getattr(item, self.end_field))
+        return ret
 
 
 def get_warehouses():
@@ -56,12 +133,38 @@ def get_models():
         }
 
 
-def get_assets(date):
-    """Yields dicts describing all assets"""
-    for asset in Asset.objects_dc.filter(
-        Q(invoice_date=None) | Q(invoice_date__lte=date),
-        part_info=None,
-    ).select_related('model', 'device_info'):
+def iter_asset_chunks(queryset, chunk_size=SCROOGE_CHUNK_SIZE):
+    """Yields lists of assets from *queryset*, chunks are ordered by pk.
+
+    Ralph devices linked to each chunk (and their cores counts, if they are
+    compared with assets) are loaded in bulk. Only one chunk is kept in
+    memory at a time.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        attach_ralph_devices(chunk)
+        if settings.SHOW_RALPH_CORES_DIFF:
+            attach_ralph_core_counts(chunk)
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def _iter_assets(date, chunk_size):
+    """Yields assets invoiced till *date* having everything Scrooge needs."""
+    for asset in itertools.chain.from_iterable(iter_asset_chunks(
+        Asset.objects_dc.filter(
+            Q(invoice_date=None) | Q(invoice_date__lte=date),
+            part_info=None,
+        ).select_related('model', 'device_info'),
+        chunk_size,
+    )):
         if not asset.device_info_id:
             logger.error('Asset {0} has no device'.format(asset.id))
             continue
@@ -71,30 +174,67 @@ def get_assets(date):
         if not asset.device_environment_id:
             logger.error('Asset {0} has no environment'.format(asset.id))
             continue
-        device_info = asset.device_info
-        hostname = None
-        if device_info:
-            ralph_device = device_info.get_ralph_device()
-            if ralph_device:
-                hostname = ralph_device.name
+        yield asset
 
-        yield {
-            'asset_id': asset.id,
-            'device_id': device_info.ralph_device_id if device_info else None,
-            'asset_name': hostname,
-            'service_id': asset.service_id,
-            'environment_id': asset.device_environment_id,
-            'sn': asset.sn,
-            'barcode': asset.barcode,
-            'warehouse_id': asset.warehouse_id,
-            'cores_count': asset.cores_count,
-            'power_consumption': asset.model.power_consumption,
-            'collocation': asset.model.height_of_device,
-            'depreciation_rate': asset.deprecation_rate,
-            'is_depreciated': asset.is_deprecated(date=date),
-            'price': asset.price,
-            'model_id': asset.model_id,
-        }
+
+def _get_asset_dict(asset):
+    device_info = asset.device_info
+    hostname = None
+    if device_info:
+        ralph_device = device_info.get_ralph_device()
+        if ralph_device:
+            hostname = ralph_device.name
+    return {
+        'asset_id': asset.id,
+        'device_id': device_info.ralph_device_id if device_info else None,
+        'asset_name': hostname,
+        'service_id': asset.service_id,
+        'environment_id': asset.device_environment_id,
+        'sn': asset.sn,
+        'barcode': asset.barcode,
+        'warehouse_id': asset.warehouse_id,
+        'cores_count': asset.cores_count,
+        'power_consumption': asset.model.power_consumption,
+        'collocation': asset.model.height_of_device,
+        'depreciation_rate': asset.deprecation_rate,
+        'price': asset.price,
+        'model_id': asset.model_id,
+    }
+
+
+def get_assets(date, chunk_size=SCROOGE_CHUNK_SIZE):
+    """Yields dicts describing all assets"""
+    for asset in _iter_assets(date, chunk_size):
+        ret = _get_asset_dict(asset)
+        ret['is_depreciated'] = is_deprecated_on(
+            asset.effective_deprecation_end_date, date,
+        )
+        yield ret
+
+
+def get_assets_range(start, end, chunk_size=SCROOGE_CHUNK_SIZE):
+    """Yields dicts describing all assets for days from *start* to *end*
+    (both included), reading assets once.
+
+    Every asset is described by one dict per period in which it is invoiced
+    and deprecated (or not) - ``period_start`` and ``period_end`` are the
+    first and the last day of the period, other values are the same as
+    ``get_assets`` returns for each day of the period.
+    """
+    for asset in _iter_assets(end, chunk_size):
+        asset_dict = _get_asset_dict(asset)
+        first_day = start
+        if asset.invoice_date and asset.invoice_date > start:
+            first_day = asset.invoice_date
+        for period_start, period_end, deprecated in split_by_deprecation(
+            asset.effective_deprecation_end_date, first_day, end,
+        ):
+            yield dict(
+                asset_dict,
+                is_depreciated=deprecated,
+                period_start=period_start,
+                period_end=period_end,
+            )
 
 
 class get_supports(DatedGetter):
@@ -111,10 +251,8 @@ class get_supports(DatedGetter):
         'price',
         'date_from',
         'date_to',
-        ('assets', (lambda support: [
-            asset.id for asset in support.assets.all()
-        ]))
     ]
+    id_lists = {'assets': (Support.assets.through, 'support', 'asset')}
 
 
 class get_licences(DatedGetter):
@@ -131,7 +269,18 @@ class get_licences(DatedGetter):
         'price',
         'invoice_date',
         'valid_thru',
-        ('assets', (lambda licence: [
-            asset.id for asset in licence.assets.all()
-        ]))
     ]
+    id_lists = {'assets': (LicenceAsset, 'licence', 'asset')}
+
+    def get_queryset(self):
+        return super(get_licences, self).get_queryset().select_related(
+            'software_category',
+        )
+
+
+class get_supports_range(DatedRangeGetter, get_supports):
+    """Gets data for DC supports for days from start to end."""
+
+
+class get_licences_range(DatedRangeGetter, get_licences):
+    """Gets data for DC licences for days from start to end."""
@@ -40,3 +40,5 @@ class Assets(RalphModule):
         })
         self.settings['DEFAULT_DEPRECATION_RATE'] = 25
         self.settings['SHOW_RALPH_CORES_DIFF'] = False
+        self.settings['ASSETS_SEARCH_APPROXIMATE_COUNT'] = False
+        self.settings['ASSETS_HISTORY_ARCHIVE_DAYS'] = 365
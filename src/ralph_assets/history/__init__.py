@@ -7,7 +7,17 @@ from __future__ import unicode_literals
 
 from django.db.models import signals
 
-from ralph_assets.history.receivers import m2m_changed, post_save, pre_save
+from ralph_assets.history.models import (
+    DEFAULT_HISTORY_FIELD_EXCLUDE,
+    HistoryMixin,
+)
+from ralph_assets.history.receivers import (
+    m2m_changed,
+    post_save,
+    pre_save,
+    through_post_delete,
+    through_post_save,
+)
 
 
 registry = {}
@@ -15,7 +25,13 @@ registry_m2m = {}
 
 
 def register(model, exclude=None, m2m=False):
-    """Register model to history observer."""
+    """Register model to history observer.
+
+    Models with :class:`HistoryMixin` are registered automatically. With
+    *m2m*, *model* is a custom through model of a relation pointing to a
+    model with history (relations with automatic through models are followed
+    without registration).
+    """
     if exclude is None and not m2m:
         raise TypeError('Please specified exclude argument.')
 
@@ -30,4 +46,19 @@ def register(model, exclude=None, m2m=False):
         signals.post_save.connect(post_save, sender=model)
     else:
         registry_m2m[model] = True
-        signals.m2m_changed.connect(m2m_changed, sender=model)
+        # rows of custom through models are created directly
+        signals.post_save.connect(through_post_save, sender=model)
+        signals.post_delete.connect(through_post_delete, sender=model)
+
+
+def register_history_model(sender, **kwargs):
+    if issubclass(sender, HistoryMixin) and sender not in registry:
+        register(sender, exclude=getattr(
+            sender,
+            'exclude_fields_from_history',
+            DEFAULT_HISTORY_FIELD_EXCLUDE,
+        ))
+
+
+signals.class_prepared.connect(register_history_model)
+signals.m2m_changed.connect(m2m_changed)
@@ -5,13 +5,14 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import json
-from collections import namedtuple
+import threading
+import time
+from functools import wraps
 
 from datetime import datetime
 
-from django.db import models
-from django.core import serializers
+from django.core.cache import cache
+from django.db import models, transaction
 from django.core.urlresolvers import reverse
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.generic import GenericForeignKey
@@ -20,14 +21,40 @@ from django.utils.translation import ugettext_lazy as _
 
 DEFAULT_HISTORY_FIELD_EXCLUDE = ('created', 'modified', 'invoice_date',
                                  'cache_version', 'rght', 'level', 'lft',
-                                 'tree_id', 'loan_end_date')
+                                 'tree_id', 'loan_end_date',
+                                 'effective_deprecation_end_date')
 
-serializer = serializers.get_serializer("python")()
+HISTORY_BULK_SIZE = 500
+# number of latest changes of an object (or of its field) kept in cache
+LATEST_HISTORY_CACHE_SIZE = 10
 
-Snapshot = namedtuple(
-    'Snapshot',
-    ['current', 'previous', 'added', 'deleted', 'changed', 'obj', 'field_name'],  # noqa
-)
+
+def get_latest_history_cache_key(content_type_id, object_id, field_name=None):
+    return 'ralph_assets.latest_history.{}.{}.{}'.format(
+        content_type_id, object_id, field_name or '',
+    )
+
+
+ARCHIVE_VERSION_CACHE_KEY = 'ralph_assets.history_archive_version'
+
+
+def get_archive_count_cache_key(content_type_id, object_id, **kwargs):
+    """Cache key of the number of archived changes of the object, valid
+    until the archive is written again.
+
+    The archive version is bumped by the ``archive_history`` command, which
+    runs in its own process, so web workers see the new version only with a
+    shared cache backend (e.g. memcached). With a per process cache (the
+    default LocMemCache) counts are refreshed when they time out."""
+    return 'ralph_assets.history_archive_count.{}.{}.{}.{}'.format(
+        cache.get(ARCHIVE_VERSION_CACHE_KEY, 0),
+        content_type_id,
+        object_id,
+        '.'.join(
+            '{}={}'.format(name, value)
+            for name, value in sorted(kwargs.iteritems())
+        ),
+    )
 
 
 class HistoryManager(models.Manager):
@@ -54,10 +81,107 @@ class HistoryManager(models.Manager):
             **kwargs
         )
 
-    def log_changes(self, obj, user, diff_data):
+    def get_latest_history(self, obj, limit, field_name=None):
+        """Returns list of (at most) *limit* latest changes of *obj*, fetched
+        with a single ``LIMIT`` query. Up to ``LATEST_HISTORY_CACHE_SIZE``
+        latest changes are cached until history of *obj* is written."""
+        content_type = ContentType.objects.get_for_model(obj.__class__)
+        history = self.get_history_for_this_content_type(
+            content_type, obj.id,
+        ).select_related('user').order_by('-date', '-id')
+        if field_name:
+            history = history.filter(field_name=field_name)
+        if limit > LATEST_HISTORY_CACHE_SIZE:
+            return list(history[:limit])
+        key = get_latest_history_cache_key(content_type.id, obj.id, field_name)
+        latest = cache.get(key)
+        if latest is None:
+            latest = list(history[:LATEST_HISTORY_CACHE_SIZE])
+            cache.set(key, latest)
+        return latest[:limit]
+
+    def write(self, rows):
+        """Writes History *rows* with a few ``bulk_create`` calls and
+        invalidates cached latest changes of their objects."""
+        for start in xrange(0, len(rows), HISTORY_BULK_SIZE):
+            self.bulk_create(rows[start:start + HISTORY_BULK_SIZE])
+        keys = set()
+        for row in rows:
+            keys.add(get_latest_history_cache_key(
+                row.content_type_id, row.object_id,
+            ))
+            keys.add(get_latest_history_cache_key(
+                row.content_type_id, row.object_id, row.field_name,
+            ))
+        cache.delete_many(list(keys))
+
+    def get_history_with_archive(self, content_type, object_id, **kwargs):
+        """Returns history of the object followed by its archived history,
+        see :class:`HistoryChain`."""
+        return HistoryChain(
+            self.get_history_for_this_content_type(
+                content_type, object_id, **kwargs
+            ),
+            HistoryArchive.objects.filter(
+                content_type=content_type,
+                object_id=object_id,
+                **kwargs
+            ),
+            get_archive_count_cache_key(
+                getattr(content_type, 'id', content_type), object_id,
+                **kwargs
+            ),
+        )
+
+    def archive(self, before, chunk_size=HISTORY_BULK_SIZE):
+        """Moves history older than *before* to the archive table (in
+        chunks, each in its own transaction). Returns the number of moved
+        rows."""
+        fields = HistoryArchive._meta.fields
+        moved = 0
+        while True:
+            rows = list(self.model.objects.filter(
+                date__lt=before,
+            ).order_by('pk').values(
+                *[field.name for field in fields]
+            )[:chunk_size])
+            if not rows:
+                if moved:
+                    # cached counts of archived changes are outdated
+                    cache.set(ARCHIVE_VERSION_CACHE_KEY, max(
+                        int(time.time()),
+                        cache.get(ARCHIVE_VERSION_CACHE_KEY, 0) + 1,
+                    ))
+                return moved
+            with transaction.commit_on_success():
+                HistoryArchive.objects.bulk_create([
+                    HistoryArchive(**{
+                        field.attname: row[field.name] for field in fields
+                    }) for row in rows
+                ])
+                self.model.objects.filter(
+                    pk__in=[row['id'] for row in rows],
+                ).delete()
+            moved += len(rows)
+
+    def log_changes(self, obj, user, diff_data, coalesce=False):
         if not obj:
             return
-        content_type = ContentType.objects.get_for_model(obj.__class__)
+        self.log_changes_for_this_content_type(
+            ContentType.objects.get_for_model(obj.__class__),
+            obj.id,
+            user,
+            diff_data,
+            coalesce=coalesce,
+        )
+
+    def log_changes_for_this_content_type(
+        self, content_type, object_id, user, diff_data, coalesce=False
+    ):
+        """Writes *diff_data* of the object to history. Inside a
+        :class:`buffered_history` block changes are written when the block
+        ends and, with *coalesce*, replace pending changes of the same field
+        (used for m2m membership)."""
         changed_items = []
 
         for data in diff_data:
@@ -65,16 +189,19 @@ class HistoryManager(models.Manager):
                 self.model(
                     user=user,
                     content_type=content_type,
-                    object_id=obj.id,
+                    object_id=object_id,
                     field_name=data['field'],
                     old_value=data['old'] if data['old'] else '-',
                     new_value=data['new'] if data['new'] else '-',
                 )
             )
-        self.model.objects.bulk_create(changed_items)
+        if history_buffer.active:
+            history_buffer.add(changed_items, coalesce=coalesce)
+        else:
+            self.write(changed_items)
 
 
-class History(models.Model):
+class AbstractHistory(models.Model):
     date = models.DateTimeField(verbose_name=_('date'), default=datetime.now)
     user = models.ForeignKey(
         'auth.User', verbose_name=_('user'), null=True,
@@ -82,16 +209,12 @@ class History(models.Model):
     )
     content_type = models.ForeignKey(ContentType)
     object_id = models.PositiveIntegerField()
-    content_object = GenericForeignKey('content_type', 'object_id')
     field_name = models.CharField(max_length=64, default='')
     old_value = models.TextField(default='')
     new_value = models.TextField(default='')
-    objects = HistoryManager()
 
     class Meta:
-        app_label = 'ralph_assets'
-        verbose_name = _('history change')
-        verbose_name_plural = _('history changes')
+        abstract = True
         ordering = ('-date',)
 
     def __unicode__(self):
@@ -103,6 +226,19 @@ class History(models.Model):
             self.new_value
         )
 
+
+class History(AbstractHistory):
+    content_object = GenericForeignKey('content_type', 'object_id')
+    objects = HistoryManager()
+
+    # (content_type, object_id, field_name, date) index is created by
+    # migration 0028
+
+    class Meta(AbstractHistory.Meta):
+        app_label = 'ralph_assets'
+        verbose_name = _('history change')
+        verbose_name_plural = _('history changes')
+
     @classmethod
     def get_history_url_for_object(cls, obj):
         content_type = ContentType.objects.get_for_model(obj.__class__)
@@ -112,78 +248,181 @@ class History(models.Model):
         })
 
 
+class HistoryArchive(AbstractHistory):
+    """History moved out of the main table by ``archive_history`` command
+    (indexed the same way)."""
+    content_object = GenericForeignKey('content_type', 'object_id')
+
+    class Meta(AbstractHistory.Meta):
+        app_label = 'ralph_assets'
+        verbose_name = _('archived history change')
+        verbose_name_plural = _('archived history changes')
+
+
+class HistoryChain(object):
+    """History rows followed by archived ones, sliceable for pagination.
+
+    Archived rows are older than the rest, so the archive is read only by
+    slices reaching past the main table rows (the hot window). The number
+    of archived rows is kept in cache under *archive_count_key* (if given),
+    so counting pages doesn't scan the archive either.
+    """
+
+    def __init__(self, history, archive, archive_count_key=None):
+        self.history = history
+        self.archive = archive
+        self.archive_count_key = archive_count_key
+        self._history_count = None
+        self._archive_count = None
+
+    @property
+    def history_count(self):
+        if self._history_count is None:
+            self._history_count = self.history.count()
+        return self._history_count
+
+    @property
+    def archive_count(self):
+        if self._archive_count is None:
+            if self.archive_count_key:
+                self._archive_count = cache.get(self.archive_count_key)
+            if self._archive_count is None:
+                self._archive_count = self.archive.count()
+                if self.archive_count_key:
+                    cache.set(self.archive_count_key, self._archive_count)
+        return self._archive_count
+
+    def count(self):
+        return self.history_count + self.archive_count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            rows = self[key:key + 1]
+            if not rows:
+                raise IndexError(key)
+            return rows[0]
+        start = key.start or 0
+        rows = []
+        if start < self.history_count:
+            rows.extend(self.history[start:key.stop])
+        if key.stop is None or key.stop > self.history_count:
+            rows.extend(self.archive[
+                max(start - self.history_count, 0):
+                None if key.stop is None else key.stop - self.history_count
+            ])
+        return rows
+
+
+class HistoryBlock(object):
+    """History rows waiting for the end of a :class:`buffered_history`
+    block. Coalesced rows are also kept by (content type, object, field)."""
+
+    def __init__(self):
+        self.rows = []
+        self.coalesced = {}
+
+
+def get_row_key(row):
+    return row.content_type_id, row.object_id, row.field_name
+
+
+class HistoryBuffer(threading.local):
+    """Per-thread stack of blocks of History rows. Rows of a nested block
+    are passed to the outer one, the outermost block writes them."""
+
+    def __init__(self):
+        self.blocks = []
+
+    @property
+    def active(self):
+        return bool(self.blocks)
+
+    def start(self):
+        self.blocks.append(HistoryBlock())
+
+    def end(self, commit=True):
+        block = self.blocks.pop()
+        if not commit:
+            return
+        if self.blocks:
+            for row in block.rows:
+                self.add(
+                    [row],
+                    coalesce=block.coalesced.get(get_row_key(row)) is row,
+                )
+        else:
+            self.flush(block)
+
+    def add(self, rows, coalesce=False):
+        block = self.blocks[-1]
+        for row in rows:
+            key = get_row_key(row)
+            if coalesce and key in block.coalesced:
+                block.coalesced[key].new_value = row.new_value
+                continue
+            block.rows.append(row)
+            if coalesce:
+                block.coalesced[key] = row
+
+    def get_pending(self, content_type, object_id, field_name):
+        """Returns the latest coalesced row of *field_name* of the object
+        which wasn't written yet."""
+        key = (content_type.id, object_id, field_name)
+        for block in reversed(self.blocks):
+            if key in block.coalesced:
+                return block.coalesced[key]
+        return None
+
+    def flush(self, block):
+        History.objects.write([
+            row for row in block.rows if row.old_value != row.new_value
+        ])
+
+
+history_buffer = HistoryBuffer()
+
+
+class buffered_history(object):
+    """Context manager (and decorator) deferring history writes to the end
+    of the block, where they are written with a few ``bulk_create`` calls.
+    If the block raises, its rows are dropped. Use it inside a transaction
+    block, so history is written (or rolled back) with the changes::
+
+        @transaction.commit_on_success
+        @buffered_history()
+        def done(self, form_list):
+            ...
+    """
+
+    def __enter__(self):
+        history_buffer.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        history_buffer.end(commit=exc_type is None)
+
+    def __call__(self, func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return inner
+
+
 class HistoryMixin(object):
-    """Django's raw m2m_change signal sucks when working with forms."""
-
-    def __init__(self, *args, **kwargs):
-        super(HistoryMixin, self).__init__(*args, **kwargs)
-        from ralph_assets.history import registry, register
-        if not registry.get(self.__class__, None):
-            exclude = getattr(
-                self,
-                'exclude_fields_from_history',
-                DEFAULT_HISTORY_FIELD_EXCLUDE
-            )
-            register(self.__class__, exclude=exclude)
-            for field in self._meta.get_all_related_many_to_many_objects():
-                register(field.field.rel.through, m2m=True)
+    """Records history of changes of the model and of m2m relations pointing
+    to it.
+
+    Models are registered when their classes are prepared (fields listed in
+    ``exclude_fields_from_history`` are skipped), so constructing instances
+    costs nothing. Changed fields are found by comparing with field values
+    recorded by ``TimeTrackable`` when an instance was loaded.
+    """
 
     def get_history(self, field_name=None):
         return History.objects.get_history_for_this_object(
             obj=self,
             field_name=field_name,
         )
-
-    def get_snapshot(self, obj, manager, field_name):
-        """Method returns snapshot from current state of object."""
-        snapshot = serializer.serialize(manager.all(), fields=())
-        try:
-            history = obj.get_history(field_name=field_name)[0]
-        except (IndexError, AttributeError):
-            history = None
-        previous = getattr(history, 'new_value', None)
-        previous = previous and json.loads(previous) or []
-        current = [s['pk'] for s in snapshot]
-        deleted = set(previous) - set(current)
-        added = set(current) - set(previous)
-        changed = not set(current) == set(previous)
-        return Snapshot(
-            current, previous, added, deleted, changed, obj, field_name
-        )
-
-    def save_history_from_snapshot(self, snapshot):
-        if snapshot.changed:
-            History.objects.log_changes(
-                snapshot.obj,
-                self.saving_user,
-                [{
-                    'field': snapshot.field_name,
-                    'old': json.dumps(snapshot.previous),
-                    'new': json.dumps(snapshot.current),
-                }]
-            )
-
-    def _save_related_objects_history(self, manager, related_pks, field_name):
-        for obj in manager.filter(pk__in=related_pks):
-            manager = getattr(obj, field_name)
-            snapshot = self.get_snapshot(obj, manager, field_name)
-            self.save_history_from_snapshot(snapshot)
-
-    def save_reverse_relation_history(self):
-        """Save history to related objects reverse."""
-        for field in self._meta.get_all_related_many_to_many_objects():
-            field_name = field.get_accessor_name()
-            reverse_manager = getattr(self, field_name)
-            snapshot = self.get_snapshot(self, reverse_manager, field_name)
-            self._save_related_objects_history(
-                reverse_manager, snapshot.added, field.field.name
-            )
-            self.save_history_from_snapshot(snapshot)
-
-    def save_m2m_history(self):
-        """Save history to related objects."""
-        for field in self._meta.get_m2m_with_model():
-            field_name = field[0].name
-            manager = getattr(self, field_name)
-            snapshot = self.get_snapshot(self, manager, field_name)
-            self.save_history_from_snapshot(snapshot)
@@ -5,7 +5,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from ralph_assets.history.utils import context
+from ralph_assets.history.utils import context, log_m2m_signal, log_through_row
 
 
 def pre_save(sender, instance, **kwargs):
@@ -13,14 +13,17 @@ def pre_save(sender, instance, **kwargs):
 
 
 def post_save(sender, instance, **kwargs):
-    context.end()
+    context.end(sender, instance)
 
 
-def m2m_changed(sender, instance, action, reverse, **kwargs):
-    if action in ('pre_clear',) and reverse:
-        instance.save_reverse_relation_history()
-    if action in ('post_add',) and not reverse:
-        try:
-            instance.save_m2m_history()
-        except AttributeError:
-            pass
+def m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    log_m2m_signal(sender, instance, action, reverse, pk_set)
+
+
+def through_post_save(sender, instance, created, **kwargs):
+    if created:
+        log_through_row(sender, instance)
+
+
+def through_post_delete(sender, instance, **kwargs):
+    log_through_row(sender, instance, removed=True)
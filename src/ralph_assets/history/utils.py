@@ -5,11 +5,16 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from django.core import serializers
+import json
+import threading
+
+from django.contrib.contenttypes.models import ContentType
 from django.db.models.fields import FieldDoesNotExist
 from django.db.models.fields.related import RelatedField
+from django.utils.encoding import is_protected_type
 
-from ralph_assets.history.models import History
+from ralph_assets.history.models import History, HistoryMixin, history_buffer
+from ralph_assets.models_util import get_choices_map
 
 
 def field_changes(instance, ignore=('id', 'ralph_device_id')):
@@ -61,10 +66,9 @@ def get_choices(instance, field, id):
         id = int(id)
     except (TypeError, ValueError):
         return id
-    choices = instance._meta.get_field_by_name(field)[0].get_choices()
-    for choice_id, value in choices:
-        if choice_id == id:
-            return value
+    return get_choices_map(
+        instance._meta.get_field_by_name(field)[0],
+    ).get_label(id)
 
 
 class DictDiffer(object):
@@ -82,41 +86,92 @@ class DictDiffer(object):
         )
 
 
-class HistoryContext(object):
+_history_fields = {}
 
-    def __init__(self):
-        self.serializer = serializers.get_serializer("python")()
-        self.obj = None
 
-    def get_fields_snapshot(self, objs):
-        if not objs:
-            return
-        kwargs = {}
-        fields = self.registry.get(objs[0].__class__, [])
-        if fields:
-            kwargs.update({'fields': fields})
-        return self.serializer.serialize(objs, **kwargs)
+def get_history_fields(model):
+    """Returns registered (concrete) fields of *model*."""
+    from ralph_assets.history import registry
+    try:
+        return _history_fields[model]
+    except KeyError:
+        names = registry.get(model, ())
+        fields = [field for field in model._meta.fields if field.name in names]
+        _history_fields[model] = fields
+        return fields
+
+
+def get_fields_snapshot(obj, model=None):
+    """Returns values of registered fields of *obj* (an instance of *model*
+    or an object with its field values as attributes) the way python
+    serializer represents them (foreign keys as primary keys)."""
+    snapshot = {}
+    for field in get_history_fields(model or obj.__class__):
+        if field.rel:
+            snapshot[field.name] = getattr(obj, field.attname)
+            continue
+        value = field._get_val_from_obj(obj)
+        if not is_protected_type(value):
+            value = field.value_to_string(obj)
+        snapshot[field.name] = value
+    return snapshot
+
+
+class FieldValues(object):
+    """Field values (by attname) as attributes."""
+
+    def __init__(self, values):
+        self.__dict__.update(values)
+
+
+def get_loaded_snapshot(obj):
+    """Returns snapshot of *obj* as it was loaded (or last saved), from
+    field values recorded by ``TimeTrackable``, or None for other objects.
+    Deferred instances are skipped (their state isn't complete)."""
+    if obj._deferred or not hasattr(obj, '_field_state'):
+        return None
+    values = obj._fields_as_dict()
+    values.update(obj.dirty_fields)
+    return get_fields_snapshot(FieldValues(values), obj.__class__)
 
-    @property
-    def registry(self):
-        from ralph_assets.history import registry
-        return registry
+
+class HistoryContext(object):
+    """Captures changes of *obj* made by a single save."""
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.model = obj.__class__
+        self.past_snapshot = None
 
     def pre_save(self):
-        self.pre_obj = None
+        """Remembers state of the object before save - field values
+        recorded when it was loaded (or saved), or for objects without them
+        the state from the database."""
+        if not self.obj._state.adding:
+            self.past_snapshot = get_loaded_snapshot(self.obj)
+            if self.past_snapshot is not None:
+                return
+        if self.obj.pk is None:
+            return
         try:
-            self.pre_obj = self.model._default_manager.get(pk=self.obj.pk)
+            pre_obj = self.model._default_manager.get(pk=self.obj.pk)
         except self.model.DoesNotExist:
             return
-        self.past_snapshot = self.get_fields_snapshot(
-            [self.pre_obj]
-        )[0]['fields']
+        self.past_snapshot = get_fields_snapshot(pre_obj)
+
+    def get_related(self, field, pk):
+        if pk is None:
+            return None
+        try:
+            return field.rel.to._base_manager.get(pk=pk)
+        except field.rel.to.DoesNotExist:
+            return None
 
     def post_save(self):
-        if not self.pre_obj:
+        if self.past_snapshot is None:
             return
-        current_snapshot = self.get_fields_snapshot([self.obj])[0]['fields']
 
+        current_snapshot = get_fields_snapshot(self.obj)
         fields_diff = DictDiffer(
             current_snapshot, self.past_snapshot
         ).changed()
@@ -125,23 +180,15 @@ class HistoryContext(object):
         for field in fields_diff:
             old_value = self.past_snapshot[field]
             new_value = current_snapshot[field]
-            old_field = self.pre_obj._meta.get_field_by_name(field)[0]
-            new_field = self.obj._meta.get_field_by_name(field)[0]
-            if isinstance(new_field, RelatedField):
-                old_value = str(getattr(self.pre_obj, field))
+            field_object = self.obj._meta.get_field_by_name(field)[0]
+            if isinstance(field_object, RelatedField):
+                old_value = str(self.get_related(field_object, old_value))
                 new_value = str(getattr(self.obj, field))
-            elif hasattr(old_field, 'choices') and old_field.choices:
+            elif hasattr(field_object, 'choices') and field_object.choices:
                 if int(old_value) == int(new_value):
                     continue
-                old_value = get_choices(self.pre_obj, field, old_value)
+                old_value = get_choices(self.obj, field, old_value)
                 new_value = get_choices(self.obj, field, new_value)
-            elif hasattr(self.obj, 'get_{}_display'.format(field)):
-                old_value = getattr(
-                    self.pre_obj, 'get_{}_display'.format(field)
-                )()
-                new_value = getattr(
-                    self.obj, 'get_{}_display'.format(field)
-                )()
 
             if old_value != new_value:
                 diff_data.append(
@@ -153,16 +200,181 @@ class HistoryContext(object):
                 )
         History.objects.log_changes(self.obj, self.obj.saving_user, diff_data)
 
-    def start(self, sender, obj, m2m=False, pk_set=set(), reverse=False):
-        self.obj = obj
-        self.model = self.obj.__class__
-        self.sender = sender
-        self.pre_save()
 
-    def end(self):
-        self.post_save()
-        self.obj = None
-        self.sender = None
-        self.reverse = False
+class HistoryContextStack(threading.local):
+    """Per-thread stack of contexts of saves in progress - saves of other
+    objects may be nested in a save (e.g. in signal receivers)."""
+
+    def __init__(self):
+        self.contexts = []
+
+    def start(self, sender, obj):
+        history_context = HistoryContext(obj)
+        history_context.pre_save()
+        self.contexts.append(history_context)
+
+    def end(self, sender, obj):
+        for index in xrange(len(self.contexts) - 1, -1, -1):
+            if self.contexts[index].obj is obj:
+                history_context = self.contexts[index]
+                # contexts above were left by saves which failed
+                del self.contexts[index:]
+                history_context.post_save()
+                return
+
+
+context = HistoryContextStack()
+
+
+_m2m_fields = {}
+
+
+def get_m2m_field(through):
+    """Returns the m2m field using *through* table."""
+    try:
+        return _m2m_fields[through]
+    except KeyError:
+        _m2m_fields[through] = None
+        for fk in through._meta.fields:
+            if not fk.rel:
+                continue
+            for field in fk.rel.to._meta.many_to_many:
+                if field.rel.through is through:
+                    _m2m_fields[through] = field
+        return _m2m_fields[through]
+
+
+def get_m2m_sides(field):
+    """Returns (model, field name, through foreign key, other through
+    foreign key) of both sides of m2m *field* - the declaring side first."""
+    source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+    return (
+        (field.model, field.name, source, target),
+        (field.rel.to, field.related.get_accessor_name(), target, source),
+    )
+
+
+def get_m2m_membership(content_type, object_id, field_name):
+    """Returns pks of related objects recorded by the latest history of m2m
+    *field_name* of the object or None if there is no history."""
+    history = history_buffer.get_pending(content_type, object_id, field_name)
+    if history is None:
+        history = History.objects.get_history_for_this_content_type(
+            content_type, object_id, field_name=field_name,
+        ).order_by('-date', '-id')[:1]
+        history = history[0] if history else None
+    if history is None:
+        return None
+    try:
+        return set(json.loads(history.new_value))
+    except ValueError:
+        return set()
+
+
+def log_m2m_changes(field, ids, related_ids, removed=False, user=None):
+    """Records that objects *related_ids* were added to (or *removed*
+    from) m2m *field* of objects *ids* - on both sides of the relation,
+    for sides with history. Membership recorded by the latest history is
+    updated with the changed pks, only objects without m2m history yet read
+    the through table."""
+    through = field.rel.through
+    sides = zip(get_m2m_sides(field), (ids, related_ids), (related_ids, ids))
+    for side, side_ids, changed in sides:
+        model, field_name, column, other_column = side
+        if not issubclass(model, HistoryMixin):
+            continue
+        content_type = ContentType.objects.get_for_model(model)
+        for object_id in side_ids:
+            previous = get_m2m_membership(content_type, object_id, field_name)
+            if previous is None:
+                # through table is already changed
+                current = set(through._default_manager.filter(**{
+                    column: object_id,
+                }).values_list(other_column, flat=True))
+                previous = (current | changed) if removed else (
+                    current - changed
+                )
+            elif removed:
+                current = previous - changed
+            else:
+                current = previous | changed
+            if current == previous:
+                continue
+            History.objects.log_changes_for_this_content_type(
+                content_type,
+                object_id,
+                user,
+                [{
+                    'field': field_name,
+                    'old': json.dumps(sorted(previous)),
+                    'new': json.dumps(sorted(current)),
+                }],
+                coalesce=True,
+            )
+
+
+def log_m2m_signal(through, instance, action, reverse, pk_set):
+    """Records history of an ``m2m_changed`` signal using its *pk_set*.
+    Relations with custom through models are followed by saves and deletes
+    of through rows instead (``add`` and ``remove`` aren't available)."""
+    if not through._meta.auto_created:
+        return
+    field = get_m2m_field(through)
+    if field is None or not issubclass(field.rel.to, HistoryMixin):
+        # only relations pointing to models with history are recorded
+        return
+    if action == 'pre_clear':
+        column, other_column = get_m2m_sides(field)[reverse][2:]
+        instance.__dict__.setdefault('_history_cleared', {})[through] = set(
+            through._default_manager.filter(**{
+                column: instance.pk,
+            }).values_list(other_column, flat=True)
+        )
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.get('_history_cleared', {}).pop(
+            through, None,
+        )
+    if not pk_set:
+        return
+    ids, related_ids = set([instance.pk]), set(pk_set)
+    if reverse:
+        ids, related_ids = related_ids, ids
+    log_m2m_changes(
+        field,
+        ids,
+        related_ids,
+        removed=action != 'post_add',
+        user=getattr(instance, 'saving_user', None),
+    )
+
+
+def get_through_row_user(through, row, columns):
+    """Returns the user saving *row* of custom *through* model - the one set
+    on the row, or else on an object the row was created from (objects are
+    taken only if already fetched, no queries are made)."""
+    user = getattr(row, 'saving_user', None)
+    for column in columns:
+        if user is not None:
+            break
+        related = getattr(
+            row, through._meta.get_field(column).get_cache_name(), None,
+        )
+        user = getattr(related, 'saving_user', None)
+    return user
+
 
-context = HistoryContext()
+def log_through_row(through, row, removed=False):
+    """Records history of a saved (or deleted) row of custom *through*
+    model."""
+    field = get_m2m_field(through)
+    if field is None:
+        return
+    column, other_column = get_m2m_sides(field)[0][2:]
+    log_m2m_changes(
+        field,
+        set([getattr(row, through._meta.get_field(column).attname)]),
+        set([getattr(row, through._meta.get_field(other_column).attname)]),
+        removed=removed,
+        user=get_through_row_user(through, row, (column, other_column)),
+    )
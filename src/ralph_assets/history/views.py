@@ -48,18 +48,19 @@ class HistoryListForModel(PaginateMixin, ContentTypeMixin, HistoryBase):
         )
 
     def get_paginate_queryset(self):
-        history = History.objects.get_history_for_this_content_type(
-            content_type=self.content_type,
-            object_id=self.object_id,
-        )
         self.show_status_button = True
         try:
             self.model._meta.get_field_by_name('status')
         except FieldDoesNotExist:
             self.show_status_button = False
+        kwargs = {}
         if self.status and self.show_status_button:
-            history = history.filter(field_name__exact='status')
-        return history
+            kwargs['field_name__exact'] = 'status'
+        return History.objects.get_history_with_archive(
+            content_type=self.content_type,
+            object_id=self.object_id,
+            **kwargs
+        )
 
     def get_context_data(self, **kwargs):
         context = super(HistoryListForModel, self).get_context_data(**kwargs)
@@ -39,6 +39,7 @@ from ralph_assets.models_util import (
     RegionalizedDBManager,
 )
 from ralph_assets.models_util import WithForm
+from ralph_assets.history import register as register_history
 from ralph_assets.history.models import History, HistoryMixin
 
 
@@ -275,6 +276,7 @@ class Licence(
         try:
             assigned_licence = Model.objects.get(**kwargs)
             old_value = assigned_licence.quantity
+            assigned_licence.saving_user = getattr(obj, 'saving_user', None)
             assigned_licence.delete()
         except Model.DoesNotExist:
             return
@@ -306,6 +308,9 @@ class LicenceAsset(models.Model):
         )
 
 
+register_history(LicenceAsset, m2m=True)
+
+
 class LicenceUser(models.Model):
     licence = models.ForeignKey(Licence)
     user = models.ForeignKey(User, related_name='licences')
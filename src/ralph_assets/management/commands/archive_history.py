@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import datetime
+import textwrap
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from ralph_assets.history.models import HISTORY_BULK_SIZE, History
+
+
+class Command(BaseCommand):
+    """Move history of changes older than given number of days to the
+    archive table. Archived history is still shown by history views, past
+    the pages of recent changes."""
+    help = textwrap.dedent(__doc__).strip()
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--days',
+            type='int',
+            dest='days',
+            default=None,
+            help="Archive history older than given number of days "
+                 "(ASSETS_HISTORY_ARCHIVE_DAYS setting by default)",
+        ),
+        make_option(
+            '--chunk-size',
+            type='int',
+            dest='chunk_size',
+            default=HISTORY_BULK_SIZE,
+            help="Number of history rows moved at once",
+        ),
+    )
+
+    def handle(self, *args, **options):
+        days = options['days']
+        if days is None:
+            days = settings.ASSETS_HISTORY_ARCHIVE_DAYS
+        before = datetime.datetime.now() - datetime.timedelta(days=days)
+        moved = History.objects.archive(
+            before, chunk_size=options['chunk_size'],
+        )
+        self.stdout.write('Archived {} history changes.\n'.format(moved))
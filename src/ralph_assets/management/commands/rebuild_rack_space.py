@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import textwrap
+
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from ralph_assets.models_rack_space import (
+    RACK_SPACE_CHUNK_SIZE,
+    rebuild_all_rack_space,
+    rebuild_rack_space,
+)
+
+
+class Command(BaseCommand):
+    """Rebuild occupancy index of racks."""
+    help = textwrap.dedent(__doc__).strip()
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--chunk-size',
+            type='int',
+            dest='chunk_size',
+            default=RACK_SPACE_CHUNK_SIZE,
+            help="Number of racks processed at once",
+        ),
+        make_option(
+            '--id',
+            type='int',
+            action='append',
+            dest='ids',
+            default=[],
+            help="Rebuild only rack with given id (can be repeated)",
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if options['ids']:
+            rebuilt = rebuild_rack_space(options['ids'])
+        else:
+            rebuilt = rebuild_all_rack_space(chunk_size=options['chunk_size'])
+        self.stdout.write('Rebuilt space of {} racks.\n'.format(rebuilt))
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import textwrap
+
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from ralph_assets.models_assets import Asset
+from ralph_assets.models_search import (
+    SEARCH_DOCUMENT_CHUNK_SIZE,
+    rebuild_asset_counters,
+    rebuild_search_documents,
+)
+
+
+class Command(BaseCommand):
+    """Rebuild denormalized search documents, n-gram index and counters of
+    assets."""
+    help = textwrap.dedent(__doc__).strip()
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--chunk-size',
+            type='int',
+            dest='chunk_size',
+            default=SEARCH_DOCUMENT_CHUNK_SIZE,
+            help="Number of assets processed at once",
+        ),
+        make_option(
+            '--id',
+            type='int',
+            action='append',
+            dest='ids',
+            default=[],
+            help="Rebuild only asset with given id (can be repeated)",
+        ),
+    )
+
+    def handle(self, *args, **options):
+        queryset = Asset.admin_objects.all()
+        if options['ids']:
+            queryset = queryset.filter(pk__in=options['ids'])
+        rebuilt = rebuild_search_documents(
+            queryset, chunk_size=options['chunk_size'],
+        )
+        self.stdout.write('Rebuilt {} search documents.\n'.format(rebuilt))
+        if not options['ids']:
+            rebuild_asset_counters()
+            self.stdout.write('Rebuilt asset counters.\n')
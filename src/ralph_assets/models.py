@@ -6,8 +6,6 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import difflib
-
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 from django.utils.html import escape
@@ -39,6 +37,14 @@ from ralph_assets.licences.models import (
     LicenceType,
     SoftwareCategory,
 )
+from ralph_assets.models_search import (
+    AssetCounter,
+    AssetNgram,
+    AssetSearchDocument,
+    fuzzy_match,
+    ngram_q,
+)
+from ralph_assets.models_rack_space import RackSpace
 from ralph_assets.models_support import Support
 from ralph_assets.models_transition import (
     Action,
@@ -61,8 +67,8 @@ class DeviceLookup(RestrictedLookupChannel):
     def get_query(self, q, request):
         query = Q(
             Q(device_info__gt=0) & Q(
-                Q(barcode__istartswith=q) |
-                Q(sn__istartswith=q) |
+                ngram_q('barcode', 'istartswith', q) |
+                ngram_q('sn', 'istartswith', q) |
                 Q(model__name__icontains=q)
             )
         )
@@ -91,11 +97,13 @@ class LinkedDeviceNameLookup(DeviceLookup):
             'id', flat=True
         ).filter(name__icontains=text)
         query = Q(
-            Q(barcode__icontains=text)
-            | Q(sn__icontains=text)
+            ngram_q('barcode', 'icontains', text)
+            | ngram_q('sn', 'icontains', text)
             | Q(device_info__ralph_device_id__in=matched_devices_ids)
         )
-        return self.get_base_objects().filter(query).order_by()[:10]
+        return self.get_base_objects().filter(
+            query,
+        ).order_by().with_ralph_devices()[:10]
 
     def format_item_display(self, obj):
         item = super(LinkedDeviceNameLookup, self).format_item_display(obj)
@@ -255,8 +263,8 @@ class AssetLookupBase(RestrictedLookupChannel):
 
     def get_query(self, q, request):
         return Asset.objects.filter(
-            Q(barcode__icontains=q) |
-            Q(sn__icontains=q)
+            ngram_q('barcode', 'icontains', q) |
+            ngram_q('sn', 'icontains', q)
         ).order_by('sn', 'barcode')[:10]
 
     def get_result(self, obj):
@@ -271,8 +279,8 @@ class AssetLookup(AssetLookupBase):
     def get_query(self, q, request):
         return Asset.objects.filter(
             Q(model__name__icontains=q) |
-            Q(barcode__icontains=q) |
-            Q(sn__icontains=q)
+            ngram_q('barcode', 'icontains', q) |
+            ngram_q('sn', 'icontains', q)
         ).order_by('sn', 'barcode')[:10]
 
     def format_item_display(self, obj):
@@ -375,33 +383,13 @@ class AssetLookupFuzzy(AssetLookupBase):
         dev_ids = Device.objects.filter(
             model__type=DeviceType.unknown,
         ).values_list('id', flat=True)
-        assets = Asset.objects.select_related(
-            'model__name',
-        ).filter(
+        assets = Asset.objects.filter(
             Q(device_info__ralph_device_id=None) |
             Q(device_info__ralph_device_id__in=dev_ids),
         ).filter(part_info=None)
-
-        def comparator(asset):
-            seq = "".join(
-                [part or '' for part in
-                    [
-                        asset.sn,
-                        asset.barcode,
-                        asset.model.name,
-                    ]]
-            ).replace(" ", "").lower()
-            ratio = difflib.SequenceMatcher(
-                None,
-                seq,
-                query.replace(" ", "").lower(),
-            ).ratio()
-            if ratio:
-                return 1 / ratio
-            return 999
-
-        assets = sorted(assets, key=comparator)
-        return assets[:10]
+        ids = fuzzy_match(assets, query)
+        found = Asset.objects.select_related('model').in_bulk(ids)
+        return [found[asset_id] for asset_id in ids]
 
     def format_match(self, obj):
         ret = obj.__unicode__()
@@ -459,9 +447,12 @@ __all__ = [
     'Asset',
     'AssetCategory',
     'AssetCategoryType',
+    'AssetCounter',
     'AssetManufacturer',
     'AssetModel',
+    'AssetNgram',
     'AssetOwner',
+    'AssetSearchDocument',
     'AssetSource',
     'AssetStatus',
     'AssetType',
@@ -477,6 +468,7 @@ __all__ = [
     'OfficeInfo',
     'Orientation',
     'PartInfo',
+    'RackSpace',
     'ReportOdtSource',
     'ReportOdtSourceLanguage',
     'Service',
@@ -9,6 +9,7 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import datetime
+import itertools
 import logging
 import os
 
@@ -33,8 +34,9 @@ from uuid import uuid4
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
-from django.core.urlresolvers import reverse
+from django.core.urlresolvers import get_script_prefix, reverse
 from django.db import models
+from django.db.models.query import QuerySet
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
 from django.template import Context, Template
@@ -47,6 +49,7 @@ from ralph.discovery.models_device import (
     DeviceType,
     ServiceCatalog,
 )
+from ralph.discovery.models_component import Processor
 from ralph.discovery.models_util import SavingUser
 from ralph_assets.history.models import HistoryMixin
 from ralph_assets.history.utils import field_changes
@@ -166,6 +169,18 @@ MODE2ASSET_TYPE = {
 
 
 ASSET_TYPE2MODE = {v: k for k, v in MODE2ASSET_TYPE.items()}
+_device_url_templates = {}
+
+
+def get_device_url(mode, asset_id):
+    """Returns url of the edit page of asset *asset_id*. The url is resolved
+    once per *mode* (and script prefix) and formatted for next assets."""
+    key = (get_script_prefix(), mode)
+    if key not in _device_url_templates:
+        url = reverse('device_edit', kwargs={'mode': mode, 'asset_id': 0})
+        index = url.rindex('0')
+        _device_url_templates[key] = url[:index] + '{}' + url[index + 1:]
+    return _device_url_templates[key].format(asset_id)
 
 
 class AssetPurpose(Choices):
@@ -331,21 +346,134 @@ def _get_file_path(instance, filename):
     return os.path.join('assets', filename)
 
 
-class BOAdminManager(models.Manager):
+RALPH_DEVICES_BATCH_SIZE = 500
+
+
+def is_deprecated_on(effective_deprecation_end_date, date):
+    """Returns True if asset with *effective_deprecation_end_date* is
+    deprecated on *date*."""
+    return (
+        effective_deprecation_end_date is None or
+        effective_deprecation_end_date < date
+    )
+
+
+def get_deprecated_q(date):
+    """Returns filter of assets deprecated on *date*."""
+    return (
+        models.Q(effective_deprecation_end_date=None) |
+        models.Q(effective_deprecation_end_date__lt=date)
+    )
+
+
+def split_by_deprecation(effective_deprecation_end_date, start, end):
+    """Returns (first day, last day, deprecated) tuples covering days from
+    *start* to *end* (both included) for asset with
+    *effective_deprecation_end_date*."""
+    if is_deprecated_on(effective_deprecation_end_date, start):
+        return [(start, end, True)]
+    if effective_deprecation_end_date >= end:
+        return [(start, end, False)]
+    return [
+        (start, effective_deprecation_end_date, False),
+        (
+            effective_deprecation_end_date + datetime.timedelta(days=1),
+            end,
+            True,
+        ),
+    ]
+
+
+def get_deprecation_intervals(assets, start, end):
+    """Yields (asset id, intervals) for *assets* (queryset) in one pass.
+
+    Intervals are (first day, last day, deprecated) tuples covering days from
+    *start* to *end* (both included), so a cost feed can bill the whole range
+    without asking about every day.
+    """
+    for asset_id, end_date in assets.values_list(
+        'id', 'effective_deprecation_end_date',
+    ).order_by('id').iterator():
+        yield asset_id, split_by_deprecation(end_date, start, end)
+
+
+class AssetQuerySet(QuerySet):
+    """Query set of assets which can load linked Ralph devices in bulk."""
+
+    _with_ralph_devices = False
+
+    def with_ralph_devices(self):
+        """Assets are fetched in batches and Ralph devices linked to each
+        batch are loaded (with model and venture) in one query, so
+        ``get_ralph_device``, ``linked_device``, ``venture`` etc. don't hit
+        the database."""
+        return self._clone(_with_ralph_devices=True)
+
+    def deprecated(self, date):
+        """Assets deprecated on *date* (uses the indexed effective
+        deprecation end date)."""
+        return self.filter(get_deprecated_q(date))
+
+    def not_deprecated(self, date):
+        return self.filter(effective_deprecation_end_date__gte=date)
+
+    def _clone(self, klass=None, setup=False, **kwargs):
+        kwargs.setdefault('_with_ralph_devices', self._with_ralph_devices)
+        return super(AssetQuerySet, self)._clone(klass, setup, **kwargs)
+
+    def iterator(self):
+        iterator = super(AssetQuerySet, self).iterator()
+        if not self._with_ralph_devices:
+            return iterator
+        return self._iter_with_ralph_devices(iterator)
+
+    def _iter_with_ralph_devices(self, iterator):
+        while True:
+            batch = list(itertools.islice(iterator, RALPH_DEVICES_BATCH_SIZE))
+            if not batch:
+                return
+            attach_ralph_devices(batch)
+            for asset in batch:
+                yield asset
+
+
+class AssetQuerySetManager(models.Manager):
+    """Base manager of assets, returns ``AssetQuerySet``."""
+
+    def get_query_set(self):
+        return super(AssetQuerySetManager, self).get_query_set()._clone(
+            klass=AssetQuerySet,
+        )
+
+    def with_ralph_devices(self):
+        return self.get_query_set().with_ralph_devices()
+
+    def deprecated(self, date):
+        return self.get_query_set().deprecated(date)
+
+    def not_deprecated(self, date):
+        return self.get_query_set().not_deprecated(date)
+
+
+class BOAdminManager(AssetQuerySetManager):
     def get_query_set(self):
         return super(BOAdminManager, self).get_query_set().filter(
             type__in=(AssetType.BO.choices)
         )
 
 
-class DCAdminManager(models.Manager):
+class DCAdminManager(AssetQuerySetManager):
     def get_query_set(self):
         return super(DCAdminManager, self).get_query_set().filter(
             type__in=(AssetType.DC.choices)
         )
 
 
-class AssetAdminManager(models.Manager):
+class AssetAdminManager(AssetQuerySetManager):
+    pass
+
+
+class AssetManager(AssetQuerySetManager, RegionalizedDBManager):
     pass
 
 
@@ -520,6 +648,11 @@ class Asset(
         'Check if you no longer want to bill for this asset'
     ))
     deprecation_end_date = models.DateField(null=True, blank=True)
+    # last day the asset isn't deprecated, empty when it's always deprecated
+    # (kept by ``save``, see ``get_effective_deprecation_end_date``)
+    effective_deprecation_end_date = models.DateField(
+        null=True, blank=True, db_index=True, editable=False,
+    )
     production_year = models.PositiveSmallIntegerField(null=True, blank=True)
     slots = models.FloatField(
         verbose_name='Slots',
@@ -529,6 +662,7 @@ class Asset(
         default=0,
     )
     service_name = models.ForeignKey(Service, null=True, blank=True)
+    objects = AssetManager()
     admin_objects = AssetAdminManager()
     admin_objects_dc = DCAdminManager()
     admin_objects_bo = BOAdminManager()
@@ -617,13 +751,8 @@ class Asset(
         asset_cores_count = self.model.cores_count if self.model else 0
         if settings.SHOW_RALPH_CORES_DIFF:
             device_cores_count = None
-            try:
-                if self.device_info and self.device_info.ralph_device_id:
-                    device_cores_count = Device.objects.get(
-                        pk=self.device_info.ralph_device_id,
-                    ).get_core_count()
-            except Device.DoesNotExist:
-                pass
+            if self.device_info:
+                device_cores_count = self.device_info.get_ralph_core_count()
             if (device_cores_count is not None and
                asset_cores_count != device_cores_count):
                 logger.warning(
@@ -671,14 +800,9 @@ class Asset(
                     self.generate_hostname(commit, template_vars)
 
     def get_ralph_device(self):
-        if not self.device_info or not self.device_info.ralph_device_id:
-            return None
-        try:
-            return Device.objects.get(
-                pk=self.device_info.ralph_device_id,
-            )
-        except Device.DoesNotExist:
+        if not self.device_info:
             return None
+        return self.device_info.get_ralph_device()
 
     def get_synced_objs_and_fields(self):
         # Implementation of the abstract method from SyncFieldMixin.
@@ -728,6 +852,9 @@ class Asset(
     def save(self, commit=True, force_unlink=False, *args, **kwargs):
         _replace_empty_with_none(self, ['source', 'hostname'])
         self.handle_device_linkage(force_unlink)
+        self.effective_deprecation_end_date = (
+            self.get_effective_deprecation_end_date()
+        )
         return super(Asset, self).save(commit=commit, *args, **kwargs)
 
     def get_data_icon(self):
@@ -802,17 +929,22 @@ class Asset(
             if self.deprecation_rate else 0
         )
 
-    def is_deprecated(self, date=None):
-        date = date or datetime.date.today()
+    def get_effective_deprecation_end_date(self):
+        """Returns the last day the asset isn't deprecated or None if it's
+        always deprecated (forced or without invoice date)."""
         if self.force_deprecation or not self.invoice_date:
-            return True
+            return None
         if self.deprecation_end_date:
-            deprecation_date = self.deprecation_end_date
-        else:
-            deprecation_date = self.invoice_date + relativedelta(
-                months=self.get_deprecation_months(),
-            )
-        return deprecation_date < date
+            return self.deprecation_end_date
+        return self.invoice_date + relativedelta(
+            months=self.get_deprecation_months(),
+        )
+
+    def is_deprecated(self, date=None):
+        return is_deprecated_on(
+            self.get_effective_deprecation_end_date(),
+            date or datetime.date.today(),
+        )
 
     def delete_with_info(self, *args, **kwargs):
         """
@@ -831,7 +963,7 @@ class Asset(
     def is_discovered(self):
         if self.part_info:
             if self.part_info.device:
-                return self.part_info.device.is_discovered()
+                return self.part_info.device.is_discovered
             return False
         try:
             dev = self.device_info.get_ralph_device()
@@ -844,10 +976,7 @@ class Asset(
 
     @property
     def url(self):
-        return reverse('device_edit', kwargs={
-            'mode': ASSET_TYPE2MODE[self.type],
-            'asset_id': self.id,
-        })
+        return get_device_url(ASSET_TYPE2MODE[self.type], self.id)
 
     @property
     def country_code(self):
@@ -876,7 +1005,14 @@ class Asset(
     def asset_type(self):
         return self.type
 
+    def cache_related_assets(self, assets):
+        """Caches *assets* (loaded in bulk) as assets mounted at the same
+        position of the rack."""
+        self._related_assets_cache = assets
+
     def get_related_assets(self):
+        if hasattr(self, '_related_assets_cache'):
+            return self._related_assets_cache
         return Asset.objects.filter(
             device_info__position=self.device_info.position,
             device_info__rack=self.device_info.rack,
@@ -972,6 +1108,52 @@ class ReportOdtSourceLanguage(SavingUser, TimeTrackable):
         return self.report_odt_source.slug
 
 
+def attach_ralph_devices(assets):
+    """Loads device infos (if not loaded yet) and Ralph devices linked to
+    *assets* in bulk and caches them on the assets."""
+    cache_name = Asset._meta.get_field('device_info').get_cache_name()
+    missing_ids = set(
+        asset.device_info_id for asset in assets
+        if asset.device_info_id and not hasattr(asset, cache_name)
+    )
+    if missing_ids:
+        device_infos = DeviceInfo._base_manager.in_bulk(missing_ids)
+        for asset in assets:
+            if asset.device_info_id in device_infos:
+                setattr(
+                    asset, cache_name, device_infos[asset.device_info_id],
+                )
+    device_infos = [
+        asset.device_info for asset in assets if asset.device_info_id
+    ]
+    devices = Device.objects.select_related('model', 'venture').in_bulk(set(
+        info.ralph_device_id for info in device_infos if info.ralph_device_id
+    ))
+    for info in device_infos:
+        info.cache_ralph_device(devices.get(info.ralph_device_id))
+
+
+def attach_ralph_core_counts(assets):
+    """Loads cores counts of Ralph devices linked to *assets* (processors in
+    one query) and caches them on device infos of the assets.
+
+    Ralph devices have to be attached already (see ``attach_ralph_devices``).
+    """
+    device_infos = [
+        asset.device_info for asset in assets
+        if asset.device_info_id and asset.device_info.get_ralph_device()
+    ]
+    core_counts = dict.fromkeys(
+        (info.ralph_device_id for info in device_infos), 0,
+    )
+    for processor in Processor.objects.filter(
+        device__in=core_counts.keys(),
+    ).select_related('model'):
+        core_counts[processor.device_id] += processor.get_cores()
+    for info in device_infos:
+        info.cache_ralph_core_count(core_counts[info.ralph_device_id])
+
+
 @receiver(pre_save, sender=Asset, dispatch_uid='ralph_assets.views.device')
 def device_hostname_assigning(sender, instance, raw, using, **kwargs):
     """A hook for assigning ``hostname`` value when an asset is edited."""
@@ -5,6 +5,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import itertools
 import logging
 import re
 
@@ -18,7 +19,7 @@ from lck.django.common.models import (
 )
 
 from django.db import models
-from django.db.models import Sum
+from django.db.models import Count, Sum
 from django.db.models.signals import post_save, post_delete
 from django.db.utils import DatabaseError
 from django.dispatch import receiver
@@ -138,12 +139,79 @@ class Accessory(Named):
         verbose_name_plural = _('accessories')
 
 
+FREE_U_BATCH_SIZE = 500
+
+
+def attach_free_u(racks):
+    """Sets ``free_u`` of *racks* using two queries grouped by rack: the
+    height of root assets and the number of positions taken by
+    accessories."""
+    from ralph_assets.models_assets import Asset
+    racks = [rack for rack in racks if rack.pk]
+    if not racks:
+        return
+    rack_ids = [rack.pk for rack in racks]
+    heights = dict(
+        Asset.objects.filter(
+            device_info__rack__in=rack_ids,
+            device_info__slot_no='',
+        ).exclude(
+            model__category__is_blade=True,
+        ).values_list('device_info__rack').annotate(
+            height=Sum('model__height_of_device'),
+        ).order_by()
+    )
+    # accesory always has 1U of height
+    accessories = dict(
+        RackAccessory.objects.filter(
+            rack__in=rack_ids,
+        ).values_list('rack').annotate(
+            positions=Count('position', distinct=True),
+        ).order_by()
+    )
+    for rack in racks:
+        rack.free_u = (
+            rack.max_u_height - (heights.get(rack.pk) or 0) -
+            accessories.get(rack.pk, 0)
+        )
+
+
+class RackQuerySet(models.query.QuerySet):
+    """Query set of racks which can compute free U of racks in bulk."""
+
+    _with_free_u = False
+
+    def with_free_u(self):
+        """Racks are fetched in batches and ``free_u`` of each batch is
+        computed by ``attach_free_u``."""
+        return self._clone(_with_free_u=True)
+
+    def _clone(self, klass=None, setup=False, **kwargs):
+        kwargs.setdefault('_with_free_u', self._with_free_u)
+        return super(RackQuerySet, self)._clone(klass, setup, **kwargs)
+
+    def iterator(self):
+        iterator = super(RackQuerySet, self).iterator()
+        if not self._with_free_u:
+            return iterator
+        return self._iter_with_free_u(iterator)
+
+    def _iter_with_free_u(self, iterator):
+        while True:
+            batch = list(itertools.islice(iterator, FREE_U_BATCH_SIZE))
+            if not batch:
+                return
+            attach_free_u(batch)
+            for rack in batch:
+                yield rack
+
+
 class RackManager(models.Manager):
+    def get_query_set(self):
+        return RackQuerySet(self.model, using=self._db)
+
     def with_free_u(self):
-        racks = self.get_query_set()
-        for rack in racks:
-            rack.free_u = rack.get_free_u()
-        return racks
+        return self.get_query_set().with_free_u()
 
 
 class Rack(Named.NonUnique):
@@ -180,13 +248,12 @@ class Rack(Named.NonUnique):
     objects = RackManager()
 
     def get_free_u(self):
-        assets = self.get_root_assets()
-        assets_height = assets.aggregate(
-            sum=Sum('model__height_of_device'))['sum'] or 0
-        # accesory always has 1U of height
-        accessories = RackAccessory.objects.values_list(
-            'position', flat=True).filter(rack=self)
-        return self.max_u_height - assets_height - len(set(accessories))
+        """Returns free U of the rack. Racks fetched ``with_free_u`` have it
+        computed already."""
+        if 'free_u' in self.__dict__:
+            return self.free_u
+        attach_free_u([self])
+        return self.__dict__.pop('free_u', self.max_u_height)
 
     def get_orientation_desc(self):
         return RackOrientation.name_from_id(self.orientation)
@@ -328,15 +395,40 @@ class DeviceInfo(TimeTrackable, SavingUser, SoftDeletable):
             self.size,
         )
 
+    def cache_ralph_device(self, device):
+        """Caches *device* (loaded in bulk) as the linked Ralph device."""
+        self._ralph_device_cache = (self.ralph_device_id, device)
+
     def get_ralph_device(self):
         if not self.ralph_device_id:
             return None
+        cached_id, device = getattr(
+            self, '_ralph_device_cache', (None, None),
+        )
+        if cached_id == self.ralph_device_id:
+            return device
         try:
             dev = Device.objects.get(id=self.ralph_device_id)
             return dev
         except Device.DoesNotExist:
             return None
 
+    def cache_ralph_core_count(self, core_count):
+        """Caches *core_count* (loaded in bulk) of the linked Ralph device."""
+        self._ralph_core_count_cache = (self.ralph_device_id, core_count)
+
+    def get_ralph_core_count(self):
+        """Returns cores count of the linked Ralph device or None."""
+        if not self.ralph_device_id:
+            return None
+        cached_id, core_count = getattr(
+            self, '_ralph_core_count_cache', (None, None),
+        )
+        if cached_id == self.ralph_device_id:
+            return core_count
+        device = self.get_ralph_device()
+        return device.get_core_count() if device else None
+
     def get_orientation_desc(self):
         return Orientation.name_from_id(self.orientation)
 
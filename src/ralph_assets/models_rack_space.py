@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+
+"""Occupancy index of racks.
+
+``RackSpace`` keeps a bitmap of taken units (one character per U, ``1`` if
+taken) for the front and the back of each rack, built from positions and
+heights of mounted assets and positions of accessories. Size of the largest
+contiguous free block, number of free blocks and fragmentation are stored
+next to it, so racks able to hold a device of given height are found by one
+query on the index instead of scanning assets.
+
+The index is rebuilt per rack whenever something mounted in the rack changes.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import math
+from collections import defaultdict
+
+from django.db import models
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from lck.django.common import nested_commit_on_success
+
+from ralph_assets.models_assets import (
+    Asset,
+    AssetCategory,
+    AssetModel,
+    DeviceInfo,
+    Orientation,
+    Rack,
+)
+from ralph_assets.models_dc_assets import RackAccessory
+
+
+RACK_SPACE_CHUNK_SIZE = 200
+# sides of a rack indexed separately, devices mounted in the middle take
+# units on both of them
+RACK_SPACE_SIDES = (Orientation.front.id, Orientation.back.id)
+TAKEN, FREE = '1', '0'
+
+
+class RackSpace(models.Model):
+    """Taken units of one side of a rack."""
+    rack = models.ForeignKey(
+        Rack, related_name='space', on_delete=models.CASCADE,
+    )
+    orientation = models.PositiveIntegerField(choices=Orientation())
+    occupied = models.TextField(default='')
+    free_u = models.PositiveIntegerField(default=0)
+    largest_free_block = models.PositiveIntegerField(default=0, db_index=True)
+    free_blocks = models.PositiveIntegerField(default=0)
+    fragmentation = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('rack', 'orientation')
+
+    def __unicode__(self):
+        return '{} of rack #{}: {} U free'.format(
+            Orientation.name_from_id(self.orientation), self.rack_id,
+            self.free_u,
+        )
+
+    def get_orientation_desc(self):
+        return Orientation.name_from_id(self.orientation)
+
+    def get_free_blocks(self, height=1):
+        """Returns (first position, size) of free blocks having at least
+        *height* units."""
+        return [
+            block for block in get_free_blocks(self.occupied)
+            if block[1] >= height
+        ]
+
+
+def get_free_blocks(occupied):
+    """Returns (first position, size) of contiguous free blocks of
+    *occupied* bitmap, positions start from 1."""
+    blocks = []
+    start = None
+    for index, unit in enumerate(occupied + TAKEN):
+        if unit == FREE and start is None:
+            start = index
+        elif unit != FREE and start is not None:
+            blocks.append((start + 1, index - start))
+            start = None
+    return blocks
+
+
+def get_space_values(occupied):
+    """Returns values of ``RackSpace`` summarizing *occupied* bitmap.
+
+    Fragmentation is the part of free units lying outside of the largest
+    free block: 0 when all free units are contiguous, close to 1 when they
+    are scattered.
+    """
+    sizes = [size for _, size in get_free_blocks(occupied)]
+    free_u = sum(sizes)
+    largest = max(sizes) if sizes else 0
+    return {
+        'occupied': occupied,
+        'free_u': free_u,
+        'largest_free_block': largest,
+        'free_blocks': len(sizes),
+        'fragmentation': 1 - largest / free_u if free_u else 0,
+    }
+
+
+def get_sides(orientation):
+    if orientation == Orientation.middle.id:
+        return RACK_SPACE_SIDES
+    if orientation in RACK_SPACE_SIDES:
+        return (orientation,)
+    # mounted on the side of the rack (left or right)
+    return ()
+
+
+def get_mounted(rack_ids):
+    """Returns (rack id, orientation, position, height) of assets and
+    accessories mounted in racks *rack_ids* (two queries)."""
+    assets = Asset.admin_objects.filter(
+        device_info__rack__in=rack_ids,
+        device_info__slot_no='',
+        device_info__position__gt=0,
+    ).exclude(
+        model__category__is_blade=True,
+    ).values_list(
+        'device_info__rack', 'device_info__orientation',
+        'device_info__position', 'model__height_of_device',
+    )
+    for rack_id, orientation, position, height in assets:
+        yield rack_id, orientation, position, max(
+            int(math.ceil(height or 0)), 1,
+        )
+    # accesory always has 1U of height
+    accessories = RackAccessory.objects.filter(
+        rack__in=rack_ids, position__gt=0,
+    ).values_list('rack', 'orientation', 'position')
+    for rack_id, orientation, position in accessories:
+        yield rack_id, orientation, position, 1
+
+
+def get_occupancy(racks):
+    """Returns bitmaps of taken units of *racks* by (rack id, side)."""
+    units = defaultdict(set)
+    for rack_id, orientation, position, height in get_mounted(
+        [rack.id for rack in racks],
+    ):
+        for side in get_sides(orientation):
+            units[rack_id, side].update(range(position, position + height))
+    return {
+        (rack.id, side): ''.join(
+            TAKEN if position in units[rack.id, side] else FREE
+            for position in range(1, rack.max_u_height + 1)
+        ) for rack in racks for side in RACK_SPACE_SIDES
+    }
+
+
+@nested_commit_on_success
+def rebuild_rack_space(rack_ids):
+    """Rebuilds ``RackSpace`` of racks *rack_ids*.
+
+    Rows of the racks are locked (in pk order, to avoid deadlocks) for the
+    rest of the transaction, so concurrent rebuilds of the same rack wait
+    for each other instead of colliding on insert.
+    """
+    rack_ids = set(filter(None, rack_ids))
+    if not rack_ids:
+        return 0
+    racks = list(Rack.objects.select_for_update().filter(
+        pk__in=rack_ids,
+    ).only('id', 'max_u_height').order_by('pk'))
+    occupancy = get_occupancy(racks)
+    RackSpace.objects.filter(rack__in=rack_ids).delete()
+    RackSpace.objects.bulk_create([
+        RackSpace(
+            rack_id=rack_id, orientation=side, **get_space_values(occupied)
+        ) for (rack_id, side), occupied in occupancy.iteritems()
+    ])
+    return len(racks)
+
+
+def rebuild_all_rack_space(chunk_size=RACK_SPACE_CHUNK_SIZE):
+    """Rebuilds ``RackSpace`` of all racks, *chunk_size* racks at once."""
+    rack_ids = list(Rack.objects.values_list('id', flat=True).order_by('id'))
+    rebuilt = 0
+    for start in xrange(0, len(rack_ids), chunk_size):
+        rebuilt += rebuild_rack_space(rack_ids[start:start + chunk_size])
+    return rebuilt
+
+
+def find_free_space(height, racks=None, orientation=None):
+    """Returns ``RackSpace`` of *racks* (all by default) having a contiguous
+    free block of at least *height* units, the least fragmented first."""
+    spaces = RackSpace.objects.select_related(
+        'rack__data_center', 'rack__server_room',
+    ).filter(largest_free_block__gte=height)
+    if racks is not None:
+        spaces = spaces.filter(rack__in=racks)
+    if orientation is not None:
+        spaces = spaces.filter(orientation=orientation)
+    return spaces.order_by(
+        'fragmentation', 'largest_free_block', 'rack', 'orientation',
+    )
+
+
+@receiver(
+    post_save, sender=DeviceInfo, dispatch_uid='assets.rack_space.device_info',
+)
+def device_info_post_save(sender, instance, raw=False, created=False,
+                          **kwargs):
+    if raw:
+        return
+    # field state isn't updated yet, so dirty fields are the saved ones
+    dirty_fields = instance.dirty_fields
+    if not created and not any(field in dirty_fields for field in (
+        'rack_id', 'slot_no', 'position', 'orientation',
+    )):
+        return
+    rebuild_rack_space([instance.rack_id, dirty_fields.get('rack_id')])
+
+
+@receiver(
+    post_delete, sender=DeviceInfo,
+    dispatch_uid='assets.rack_space.device_info_delete',
+)
+def device_info_post_delete(sender, instance, **kwargs):
+    rebuild_rack_space([instance.rack_id])
+
+
+@receiver(post_save, sender=Asset, dispatch_uid='assets.rack_space.asset')
+def asset_post_save(sender, instance, raw=False, created=False, **kwargs):
+    if raw or not instance.device_info_id:
+        return
+    dirty_fields = instance.dirty_fields
+    if created or any(
+        field in dirty_fields for field in ('model_id', 'device_info_id')
+    ):
+        rebuild_rack_space(DeviceInfo.objects.filter(pk__in=[
+            instance.device_info_id, dirty_fields.get('device_info_id'),
+        ]).values_list('rack', flat=True))
+
+
+@receiver(
+    post_delete, sender=Asset, dispatch_uid='assets.rack_space.asset_delete',
+)
+def asset_post_delete(sender, instance, **kwargs):
+    if not instance.device_info_id:
+        return
+    rebuild_rack_space(DeviceInfo.objects.filter(
+        pk=instance.device_info_id,
+    ).values_list('rack', flat=True))
+
+
+@receiver(
+    post_save, sender=AssetModel, dispatch_uid='assets.rack_space.asset_model',
+)
+def asset_model_post_save(sender, instance, raw=False, **kwargs):
+    if raw or not any(
+        field in instance.dirty_fields
+        for field in ('height_of_device', 'category_id')
+    ):
+        return
+    rebuild_rack_space(DeviceInfo.objects.filter(
+        asset__model=instance,
+    ).values_list('rack', flat=True).distinct())
+
+
+@receiver(
+    post_save, sender=AssetCategory, dispatch_uid='assets.rack_space.category',
+)
+def category_post_save(sender, instance, raw=False, **kwargs):
+    if raw or 'is_blade' not in instance.dirty_fields:
+        return
+    rebuild_rack_space(DeviceInfo.objects.filter(
+        asset__model__category=instance,
+    ).values_list('rack', flat=True).distinct())
+
+
+@receiver(pre_save, sender=RackAccessory, dispatch_uid='assets.rack_space.acc')
+def accessory_pre_save(sender, instance, raw=False, **kwargs):
+    # accessories don't track their field state, previous rack has to be
+    # rebuilt too if the accessory is moved
+    instance._rack_space_previous_rack = None
+    if not raw and instance.pk:
+        instance._rack_space_previous_rack = (list(
+            RackAccessory.objects.filter(
+                pk=instance.pk,
+            ).values_list('rack', flat=True)
+        ) or [None])[0]
+
+
+@receiver(
+    post_save, sender=RackAccessory,
+    dispatch_uid='assets.rack_space.accessory',
+)
+def accessory_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    rebuild_rack_space([
+        instance.rack_id,
+        getattr(instance, '_rack_space_previous_rack', None),
+    ])
+
+
+@receiver(
+    post_delete, sender=RackAccessory,
+    dispatch_uid='assets.rack_space.accessory_delete',
+)
+def accessory_post_delete(sender, instance, **kwargs):
+    rebuild_rack_space([instance.rack_id])
+
+
+@receiver(post_save, sender=Rack, dispatch_uid='assets.rack_space.rack')
+def rack_post_save(sender, instance, raw=False, created=False, **kwargs):
+    if raw:
+        return
+    # racks don't track their field state, space is rebuilt when the height
+    # of the rack doesn't match the index
+    spaces = [] if created else list(instance.space.all())
+    if len(spaces) != len(RACK_SPACE_SIDES) or any(
+        len(space.occupied) != instance.max_u_height for space in spaces
+    ):
+        rebuild_rack_space([instance.pk])
@@ -0,0 +1,638 @@
+# -*- coding: utf-8 -*-
+
+"""Denormalized search documents for assets.
+
+Searching assets by model, manufacturer, owner profile, location etc. joins
+a lot of tables. ``AssetSearchDocument`` keeps a flattened, lower-cased copy
+of these fields (one row per asset), so the search runs against one table.
+
+Substring searches on identifiers (sn, barcode, hostname, niw) are narrowed
+with ``AssetNgram`` - an n-gram index of these fields. The same index keeps
+n-grams of the fuzzy signature (sn, barcode and model name) of assets, which
+narrows fuzzy matching to assets sharing n-grams with the searched text.
+
+``AssetCounter`` keeps the number of assets per type and region, so an
+unfiltered search doesn't have to count the whole table.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import difflib
+import heapq
+import itertools
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from lck.django.common import nested_commit_on_success
+from ralph.account.models import Profile, Region
+from ralph.cmdb.models import CI
+from ralph.discovery.models_device import DeviceEnvironment, ServiceCatalog
+
+from ralph_assets.models_assets import (
+    Asset,
+    AssetCategory,
+    AssetManufacturer,
+    AssetModel,
+    AssetType,
+    BudgetInfo,
+    DataCenter,
+    DeviceInfo,
+    OfficeInfo,
+    Rack,
+    ServerRoom,
+)
+
+
+SEARCH_DOCUMENT_CHUNK_SIZE = 500
+SEARCH_DOCUMENT_RELATED = (
+    'budget_info',
+    'device_environment',
+    'device_info__data_center',
+    'device_info__rack__data_center',
+    'device_info__rack__server_room',
+    'device_info__server_room',
+    'model__category',
+    'model__manufacturer',
+    'office_info',
+    'owner',
+    'service',
+)
+PROFILE_FIELDS = (
+    'company',
+    'cost_center',
+    'department',
+    'employee_id',
+    'profit_center',
+    'segment',
+)
+NGRAM_SIZE = 3
+NGRAM_FIELDS = ('sn', 'barcode', 'hostname', 'niw')
+NGRAM_MAX_CANDIDATES = 5000
+FUZZY_FIELD = 'fuzzy'
+FUZZY_MAX_CANDIDATES = 200
+
+
+def normalize(value):
+    """Returns *value* in the form kept in search documents."""
+    if value is None:
+        return ''
+    return unicode(value).strip().lower()
+
+
+class AssetSearchDocument(models.Model):
+    """Flattened, lower-cased searchable fields of a single asset."""
+    asset = models.OneToOneField(
+        Asset,
+        primary_key=True,
+        related_name='search_document',
+        on_delete=models.CASCADE,
+    )
+    sn = models.CharField(max_length=200, blank=True, default='')
+    barcode = models.CharField(max_length=200, blank=True, default='')
+    hostname = models.CharField(max_length=16, blank=True, default='')
+    niw = models.CharField(max_length=200, blank=True, default='')
+    model = models.CharField(max_length=75, blank=True, default='')
+    manufacturer = models.CharField(max_length=75, blank=True, default='')
+    category = models.CharField(max_length=50, blank=True, default='')
+    category_slug = models.SlugField(
+        max_length=100, blank=True, default='', db_index=True,
+    )
+    employee_id = models.CharField(
+        max_length=64, blank=True, default='', db_index=True,
+    )
+    company = models.CharField(max_length=64, blank=True, default='')
+    segment = models.CharField(max_length=256, blank=True, default='')
+    profit_center = models.CharField(max_length=1024, blank=True, default='')
+    cost_center = models.CharField(max_length=1024, blank=True, default='')
+    department = models.CharField(max_length=64, blank=True, default='')
+    data_center = models.CharField(
+        max_length=75, blank=True, default='', db_index=True,
+    )
+    server_room = models.CharField(
+        max_length=75, blank=True, default='', db_index=True,
+    )
+    rack = models.CharField(
+        max_length=75, blank=True, default='', db_index=True,
+    )
+    imei = models.CharField(max_length=18, blank=True, default='')
+    service = models.CharField(max_length=256, blank=True, default='')
+    environment = models.CharField(max_length=256, blank=True, default='')
+    budget_info = models.CharField(max_length=255, blank=True, default='')
+
+    def __unicode__(self):
+        return 'Search document of asset #{}'.format(self.asset_id)
+
+
+class AssetNgram(models.Model):
+    """Single n-gram of an identifier field of an asset."""
+    asset = models.ForeignKey(
+        Asset, related_name='ngrams', on_delete=models.CASCADE,
+    )
+    field = models.CharField(max_length=16)
+    gram = models.CharField(max_length=NGRAM_SIZE)
+
+    class Meta:
+        unique_together = ('gram', 'field', 'asset')
+
+    def __unicode__(self):
+        return '{} of {} (asset #{})'.format(
+            self.gram, self.field, self.asset_id,
+        )
+
+
+class AssetCounter(models.Model):
+    """Number of assets of one type in one region."""
+    type = models.PositiveSmallIntegerField(choices=AssetType())
+    region = models.ForeignKey(Region, on_delete=models.CASCADE)
+    deleted = models.BooleanField(default=False)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('type', 'region', 'deleted')
+
+    def __unicode__(self):
+        return '{} assets of type {} in region #{}{}'.format(
+            self.count, self.type, self.region_id,
+            ' (deleted)' if self.deleted else '',
+        )
+
+
+def get_ngrams(value, size=NGRAM_SIZE):
+    """Returns set of n-grams of normalized *value*."""
+    value = normalize(value)
+    return set(value[i:i + size] for i in xrange(len(value) - size + 1))
+
+
+def get_fuzzy_signature(*parts):
+    return ''.join(part or '' for part in parts).replace(' ', '').lower()
+
+
+def get_asset_ngrams(asset, fields=NGRAM_FIELDS):
+    for field in fields:
+        for gram in get_ngrams(getattr(asset, field)):
+            yield AssetNgram(asset_id=asset.id, field=field, gram=gram)
+    if asset.part_info_id:
+        # parts are never matched fuzzily
+        return
+    signature = get_fuzzy_signature(asset.sn, asset.barcode, asset.model.name)
+    for gram in get_ngrams(signature):
+        yield AssetNgram(asset_id=asset.id, field=FUZZY_FIELD, gram=gram)
+
+
+def ngram_candidates(field, term):
+    """Returns ids of assets which *field* contains all n-grams of *term*.
+
+    Returns None when the index can't help - *term* is shorter than
+    ``NGRAM_SIZE`` or it matches more than ``NGRAM_MAX_CANDIDATES`` assets.
+    Candidates have to be verified with the original lookup.
+    """
+    grams = get_ngrams(term)
+    if not grams:
+        return None
+    rows = AssetNgram.objects.filter(
+        field=field, gram__in=grams,
+    ).values('asset').annotate(
+        matched=Count('gram'),
+    ).filter(matched=len(grams))
+    candidates = [row['asset'] for row in rows[:NGRAM_MAX_CANDIDATES + 1]]
+    if len(candidates) > NGRAM_MAX_CANDIDATES:
+        return None
+    return candidates
+
+
+def ngram_q(field, lookup, term):
+    """Returns Q for substring *lookup* (like ``icontains``) of *term* on
+    asset *field*, narrowed to candidates found in the n-gram index."""
+    query = Q(**{'{}__{}'.format(field, lookup): term})
+    candidates = ngram_candidates(field, term)
+    if candidates is not None:
+        query &= Q(pk__in=candidates)
+    return query
+
+
+def change_asset_counter(type, region_id, deleted, delta):
+    counters = AssetCounter.objects.filter(
+        type=type, region_id=region_id, deleted=deleted,
+    )
+    if counters.update(count=F('count') + delta):
+        return
+    # the first asset of the type in the region, the counter may be created
+    # concurrently by another save
+    sid = transaction.savepoint()
+    try:
+        AssetCounter.objects.create(
+            type=type, region_id=region_id, deleted=deleted, count=delta,
+        )
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+        counters.update(count=F('count') + delta)
+    else:
+        transaction.savepoint_commit(sid)
+
+
+def approximate_count(types, regions, include_deleted=False):
+    """Returns number of assets of *types* in *regions* read from counters.
+
+    Counters follow saves and deletes of single assets, but bulk updates
+    bypass them - the result may be off until ``rebuild_asset_counters``
+    runs.
+    """
+    counters = AssetCounter.objects.filter(type__in=types, region__in=regions)
+    if not include_deleted:
+        counters = counters.filter(deleted=False)
+    return max(counters.aggregate(total=Sum('count'))['total'] or 0, 0)
+
+
+@nested_commit_on_success
+def rebuild_asset_counters():
+    """Recounts assets per type, region and deleted flag."""
+    AssetCounter.objects.all().delete()
+    AssetCounter.objects.bulk_create([
+        AssetCounter(
+            type=row['type'],
+            region_id=row['region'],
+            deleted=row['deleted'],
+            count=row['count'],
+        ) for row in Asset.admin_objects.values(
+            'type', 'region', 'deleted',
+        ).annotate(count=Count('id')).order_by()
+    ])
+
+
+def fuzzy_ratio_key(signature, query_signature):
+    """Sort key of fuzzy matches - lower is better."""
+    ratio = difflib.SequenceMatcher(None, signature, query_signature).ratio()
+    if ratio:
+        return 1 / ratio
+    return 999
+
+
+def fuzzy_match(assets, query, limit=10):
+    """Returns ids of at most *limit* assets (from *assets* queryset) which
+    fuzzy signature is the most similar to *query*, the best first.
+
+    Only assets sharing the most n-grams with *query* are scored (with
+    a bounded heap); queries too short to have n-grams match nothing.
+    """
+    query_signature = get_fuzzy_signature(query)
+    grams = get_ngrams(query_signature)
+    if not grams:
+        return []
+    candidates = [row['asset'] for row in AssetNgram.objects.filter(
+        field=FUZZY_FIELD, gram__in=grams, asset__in=assets,
+    ).values('asset').annotate(
+        shared=Count('gram'),
+    ).order_by('-shared')[:FUZZY_MAX_CANDIDATES]]
+    if not candidates:
+        return []
+    rows = assets.filter(pk__in=candidates).values_list(
+        'id', 'sn', 'barcode', 'model__name',
+    )
+    best = heapq.nsmallest(limit, rows, key=lambda row: fuzzy_ratio_key(
+        get_fuzzy_signature(*row[1:]), query_signature,
+    ))
+    return [row[0] for row in best]
+
+
+def get_profile_values(profile):
+    return {
+        field: normalize(getattr(profile, field, None) if profile else None)
+        for field in PROFILE_FIELDS
+    }
+
+
+def get_model_values(model):
+    category = model.category if model else None
+    return {
+        'model': normalize(model.name if model else None),
+        'manufacturer': normalize(
+            model.manufacturer.name if model and model.manufacturer else None
+        ),
+        'category': normalize(category.name if category else None),
+        'category_slug': category.slug if category else '',
+    }
+
+
+def get_location_values(device_info):
+    rack = device_info.rack if device_info else None
+    data_center = device_info.data_center if device_info else None
+    server_room = device_info.server_room if device_info else None
+    if rack:
+        data_center = data_center or rack.data_center
+        server_room = server_room or rack.server_room
+    return {
+        'data_center': normalize(data_center.name if data_center else None),
+        'server_room': normalize(server_room.name if server_room else None),
+        'rack': normalize(rack.name if rack else None),
+    }
+
+
+def get_document_values(asset, profile=None):
+    """Returns search document fields for *asset* (related objects should be
+    already fetched, see ``SEARCH_DOCUMENT_RELATED``)."""
+    values = {
+        'sn': normalize(asset.sn),
+        'barcode': normalize(asset.barcode),
+        'hostname': normalize(asset.hostname),
+        'niw': normalize(asset.niw),
+        'imei': normalize(
+            asset.office_info.imei if asset.office_info else None
+        ),
+        'service': normalize(asset.service.name if asset.service else None),
+        'environment': normalize(
+            asset.device_environment.name
+            if asset.device_environment else None
+        ),
+        'budget_info': normalize(
+            asset.budget_info.name if asset.budget_info else None
+        ),
+    }
+    values.update(get_model_values(asset.model))
+    values.update(get_profile_values(profile))
+    values.update(get_location_values(asset.device_info))
+    return values
+
+
+def _rebuild_chunk(asset_ids, ngrams=True):
+    assets = Asset.admin_objects.select_related(
+        *SEARCH_DOCUMENT_RELATED
+    ).filter(pk__in=asset_ids)
+    owner_ids = set(asset.owner_id for asset in assets if asset.owner_id)
+    profiles = {
+        profile.user_id: profile
+        for profile in Profile.objects.filter(user__in=owner_ids)
+    } if owner_ids else {}
+    documents = [
+        AssetSearchDocument(
+            asset_id=asset.id,
+            **get_document_values(asset, profiles.get(asset.owner_id))
+        ) for asset in assets
+    ]
+    AssetSearchDocument.objects.filter(asset__in=asset_ids).delete()
+    AssetSearchDocument.objects.bulk_create(documents)
+    if ngrams:
+        AssetNgram.objects.filter(asset__in=asset_ids).delete()
+        AssetNgram.objects.bulk_create(list(itertools.chain.from_iterable(
+            get_asset_ngrams(asset) for asset in assets
+        )))
+    return len(documents)
+
+
+@nested_commit_on_success
+def rebuild_search_documents(queryset=None,
+                             chunk_size=SEARCH_DOCUMENT_CHUNK_SIZE):
+    """Rebuilds search documents and n-grams of assets from *queryset* (all
+    assets by default). Returns the number of rebuilt documents."""
+    if queryset is None:
+        queryset = Asset.admin_objects.all()
+    asset_ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+    rebuilt = 0
+    for start in xrange(0, len(asset_ids), chunk_size):
+        rebuilt += _rebuild_chunk(asset_ids[start:start + chunk_size])
+    return rebuilt
+
+
+@receiver(post_save, sender=Asset, dispatch_uid='assets.search_document.asset')
+def asset_post_save(sender, instance, raw=False, created=False, **kwargs):
+    if raw:
+        return
+    # field state isn't updated yet, so dirty fields are the saved ones
+    dirty_fields = instance.dirty_fields
+    _rebuild_chunk([instance.pk], ngrams=created or any(
+        field in dirty_fields for field in NGRAM_FIELDS + ('model_id',)
+    ))
+    counter_fields = ('type', 'region_id', 'deleted')
+    if created:
+        change_asset_counter(
+            instance.type, instance.region_id, instance.deleted, 1,
+        )
+    elif any(field in dirty_fields for field in counter_fields):
+        old = [
+            dirty_fields.get(field, getattr(instance, field))
+            for field in counter_fields
+        ]
+        change_asset_counter(*old, delta=-1)
+        change_asset_counter(
+            instance.type, instance.region_id, instance.deleted, 1,
+        )
+
+
+@receiver(
+    post_delete, sender=Asset, dispatch_uid='assets.search_document.counter',
+)
+def asset_post_delete(sender, instance, **kwargs):
+    change_asset_counter(
+        instance.type, instance.region_id, instance.deleted, -1,
+    )
+
+
+@receiver(
+    post_save, sender=DeviceInfo,
+    dispatch_uid='assets.search_document.device_info',
+)
+def device_info_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    rebuild_search_documents(Asset.admin_objects.filter(device_info=instance))
+
+
+@receiver(
+    post_save, sender=OfficeInfo,
+    dispatch_uid='assets.search_document.office_info',
+)
+def office_info_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    AssetSearchDocument.objects.filter(
+        asset__office_info=instance,
+    ).update(imei=normalize(instance.imei))
+
+
+@receiver(
+    post_save, sender=AssetModel,
+    dispatch_uid='assets.search_document.asset_model',
+)
+def asset_model_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    AssetSearchDocument.objects.filter(
+        asset__model=instance,
+    ).update(**get_model_values(instance))
+    if 'name' in instance.dirty_fields:
+        # fuzzy signatures contain the model name
+        assets = list(Asset.admin_objects.select_related('model').filter(
+            model=instance, part_info=None,
+        ))
+        AssetNgram.objects.filter(
+            field=FUZZY_FIELD, asset__in=[asset.id for asset in assets],
+        ).delete()
+        AssetNgram.objects.bulk_create(list(itertools.chain.from_iterable(
+            get_asset_ngrams(asset, fields=()) for asset in assets
+        )))
+
+
+@receiver(
+    post_save, sender=AssetManufacturer,
+    dispatch_uid='assets.search_document.manufacturer',
+)
+def manufacturer_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    AssetSearchDocument.objects.filter(
+        asset__model__manufacturer=instance,
+    ).update(manufacturer=normalize(instance.name))
+
+
+@receiver(
+    post_save, sender=AssetCategory,
+    dispatch_uid='assets.search_document.category',
+)
+def category_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    AssetSearchDocument.objects.filter(
+        asset__model__category=instance,
+    ).update(category=normalize(instance.name), category_slug=instance.slug)
+
+
+@receiver(
+    post_save, sender=BudgetInfo,
+    dispatch_uid='assets.search_document.budget_info',
+)
+def budget_info_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    AssetSearchDocument.objects.filter(
+        asset__budget_info=instance,
+    ).update(budget_info=normalize(instance.name))
+
+
+@receiver(
+    post_save, sender=Profile, dispatch_uid='assets.search_document.profile',
+)
+def profile_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    AssetSearchDocument.objects.filter(
+        asset__owner=instance.user_id,
+    ).update(**get_profile_values(instance))
+
+
+@receiver(
+    post_save, sender=DataCenter,
+    dispatch_uid='assets.search_document.data_center',
+)
+def data_center_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    rebuild_search_documents(Asset.admin_objects.filter(
+        Q(device_info__data_center=instance) |
+        Q(device_info__rack__data_center=instance)
+    ))
+
+
+@receiver(
+    post_save, sender=ServerRoom,
+    dispatch_uid='assets.search_document.server_room',
+)
+def server_room_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    rebuild_search_documents(Asset.admin_objects.filter(
+        Q(device_info__server_room=instance) |
+        Q(device_info__rack__server_room=instance)
+    ))
+
+
+@receiver(post_save, sender=Rack, dispatch_uid='assets.search_document.rack')
+def rack_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    AssetSearchDocument.objects.filter(
+        asset__device_info__rack=instance,
+    ).update(rack=normalize(instance.name))
+
+
+def ci_post_save(sender, instance, raw=False, **kwargs):
+    # services and environments are proxies of CI and may be saved as CIs
+    if raw:
+        return
+    name = normalize(instance.name)
+    AssetSearchDocument.objects.filter(
+        asset__service=instance.pk,
+    ).update(service=name)
+    AssetSearchDocument.objects.filter(
+        asset__device_environment=instance.pk,
+    ).update(environment=name)
+
+
+for model in (CI, ServiceCatalog, DeviceEnvironment):
+    post_save.connect(
+        ci_post_save, sender=model,
+        dispatch_uid='assets.search_document.{}'.format(
+            model._meta.module_name,
+        ),
+    )
+
+
+def ci_source(instance):
+    return Q(service=instance.pk) | Q(device_environment=instance.pk)
+
+
+# assets which search documents contain values of a related object, by model
+# of the object
+DOCUMENT_SOURCES = {
+    DeviceInfo: lambda instance: Q(device_info=instance),
+    OfficeInfo: lambda instance: Q(office_info=instance),
+    AssetModel: lambda instance: Q(model=instance),
+    AssetManufacturer: lambda instance: Q(model__manufacturer=instance),
+    AssetCategory: lambda instance: Q(model__category=instance),
+    BudgetInfo: lambda instance: Q(budget_info=instance),
+    Profile: lambda instance: Q(owner=instance.user_id),
+    DataCenter: lambda instance: (
+        Q(device_info__data_center=instance) |
+        Q(device_info__rack__data_center=instance)
+    ),
+    ServerRoom: lambda instance: (
+        Q(device_info__server_room=instance) |
+        Q(device_info__rack__server_room=instance)
+    ),
+    Rack: lambda instance: Q(device_info__rack=instance),
+    CI: ci_source,
+    ServiceCatalog: ci_source,
+    DeviceEnvironment: ci_source,
+}
+
+
+def source_pre_delete(sender, instance, **kwargs):
+    # foreign keys of assets may be nulled by the deletion, affected assets
+    # have to be found before
+    instance._search_document_assets = list(Asset.admin_objects.filter(
+        DOCUMENT_SOURCES[sender](instance),
+    ).values_list('pk', flat=True))
+
+
+def source_post_delete(sender, instance, **kwargs):
+    asset_ids = getattr(instance, '_search_document_assets', None)
+    if asset_ids:
+        rebuild_search_documents(Asset.admin_objects.filter(pk__in=asset_ids))
+
+
+for model in DOCUMENT_SOURCES:
+    pre_delete.connect(
+        source_pre_delete, sender=model,
+        dispatch_uid='assets.search_document.{}_pre_delete'.format(
+            model._meta.module_name,
+        ),
+    )
+    post_delete.connect(
+        source_post_delete, sender=model,
+        dispatch_uid='assets.search_document.{}_post_delete'.format(
+            model._meta.module_name,
+        ),
+    )
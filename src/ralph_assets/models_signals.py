@@ -8,18 +8,26 @@ from __future__ import unicode_literals
 
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from lck.django.common import nested_commit_on_success
+from ralph.discovery.models import Device
 
 from ralph_assets.models import Asset, DeviceInfo
+from ralph_assets.models_assets import Rack
 
 
 SAVE_PRIORITY = 215
+LOCALIZATION_RELATED = (
+    'data_center__deprecated_ralph_dc',
+    'rack__data_center',
+    'rack__deprecated_ralph_rack',
+)
 
 
 def _can_not_edit_localization(asset_dev_info):
     return not Asset.objects.filter(device_info=asset_dev_info).exists()
 
 
-def _get_core_parent(asset_dev_info):
+def _get_core_parent(asset_dev_info, can_edit=None):
     """
     Finds parent for connected Ralph device.
 
@@ -29,8 +37,10 @@ def _get_core_parent(asset_dev_info):
     - True if found device is blade system
     """
 
+    if can_edit is None:
+        can_edit = not _can_not_edit_localization(asset_dev_info)
     if (
-        _can_not_edit_localization(asset_dev_info) or
+        not can_edit or
         not asset_dev_info.rack or
         not asset_dev_info.rack.deprecated_ralph_rack
     ):
@@ -54,47 +64,72 @@ def _get_core_parent(asset_dev_info):
         return device_info.get_ralph_device(), True
 
 
-def _update_localization(device, asset_dev_info):
-    if _can_not_edit_localization(asset_dev_info):
-        return
-    device_parent, is_blade_system = _get_core_parent(asset_dev_info)
-    if not device_parent:
-        return
-    device.parent = device_parent
-    device.save(priority=SAVE_PRIORITY)
-    # update dc for device_parent
-    if (
-        not asset_dev_info.rack.data_center.deprecated_ralph_dc or
-        is_blade_system
-    ):
-        return
-    data_center = asset_dev_info.rack.data_center.deprecated_ralph_dc
-    device_parent.parent = data_center
-    device_parent.save(priority=SAVE_PRIORITY)
-
+def _localize(device, asset_dev_info, can_edit, core_parent):
+    """
+    Sets localization of Ralph *device* (parent, dc, rack, chassis_position,
+    position) from *asset_dev_info* without saving anything.
 
-def _update_cached_localization(device, asset_dev_info):
+    Returns:
+    Tuple of two values:
+    - True if any field of the device changed
+    - parent device which data center changed or None
+    """
+    changed = False
+    changed_parent = None
+    device_parent, is_blade_system = core_parent
+    if can_edit and device_parent:
+        if device.parent_id != device_parent.id:
+            device.parent = device_parent
+            changed = True
+        dc_id = asset_dev_info.rack.data_center.deprecated_ralph_dc_id
+        if (
+            dc_id and not is_blade_system and
+            device_parent.parent_id != dc_id
+        ):
+            device_parent.parent = (
+                asset_dev_info.rack.data_center.deprecated_ralph_dc
+            )
+            changed_parent = device_parent
+    values = {}
     if (
         asset_dev_info.data_center and
         asset_dev_info.data_center.deprecated_ralph_dc
     ):
-        device.dc = asset_dev_info.data_center.deprecated_ralph_dc.sn
+        values['dc'] = asset_dev_info.data_center.deprecated_ralph_dc.sn
     if (
         asset_dev_info.rack and
         asset_dev_info.rack.deprecated_ralph_rack
     ):
-        device.rack = asset_dev_info.rack.deprecated_ralph_rack.sn
-    device.save(priority=SAVE_PRIORITY)
-
+        values['rack'] = asset_dev_info.rack.deprecated_ralph_rack.sn
+    if can_edit:
+        if asset_dev_info.position is not None:
+            values['chassis_position'] = asset_dev_info.position
+        if asset_dev_info.slot_no is not None:
+            values['position'] = asset_dev_info.slot_no
+    for name, value in values.iteritems():
+        if getattr(device, name) != value:
+            setattr(device, name, value)
+            changed = True
+    return changed, changed_parent
+
+
+def sync_device_localization(device, asset_dev_info):
+    """
+    Sets localization of Ralph *device* from *asset_dev_info* and saves the
+    device (and its parent) only if something changed.
 
-def _update_localization_details(device, asset_dev_info):
-    if _can_not_edit_localization(asset_dev_info):
-        return
-    if asset_dev_info.position is not None:
-        device.chassis_position = asset_dev_info.position
-    if asset_dev_info.slot_no is not None:
-        device.position = asset_dev_info.slot_no
-    device.save(priority=SAVE_PRIORITY)
+    Returns True if the device was saved.
+    """
+    can_edit = not _can_not_edit_localization(asset_dev_info)
+    changed, changed_parent = _localize(
+        device, asset_dev_info, can_edit,
+        _get_core_parent(asset_dev_info, can_edit=can_edit),
+    )
+    if changed:
+        device.save(priority=SAVE_PRIORITY)
+    if changed_parent:
+        changed_parent.save(priority=SAVE_PRIORITY)
+    return changed
 
 
 def update_core_localization(asset_dev_info):
@@ -108,9 +143,86 @@ def update_core_localization(asset_dev_info):
     device = asset_dev_info.get_ralph_device()
     if not device:
         return
-    _update_localization(device=device, asset_dev_info=asset_dev_info)
-    _update_cached_localization(device=device, asset_dev_info=asset_dev_info)
-    _update_localization_details(device=device, asset_dev_info=asset_dev_info)
+    sync_device_localization(device, asset_dev_info)
+
+
+@nested_commit_on_success
+def update_core_localization_bulk(device_infos):
+    """
+    Bulk variant of ``update_core_localization`` for many *device_infos*
+    (queryset), e.g. all devices of a moved rack. Linked Ralph devices,
+    assets and blade systems are fetched in a fixed number of queries and
+    only changed devices are saved.
+
+    Returns number of saved devices.
+    """
+    device_infos = list(device_infos.select_related(
+        *LOCALIZATION_RELATED
+    ).exclude(ralph_device_id=None))
+    if not device_infos:
+        return 0
+    devices = Device.objects.in_bulk(
+        [device_info.ralph_device_id for device_info in device_infos],
+    )
+    # device infos linked to assets (which can edit localization) and whether
+    # these assets are blades
+    blades = dict(Asset.objects.filter(
+        device_info__in=[device_info.id for device_info in device_infos],
+    ).values_list('device_info', 'model__category__is_blade'))
+    blade_infos = [
+        device_info for device_info in device_infos
+        if blades.get(device_info.id) and device_info.rack
+    ]
+    blade_systems = {}
+    if blade_infos:
+        chassis_ids = {}
+        for key in DeviceInfo.objects.filter(
+            asset__model__category__is_blade=False,
+            rack__in=set(device_info.rack_id for device_info in blade_infos),
+            position__in=set(
+                device_info.position for device_info in blade_infos
+            ),
+        ).values_list(
+            'data_center', 'server_room', 'rack', 'position',
+            'ralph_device_id',
+        ).order_by('id'):
+            chassis_ids.setdefault(key[:-1], key[-1])
+        chassis = Device.objects.in_bulk(filter(None, chassis_ids.values()))
+        blade_systems = {
+            key: chassis.get(device_id)
+            for key, device_id in chassis_ids.iteritems()
+        }
+    saved = 0
+    changed_parents = {}
+    for device_info in device_infos:
+        device = devices.get(device_info.ralph_device_id)
+        if not device:
+            continue
+        can_edit = device_info.id in blades
+        if (
+            not can_edit or
+            not device_info.rack or
+            not device_info.rack.deprecated_ralph_rack
+        ):
+            core_parent = None, False
+        elif not blades[device_info.id]:
+            core_parent = device_info.rack.deprecated_ralph_rack, False
+        else:
+            core_parent = blade_systems.get((
+                device_info.data_center_id, device_info.server_room_id,
+                device_info.rack_id, device_info.position,
+            )), True
+        changed, changed_parent = _localize(
+            device, device_info, can_edit, core_parent,
+        )
+        if changed:
+            device.save(priority=SAVE_PRIORITY)
+            saved += 1
+        if changed_parent:
+            changed_parents[changed_parent.id] = changed_parent
+    for device_parent in changed_parents.itervalues():
+        device_parent.save(priority=SAVE_PRIORITY)
+    return saved
 
 
 @receiver(
@@ -118,3 +230,12 @@ def update_core_localization(asset_dev_info):
 )
 def asset_device_info_post_save(sender, instance, **kwargs):
     update_core_localization(asset_dev_info=instance)
+
+
+@receiver(post_save, sender=Rack, dispatch_uid='assets.rack.post_save')
+def rack_post_save(sender, instance, raw=False, created=False, **kwargs):
+    """Rack moved to other data center or Ralph rack changes localization of
+    all devices mounted in it."""
+    if raw or created:
+        return
+    update_core_localization_bulk(instance.deviceinfo_set.all())
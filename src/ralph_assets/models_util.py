@@ -38,6 +38,54 @@ class ImportProblem(models.Model):
         return self.message
 
 
+class ChoicesMap(object):
+    """Id -> choice, id -> label and label -> id dictionaries of a Choices
+    class or of a model field with choices. Use :func:`get_choices_map` to
+    get them built once."""
+
+    def __init__(self, choices):
+        if isinstance(choices, models.Field):
+            self.choices = {}
+            pairs = choices.flatchoices
+        else:
+            self.choices = {
+                choice.id: choice for choice in choices.__choices__
+            }
+            pairs = choices()
+        self.labels = dict(pairs)
+        self.ids = {}
+        for choice_id, label in pairs:
+            self.ids.setdefault(unicode(label).lower().strip(), choice_id)
+
+    def from_id(self, choice_id):
+        """Returns choice object with *choice_id* (like ``from_id`` of
+        Choices class), raises ValueError if there is no such choice."""
+        try:
+            return self.choices[choice_id]
+        except KeyError:
+            raise ValueError("Nothing found for '{}'.".format(choice_id))
+
+    def get_label(self, choice_id, default=None):
+        return self.labels.get(choice_id, default)
+
+    def get_id(self, label, default=None):
+        """Returns id of choice with *label* (case insensitive)."""
+        return self.ids.get(unicode(label).lower().strip(), default)
+
+
+_choices_maps = {}
+
+
+def get_choices_map(choices):
+    """Returns :class:`ChoicesMap` of *choices* (Choices class or model
+    field), built on the first use."""
+    try:
+        return _choices_maps[choices]
+    except KeyError:
+        choices_map = _choices_maps[choices] = ChoicesMap(choices)
+        return choices_map
+
+
 def add_problem(resource, severity, message):
     """Add a problem to the resource
     :param resource: Any django model instance
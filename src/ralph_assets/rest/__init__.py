@@ -1,5 +1,7 @@
 from ralph_assets.rest.data_centers_racks import DCRacksAPIView
+from ralph_assets.rest.free_space import FreeSpaceAPIView
 
 __all__ = [
     'DCRacksAPIView',
+    'FreeSpaceAPIView',
 ]
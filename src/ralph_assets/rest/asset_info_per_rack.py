@@ -5,12 +5,14 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from collections import defaultdict
+
 from django.http import Http404
 
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from ralph_assets.models_assets import Orientation, Rack
+from ralph_assets.models_assets import Asset, Orientation, Rack
 from ralph_assets.models_dc_assets import RackAccessory
 from ralph_assets.views.base import ACLGateway
 
@@ -28,6 +30,12 @@ from ralph_assets.rest.serializers.models_dc_asssets import (
 
 
 class AssetsView(ACLGateway, APIView):
+    """Rack elevation: assets and accessories on both sides of the rack.
+
+    All assets and accessories of the rack are fetched in one query each,
+    blades are grouped by position and free U is computed from the same
+    rows, so the number of queries doesn't depend on the rack contents.
+    """
 
     def get_object(self, pk):
         try:
@@ -35,23 +43,51 @@ class AssetsView(ACLGateway, APIView):
         except Rack.DoesNotExist:
             raise Http404
 
-    def _get_assets(self, rack, side):
-        return AssetSerializer(rack.get_root_assets(side), many=True).data
+    def _get_assets(self, rack):
+        assets = list(Asset.objects.select_related(
+            'model__category', 'device_info',
+        ).filter(device_info__rack=rack).order_by('id'))
+        by_position = defaultdict(list)
+        for asset in assets:
+            by_position[asset.device_info.position].append(asset)
+        for asset in assets:
+            asset.cache_related_assets([
+                related for related in by_position[asset.device_info.position]
+                if related.id != asset.id
+            ])
+        return [
+            asset for asset in assets
+            if asset.device_info.slot_no == '' and not (
+                asset.model.category and asset.model.category.is_blade
+            )
+        ]
 
-    def _get_accessories(self, rack, side):
-        accessories = RackAccessory.objects.select_related('accessory').filter(
+    def _get_accessories(self, rack):
+        return list(RackAccessory.objects.select_related('accessory').filter(
             rack=rack,
-            orientation=side,
-        )
-        return RackAccessorySerializer(accessories, many=True).data
+        ).order_by('id'))
 
     def get(self, request, rack_id, format=None):
         rack = self.get_object(rack_id)
+        assets = self._get_assets(rack)
+        accessories = self._get_accessories(rack)
+        # accesory always has 1U of height
+        rack.free_u = (
+            rack.max_u_height -
+            sum(asset.model.height_of_device or 0 for asset in assets) -
+            len(set(
+                accessory.position for accessory in accessories
+                if accessory.position is not None
+            ))
+        )
         devices = {}
         for side in [Orientation.front, Orientation.back]:
-            devices[side.desc] = (
-                self._get_assets(rack, side) +
-                self._get_accessories(rack, side)
-            )
+            devices[side.desc] = AssetSerializer([
+                asset for asset in assets
+                if asset.device_info.orientation == side.id
+            ], many=True).data + RackAccessorySerializer([
+                accessory for accessory in accessories
+                if accessory.orientation == side.id
+            ], many=True).data
         devices['info'] = RackSerializer(rack).data
         return Response(devices)
@@ -12,7 +12,7 @@ from rest_framework.views import APIView
 
 from ralph_assets.views.base import ACLGateway
 from ralph_assets.models_assets import DataCenter
-from ralph_assets.rest.serializers.models_dc_asssets import DCSerializer
+from ralph_assets.rest.serializers.models_dc_asssets import RackSerializer
 
 
 class DCRacksAPIView(ACLGateway, APIView):
@@ -32,6 +32,5 @@ class DCRacksAPIView(ACLGateway, APIView):
         :param data_center_id int: data_center id
         :returns list: list of informations about racks in given data center
         """
-        return Response(
-            DCSerializer(self.get_object(data_center_id)).data['rack_set']
-        )
+        racks = self.get_object(data_center_id).rack_set.with_free_u()
+        return Response(RackSerializer(racks, many=True).data)
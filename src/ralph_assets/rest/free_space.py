@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from ralph_assets.models_assets import Orientation, Rack
+from ralph_assets.models_rack_space import find_free_space
+from ralph_assets.rest.serializers.models_dc_asssets import (
+    RackSpaceSerializer,
+)
+from ralph_assets.views.base import ACLGateway
+
+
+class FreeSpaceAPIView(ACLGateway, APIView):
+    """
+    Return sides of racks having a contiguous free block of given height,
+    the least fragmented first.
+    """
+
+    def get(self, request, format=None):
+        """
+        Finding racks for a device of given height.
+
+        :param height int: height of the device in U (required)
+        :param data_center int: data center id
+        :param server_room int: server room id
+        :param orientation str: side of the rack (front or back)
+        :returns list: list of rack sides with free blocks big enough
+        """
+        try:
+            height = int(request.GET['height'])
+            if height < 1:
+                raise ValueError
+            racks = Rack.objects.all()
+            for param in ('data_center', 'server_room'):
+                if request.GET.get(param):
+                    racks = racks.filter(**{param: int(request.GET[param])})
+            orientation = request.GET.get('orientation')
+            if orientation:
+                orientation = Orientation.id_from_name(orientation)
+        except (KeyError, ValueError):
+            return Response(
+                {'detail': 'Invalid height, location or orientation.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        spaces = find_free_space(height, racks, orientation or None)
+        return Response(RackSpaceSerializer(
+            spaces, many=True, context={'height': height},
+        ).data)
@@ -9,6 +9,7 @@ from rest_framework import serializers
 
 from ralph_assets.models_dc_assets import DataCenter, Rack, RackAccessory
 from ralph_assets.models import Asset
+from ralph_assets.models_rack_space import RackSpace
 
 
 TYPE_EMPTY = 'empty'
@@ -78,3 +79,22 @@ class DCSerializer(serializers.ModelSerializer):
         model = DataCenter
         fields = ('id', 'name', 'rack_set')
         depth = 1
+
+
+class RackSpaceSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(source='rack.name')
+    data_center = serializers.IntegerField(source='rack.data_center_id')
+    server_room = serializers.IntegerField(source='rack.server_room_id')
+    orientation = serializers.CharField(source='get_orientation_desc')
+    blocks = serializers.SerializerMethodField('get_blocks')
+
+    def get_blocks(self, obj):
+        return obj.get_free_blocks(self.context.get('height', 1))
+
+    class Meta:
+        model = RackSpace
+        fields = (
+            'rack', 'name', 'data_center', 'server_room', 'orientation',
+            'free_u', 'largest_free_block', 'free_blocks', 'fragmentation',
+            'blocks',
+        )
@@ -8,7 +8,7 @@ from __future__ import unicode_literals
 from django.conf.urls import patterns, url
 
 from ralph_assets.rest.asset_info_per_rack import AssetsView
-from ralph_assets.rest import DCRacksAPIView
+from ralph_assets.rest import DCRacksAPIView, FreeSpaceAPIView
 
 
 urlpatterns = patterns(
@@ -21,4 +21,8 @@ urlpatterns = patterns(
         r'^data_center/(?P<data_center_id>\d+)/$',
         DCRacksAPIView.as_view(),
     ),
+    url(
+        r'^free_space/$',
+        FreeSpaceAPIView.as_view(),
+    ),
 )
@@ -45,3 +45,11 @@ ASSETS_AUTO_ASSIGN_HOSTNAME = False
 if locals().get('ASSETS_AUTO_ASSIGN_HOSTNAME'):
     # this text will be displayed as a help tip next to the hostname form field
     HOSTNAME_FIELD_HELP_TIP = 'Autogenerated if owner & model are set.'
+
+# count unfiltered asset searches using per type/region counters (run
+# rebuild_search_index command periodically to fix counters after bulk updates)
+ASSETS_SEARCH_APPROXIMATE_COUNT = False
+
+# age (in days) of history of changes moved to the archive table by
+# archive_history command
+ASSETS_HISTORY_ARCHIVE_DAYS = 365
@@ -5,13 +5,16 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from bob.templatetags.bob import pagination as bob_pagination
 from django import template
 from django.core.urlresolvers import reverse
 from django.forms import CheckboxInput
+from django.http import QueryDict
 
 from ralph_assets.models import get_edit_url
 from ralph_assets.models_support import Support
 from ralph_assets.models_assets import ASSET_TYPE2MODE
+from ralph_assets.views.pagination import CURSOR_VARIABLE_NAME, KeysetPage
 
 
 register = template.Library()
@@ -80,3 +83,44 @@ def multi_assign_form(form, counter=''):
 )
 def mode_switch(context):
     return {'mode': context['mode']}
+
+
+@register.inclusion_tag('bob/pagination.html')
+def keyset_pagination(page, show_all=False, show_csv=False,
+                      fugue_icons=False, url_query=None, neighbors=1,
+                      query_variable_name='page',
+                      export_variable_name='export'):
+    """Bob's pagination which links the previous, next and last page of
+    a keyset paginated page by cursors (other pages by their numbers)."""
+    url_query = url_query.copy() if url_query else QueryDict('').copy()
+    url_query.pop(CURSOR_VARIABLE_NAME, None)
+    context = bob_pagination(
+        page, show_all, show_csv, fugue_icons, url_query, neighbors,
+        query_variable_name, export_variable_name,
+    )
+    if not isinstance(page, KeysetPage):
+        return context
+
+    def cursor_url(cursor):
+        query = url_query.copy()
+        query.pop(query_variable_name, None)
+        query[CURSOR_VARIABLE_NAME] = cursor
+        return query.urlencode()
+
+    urls = {}
+    if page.previous_cursor():
+        urls[page.number - 1] = context['url_previous_page'] = cursor_url(
+            page.previous_cursor(),
+        )
+    if page.next_cursor():
+        urls[page.number + 1] = context['url_next_page'] = cursor_url(
+            page.next_cursor(),
+        )
+    last_page = page.paginator.num_pages
+    if last_page not in urls and last_page != page.number:
+        urls[last_page] = cursor_url(page.last_cursor())
+    context['url_pages'] = [
+        (number, urls.get(number, url))
+        for number, url in context['url_pages']
+    ]
+    return context
@@ -21,7 +21,7 @@ def get_context(obj, history, limit, full_history_button, title,
         'history_for_model_url': History.get_history_url_for_object(obj),
         'history_title': title,
         'limit': limit,
-        'history': history[:limit] if history else None,
+        'history': history[:limit],
         'show_field_name': show_field_name,
     }
 
@@ -31,12 +31,12 @@ def short_history(obj, limit=5, full_history_button=True):
     """Render a short history table."""
     if not obj:
         return {}
-    history = obj.get_history()
+    history = History.objects.get_latest_history(obj, limit)
     if not history:
         return {}
     return get_context(
         obj,
-        history.order_by('-date'),
+        history,
         limit,
         full_history_button,
         _('Short history'),
@@ -48,12 +48,14 @@ def status_history(obj, limit=5, full_history_button=True):
     """Render a short history table only for status changes."""
     if not obj:
         return {}
-    history = obj.get_history(field_name='status')
+    history = History.objects.get_latest_history(
+        obj, limit, field_name='status',
+    )
     if not history:
         return {}
     return get_context(
         obj,
-        history.order_by('-date'),
+        history,
         limit,
         full_history_button,
         _('Status history'),
@@ -17,17 +17,19 @@ from ralph_assets.licences.models import (
     AssetType,
     Licence,
 )
-from ralph_assets.models_assets import Asset
+from ralph_assets.models_assets import Asset, Warehouse
 from ralph_assets.tests.utils import (
     ClientMixin,
 )
 from ralph_assets.tests.utils.assets import (
     BOAssetFactory,
     DCAssetFactory,
+    WarehouseFactory,
 )
 from ralph_assets.tests.utils.licences import (
     LicenceFactory,
 )
+from ralph_assets.views.data_import import ImportLookupCache
 
 
 class TestImport(ClientMixin, TestCase):
@@ -78,6 +80,25 @@ class TestImport(ClientMixin, TestCase):
             )
 
 
+class TestImportLookupCache(TestCase):
+
+    def test_lookups_dont_repeat_queries(self):
+        warehouse = WarehouseFactory(name='Warehouse A')
+        WarehouseFactory()
+        lookups = ImportLookupCache()
+        with self.assertNumQueries(1):
+            for name in ('Warehouse A', 'WAREHOUSE a'):
+                self.assertEqual(lookups.get(Warehouse, name), warehouse)
+            with self.assertRaises(Warehouse.DoesNotExist):
+                lookups.get(Warehouse, 'Warehouse B')
+        new_warehouse = WarehouseFactory(name='Warehouse B')
+        lookups.add(Warehouse, new_warehouse)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                lookups.get(Warehouse, 'warehouse b'), new_warehouse,
+            )
+
+
 class TestDataImporter(object):
     SEP = ','
     upload_model = None
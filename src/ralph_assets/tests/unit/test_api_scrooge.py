@@ -8,6 +8,7 @@ from __future__ import unicode_literals
 from datetime import date
 
 from django.test import TestCase
+from django.test.utils import override_settings
 from ralph.account.models import Region
 
 from ralph_assets import models
@@ -17,6 +18,10 @@ from ralph_assets.tests.utils.assets import (
     AssetModelFactory,
     WarehouseFactory,
 )
+from ralph_assets.tests.utils.licences import (
+    LicenceAssetFactory,
+    LicenceFactory,
+)
 from ralph_assets.tests.utils.supports import (
     DCSupportFactory,
     BOSupportFactory,
@@ -120,6 +125,55 @@ class TestApiScrooge(TestCase):
             asset.device_info.get_ralph_device().name
         )
 
+    @override_settings(SHOW_RALPH_CORES_DIFF=True)
+    def test_get_assets_in_chunks(self):
+        assets = [
+            DCAssetFactory(invoice_date=date(2013, 10, 11)) for _ in range(3)
+        ]
+        today = date(2013, 11, 12)
+        # 3 chunks of assets, Ralph devices and processors of 2 non-empty
+        # chunks
+        with self.assertNumQueries(7):
+            result = list(api_scrooge.get_assets(today, chunk_size=2))
+        self.assertEqual(len(result), 3)
+        for asset, asset_result in zip(assets, result):
+            self._compare_asset(
+                asset,
+                asset_result,
+                today,
+                asset.device_info.get_ralph_device().name
+            )
+
+    def test_get_assets_range(self):
+        DCAssetFactory(
+            invoice_date=date(2013, 10, 11),
+            deprecation_end_date=date(2013, 11, 20),
+        )
+        start, end = date(2013, 10, 1), date(2013, 11, 30)
+        result = list(api_scrooge.get_assets_range(start, end))
+        self.assertEqual(
+            [
+                (r['period_start'], r['period_end'], r['is_depreciated'])
+                for r in result
+            ],
+            [
+                (date(2013, 10, 11), date(2013, 11, 20), False),
+                (date(2013, 11, 21), end, True),
+            ],
+        )
+        for day in (date(2013, 10, 11), date(2013, 11, 21)):
+            [day_result] = api_scrooge.get_assets(day)
+            for r in result:
+                if r['period_start'] <= day <= r['period_end']:
+                    self.assertEqual(
+                        dict(r, period_start=None, period_end=None),
+                        dict(day_result, period_start=None, period_end=None),
+                    )
+        self.assertEqual(
+            list(api_scrooge.get_assets_range(start, date(2013, 10, 10))),
+            [],
+        )
+
     def test_get_asset_without_hostname(self):
         asset = DCAssetFactory(
             region=Region.get_default_region(),
@@ -185,3 +239,61 @@ class TestApiScrooge(TestCase):
         )
         supports = get_supports(date(2013, 11, 12))
         self.assertEqual(len(list(supports)), 1)
+
+    def test_get_supports_range(self):
+        support = DCSupportFactory(
+            date_from=date(2013, 11, 12),
+            date_to=date(2014, 11, 12)
+        )
+        DCSupportFactory(
+            date_from=date(2012, 11, 13),
+            date_to=date(2013, 11, 1)
+        )
+        supports = list(api_scrooge.get_supports_range(
+            date(2013, 11, 5), date(2013, 11, 30),
+        ))
+        self.assertEqual(len(supports), 1)
+        self.assertEqual(supports[0]['support_id'], support.id)
+        self.assertEqual(supports[0]['period_start'], date(2013, 11, 12))
+        self.assertEqual(supports[0]['period_end'], date(2013, 11, 30))
+
+    def test_get_licences_assets(self):
+        licences = [
+            LicenceFactory(
+                asset_type=models.AssetType.data_center.id,
+                invoice_date=date(2013, 11, 10),
+                valid_thru=date(2014, 11, 12),
+            ) for _ in range(3)
+        ]
+        asset = DCAssetFactory()
+        for licence in licences[:2]:
+            LicenceAssetFactory(licence=licence, asset=asset)
+        with self.assertNumQueries(2):
+            result = list(api_scrooge.get_licences(date(2013, 11, 12)))
+        self.assertEqual(
+            sorted(licence['assets'] for licence in result),
+            [[], [asset.id], [asset.id]],
+        )
+        self.assertEqual(
+            set(licence['software_category'] for licence in result),
+            set(licence.software_category.name for licence in licences),
+        )
+
+    def test_get_supports_assets(self):
+        assets = [DCAssetFactory() for _ in range(3)]
+        for date_from in (date(2013, 11, 12), date(2013, 11, 10)):
+            support = DCSupportFactory(
+                date_from=date_from,
+                date_to=date(2014, 11, 12)
+            )
+            support.assets.add(*assets[:2])
+        DCSupportFactory(
+            date_from=date(2013, 11, 11),
+            date_to=date(2014, 11, 12)
+        )
+        with self.assertNumQueries(2):
+            supports = list(get_supports(date(2013, 11, 12)))
+        self.assertEqual(
+            sorted(support['assets'] for support in supports),
+            [[], [assets[0].id, assets[1].id], [assets[0].id, assets[1].id]],
+        )
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cStringIO
+import os
+import tempfile
+
+from django.test import TestCase
+from ralph.business.models import Venture
+from ralph.discovery.tests.util import DeviceFactory
+
+from ralph_assets.models_assets import Asset
+from ralph_assets.tests.utils.assets import DCAssetFactory
+from ralph_assets.views.base import DataTableColumnAssets as _
+from ralph_assets.views.export import (
+    AssetCsvExporter,
+    make_csv_file_response,
+)
+
+
+class TestAssetCsvExporter(TestCase):
+
+    def setUp(self):
+        self.columns = [
+            _('Asset id', field='pk', export=True),
+            _('SN', field='sn', export=True),
+            _('Model', field='model__name', export=True),
+            _('Venture', field='venture', export=True),
+            _('Discovered', field='is_discovered',
+              foreign_field_name='is_discovered', export=True),
+            _('Not a field', field='support_peroid', export=True),
+        ]
+        self.venture = Venture.objects.create(name='v1')
+        self.assets = [
+            DCAssetFactory(device_info__ralph_device_id=DeviceFactory(
+                venture=self.venture,
+            ).id) for i in range(5)
+        ]
+
+    def test_rows(self):
+        exporter = AssetCsvExporter(Asset.objects.all(), self.columns)
+        rows = [row for chunk in exporter.iter_rows() for row in chunk]
+        self.assertEqual(exporter.get_header(), [
+            'type', 'Asset id', 'SN', 'Model', 'Venture', 'Discovered',
+            'Not a field',
+        ])
+        self.assertEqual(rows[0], [
+            'device',
+            unicode(self.assets[0].id),
+            self.assets[0].sn,
+            self.assets[0].model.name,
+            'v1',
+            'False',
+            '',
+        ])
+        self.assertEqual(len(rows), 5)
+
+    def test_queries_per_chunk(self):
+        exporter = AssetCsvExporter(
+            Asset.objects.all(), self.columns, chunk_size=2,
+        )
+        # 3 chunks (values and devices) and the final empty chunk
+        with self.assertNumQueries(7):
+            chunks = list(exporter.iter_rows())
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+
+    def test_write(self):
+        stream = cStringIO.StringIO()
+        AssetCsvExporter(Asset.objects.all(), self.columns).write(stream)
+        self.assertEqual(len(stream.getvalue().splitlines()), 6)
+
+    def test_file_is_removed_after_response(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'wb') as stream:
+            AssetCsvExporter(Asset.objects.all(), self.columns).write(stream)
+        response = make_csv_file_response(path, 'assets.csv')
+        self.assertEqual(len(b''.join(response).splitlines()), 6)
+        response.close()
+        self.assertFalse(os.path.exists(path))
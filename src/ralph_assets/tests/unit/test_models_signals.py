@@ -11,11 +11,10 @@ from mock import patch
 from ralph_assets.models_assets import DeviceInfo, Orientation
 from ralph_assets.models_signals import (
     _get_core_parent,
-    _update_cached_localization,
-    _update_localization,
-    _update_localization_details,
     asset_device_info_post_save,
+    sync_device_localization,
     update_core_localization,
+    update_core_localization_bulk,
 )
 from ralph_assets.tests.utils.assets import (
     DataCenterFactory,
@@ -24,7 +23,7 @@ from ralph_assets.tests.utils.assets import (
     RackFactory,
     ServerRoomFactory,
 )
-from ralph.discovery.models import DeviceType
+from ralph.discovery.models import Device, DeviceType
 from ralph.discovery.tests.util import DeviceModelFactory, DeviceFactory
 
 
@@ -124,12 +123,12 @@ class AssetDevInfoPostSaveTest(TestCase):
         )
 
     def test_update_cached_localization(self):
-        _update_cached_localization(
+        sync_device_localization(
             device=self.dev_1, asset_dev_info=self.assets_dev_1.device_info,
         )
         self.assertEqual(self.dev_1.rack, 'Rack 1 DC1')
         self.assertEqual(self.dev_1.dc, 'DC1')
-        _update_cached_localization(
+        sync_device_localization(
             device=self.dev_3, asset_dev_info=self.assets_dev_3.device_info,
         )
         self.assertEqual(self.dev_3.rack, 'Rack 1 DC2')
@@ -150,7 +149,9 @@ class AssetDevInfoPostSaveTest(TestCase):
         )
         self.assets_dev_2.device_info = device_info
         self.assets_dev_2.save()
-        _update_localization(device=self.dev_2, asset_dev_info=device_info)
+        sync_device_localization(
+            device=self.dev_2, asset_dev_info=device_info,
+        )
         self.assertEqual(self.dev_2.parent_id, self.rack_1_2.id)
 
         # case: rack and dc changed
@@ -168,12 +169,14 @@ class AssetDevInfoPostSaveTest(TestCase):
         )
         self.assets_dev_2.device_info = device_info
         self.assets_dev_2.save()
-        _update_localization(device=self.dev_2, asset_dev_info=device_info)
+        sync_device_localization(
+            device=self.dev_2, asset_dev_info=device_info,
+        )
         self.assertEqual(self.dev_2.parent_id, self.rack_2_2.id)
         self.assertEqual(self.dev_2.parent.parent_id, self.dc_2.id)
 
     def test_update_localization_details(self):
-        _update_localization_details(
+        sync_device_localization(
             device=self.dev_5, asset_dev_info=self.assets_dev_5.device_info,
         )
         self.assertEqual(self.dev_5.chassis_position, 10)
@@ -202,28 +205,49 @@ class AssetDevInfoPostSaveTest(TestCase):
             (None, False),
         )
 
-    @patch('ralph_assets.models_signals._update_localization_details')
-    @patch('ralph_assets.models_signals._update_localization')
-    @patch('ralph_assets.models_signals._update_cached_localization')
-    def test_update_core_localization(
-        self, mock_update_cached_localization, mock_update_localization,
-        mock_update_localization_details,
-    ):
+    @patch('ralph_assets.models_signals.sync_device_localization')
+    def test_update_core_localization(self, mock_sync_device_localization):
         # case: ralph device doesn't exist
         self.dev_1.delete()
         update_core_localization(
             asset_dev_info=self.assets_dev_1.device_info,
         )
-        self.assertFalse(mock_update_cached_localization.called)
-        self.assertFalse(mock_update_localization.called)
-        self.assertFalse(mock_update_localization_details.called)
+        self.assertFalse(mock_sync_device_localization.called)
         # case: ralph device exists
         update_core_localization(
             asset_dev_info=self.assets_dev_2.device_info,
         )
-        self.assertTrue(mock_update_cached_localization.called)
-        self.assertTrue(mock_update_localization.called)
-        self.assertTrue(mock_update_localization_details.called)
+        self.assertTrue(mock_sync_device_localization.called)
+
+    def test_device_is_saved_only_when_changed(self):
+        device_info = self.assets_dev_4.device_info
+        sync_device_localization(device=self.dev_4, asset_dev_info=device_info)
+        with patch.object(Device, 'save') as mock_save:
+            self.assertFalse(sync_device_localization(
+                device=self.dev_4, asset_dev_info=device_info,
+            ))
+            self.assertFalse(mock_save.called)
+            device_info.position = 12
+            self.assertTrue(sync_device_localization(
+                device=self.dev_4, asset_dev_info=device_info,
+            ))
+            self.assertEqual(mock_save.call_count, 1)
+
+    def test_update_core_localization_bulk(self):
+        # move rack to other ralph rack in other data center
+        self.assets_rack_2_2.deprecated_ralph_rack_id = self.rack_1_2.id
+        self.assets_rack_2_2.data_center = self.assets_dc_1
+        self.assets_rack_2_2.save()
+        dev_4 = Device.objects.get(id=self.dev_4.id)
+        self.assertEqual(dev_4.parent_id, self.rack_1_2.id)
+        self.assertEqual(dev_4.rack, 'Rack 2 DC1')
+        self.assertEqual(dev_4.chassis_position, 10)
+        self.assertEqual(
+            Device.objects.get(id=self.rack_1_2.id).parent_id, self.dc_1.id,
+        )
+        self.assertEqual(update_core_localization_bulk(
+            self.assets_rack_2_2.deviceinfo_set.all(),
+        ), 0)
 
     @patch('ralph_assets.models_signals.update_core_localization')
     def test_asset_device_info_post_save(self, mock):
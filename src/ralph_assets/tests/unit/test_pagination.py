@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from django.test import TestCase
+
+from ralph_assets.models_assets import Asset
+from ralph_assets.tests.utils.assets import DCAssetFactory
+from ralph_assets.views.pagination import (
+    CountedPaginator,
+    KeysetPaginator,
+    decode_cursor,
+)
+
+
+class TestKeysetPaginator(TestCase):
+
+    def setUp(self):
+        for barcode in ['b', 'a', None, 'c', 'a2', None, 'd']:
+            DCAssetFactory(barcode=barcode)
+
+    def _walk_forward(self, paginator):
+        page = paginator.page(1)
+        pages = [page.object_list]
+        while page.has_next():
+            page = paginator.cursor_page(decode_cursor(page.next_cursor()))
+            pages.append(page.object_list)
+        return pages
+
+    def _walk_backward(self, paginator):
+        page = paginator.cursor_page(
+            decode_cursor(paginator.page(1).last_cursor()),
+        )
+        pages = [page.object_list]
+        while page.has_previous():
+            page = paginator.cursor_page(
+                decode_cursor(page.previous_cursor()),
+            )
+            pages.insert(0, page.object_list)
+        return pages
+
+    def _offset_pages(self, paginator):
+        return [
+            list(paginator.object_list[i:i + paginator.per_page])
+            for i in range(0, paginator.count, paginator.per_page)
+        ]
+
+    def test_default_sort(self):
+        paginator = KeysetPaginator(Asset.objects.all(), 3)
+        expected = self._offset_pages(paginator)
+        self.assertEqual(self._walk_forward(paginator), expected)
+        self.assertEqual(self._walk_backward(paginator), expected)
+
+    def test_nullable_column_sort(self):
+        for ascending in (True, False):
+            paginator = KeysetPaginator(
+                Asset.objects.all(), 2, key='barcode', ascending=ascending,
+            )
+            expected = self._offset_pages(paginator)
+            self.assertEqual(self._walk_forward(paginator), expected)
+            self.assertEqual(self._walk_backward(paginator), expected)
+
+    def test_cursor_of_other_sort_is_ignored(self):
+        paginator = KeysetPaginator(
+            Asset.objects.all(), 2, key='barcode', sort='barcode',
+        )
+        cursor = decode_cursor(paginator.page(1).next_cursor())
+        other_paginator = KeysetPaginator(
+            Asset.objects.all(), 2, key='barcode', ascending=False,
+            sort='-barcode',
+        )
+        self.assertIsNone(other_paginator.cursor_page(cursor))
+        self.assertIsNone(other_paginator.cursor_page(decode_cursor('x')))
+
+
+    def test_approximate_count(self):
+        # counters overestimate the number of assets
+        paginator = KeysetPaginator(
+            Asset.objects.all(), 3, count=20, count_is_exact=False,
+        )
+        ids = list(Asset.objects.order_by('pk').values_list('pk', flat=True))
+        forward = self._walk_forward(paginator)
+        self.assertEqual(
+            [[asset.pk for asset in rows] for rows in forward],
+            [ids[0:3], ids[3:6], ids[6:7]],
+        )
+        last_page = paginator.cursor_page(
+            decode_cursor(paginator.page(1).last_cursor()),
+        )
+        self.assertEqual([asset.pk for asset in last_page], ids[4:7])
+        self.assertFalse(last_page.has_next())
+        backward = self._walk_backward(paginator)
+        self.assertEqual(
+            [asset.pk for rows in backward for asset in rows], ids,
+        )
+        self.assertEqual(len(paginator.page(3).object_list), 1)
+        self.assertFalse(paginator.page(3).has_next())
+
+
+class TestCountedPaginator(TestCase):
+
+    def test_known_count_is_reused(self):
+        for _ in range(3):
+            DCAssetFactory()
+        paginator = CountedPaginator(Asset.objects.all(), 2, count=3)
+        with self.assertNumQueries(1):
+            page = paginator.page(2)
+            self.assertEqual(len(page.object_list), 1)
+        self.assertEqual(paginator.num_pages, 2)
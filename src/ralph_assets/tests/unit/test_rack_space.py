@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from ralph_assets.models_assets import Orientation
+from ralph_assets.models_rack_space import (
+    RackSpace,
+    find_free_space,
+    get_free_blocks,
+    get_space_values,
+)
+from ralph_assets.tests.utils.assets import (
+    DCAssetFactory,
+    RackAccessoryFactory,
+    RackFactory,
+)
+
+
+class TestRackSpace(TestCase):
+
+    def setUp(self):
+        self.rack = RackFactory(max_u_height=10)
+
+    def _occupied(self, rack=None, orientation=Orientation.front):
+        return RackSpace.objects.get(
+            rack=rack or self.rack, orientation=orientation.id,
+        ).occupied
+
+    def _mount(self, position, height, orientation=Orientation.front):
+        return DCAssetFactory(
+            device_info__rack=self.rack,
+            device_info__position=position,
+            device_info__orientation=orientation.id,
+            device_info__slot_no='',
+            model__height_of_device=height,
+        )
+
+    def test_free_blocks(self):
+        self.assertEqual(get_free_blocks('0011010000'), [
+            (1, 2), (5, 1), (7, 4),
+        ])
+        values = get_space_values('0011010000')
+        self.assertEqual(values['free_u'], 7)
+        self.assertEqual(values['largest_free_block'], 4)
+        self.assertEqual(values['free_blocks'], 3)
+        self.assertAlmostEqual(values['fragmentation'], 3 / 7)
+
+    def test_index_follows_mounted_devices(self):
+        self.assertEqual(self._occupied(), '0000000000')
+        asset = self._mount(2, 3)
+        self._mount(9, 1, Orientation.middle)
+        RackAccessoryFactory(
+            rack=self.rack, position=6, orientation=Orientation.back.id,
+        )
+        self.assertEqual(self._occupied(), '0111000010')
+        self.assertEqual(
+            self._occupied(orientation=Orientation.back), '0000010010',
+        )
+
+        asset.device_info.position = 5
+        asset.device_info.save()
+        self.assertEqual(self._occupied(), '0000111010')
+
+        other_rack = RackFactory(max_u_height=10)
+        asset.device_info.rack = other_rack
+        asset.device_info.save()
+        self.assertEqual(self._occupied(), '0000000010')
+        self.assertEqual(self._occupied(other_rack), '0000111000')
+
+    def test_blades_dont_take_space(self):
+        chassis = self._mount(1, 2)
+        DCAssetFactory(
+            device_info__rack=self.rack,
+            device_info__position=1,
+            device_info__slot_no='1',
+            model__category__is_blade=True,
+        )
+        self.assertEqual(self._occupied(), '1100000000')
+        chassis.model.height_of_device = 4
+        chassis.model.save()
+        self.assertEqual(self._occupied(), '1111000000')
+
+    def test_rebuild_command(self):
+        self._mount(1, 2)
+        RackSpace.objects.all().delete()
+        call_command('rebuild_rack_space', chunk_size=1)
+        self.assertEqual(self._occupied(), '1100000000')
+
+    def test_find_free_space(self):
+        self._mount(3, 2)
+        self._mount(3, 5, Orientation.back)
+        tight_rack = RackFactory(max_u_height=4)
+        with self.assertNumQueries(1):
+            spaces = [
+                (space.rack_id, space.orientation)
+                for space in find_free_space(4)
+            ]
+        self.assertEqual(spaces, [
+            (tight_rack.id, Orientation.front.id),
+            (tight_rack.id, Orientation.back.id),
+            (self.rack.id, Orientation.front.id),
+        ])
+        self.assertEqual(list(find_free_space(7)), [])
+
+
+class TestRestFreeSpace(TestCase):
+
+    def setUp(self):
+        User.objects.create_superuser('test', 'test@test.test', 'test')
+        self.client = APIClient()
+        self.client.login(username='test', password='test')
+        self.rack = RackFactory(max_u_height=6)
+        DCAssetFactory(
+            device_info__rack=self.rack,
+            device_info__position=3,
+            device_info__slot_no='',
+            model__height_of_device=1,
+        )
+        RackFactory(max_u_height=6)
+
+    def tearDown(self):
+        self.client.logout()
+
+    def test_get(self):
+        response = self.client.get('/assets/api/free_space/', {
+            'height': 2,
+            'data_center': self.rack.data_center_id,
+            'orientation': 'front',
+        })
+        self.assertEqual(json.loads(response.content), [{
+            'rack': self.rack.id,
+            'name': self.rack.name,
+            'data_center': self.rack.data_center_id,
+            'server_room': self.rack.server_room_id,
+            'orientation': 'front',
+            'free_u': 5,
+            'largest_free_block': 3,
+            'free_blocks': 2,
+            'fragmentation': 0.4,
+            'blocks': [[1, 2], [4, 3]],
+        }])
+
+    def test_invalid_height(self):
+        response = self.client.get('/assets/api/free_space/', {'height': 0})
+        self.assertEqual(response.status_code, 400)
@@ -8,6 +8,7 @@ from __future__ import unicode_literals
 import json
 
 from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
 from rest_framework.test import APIClient
 
@@ -18,6 +19,7 @@ from ralph_assets.rest.asset_info_per_rack import (
 )
 from ralph_assets.tests.utils.assets import (
     AssetFactory,
+    DCAssetFactory,
     RackFactory,
     RackAccessoryFactory,
 )
@@ -117,3 +119,47 @@ class TestRestAssetInfoPerRack(TestCase):
             'back': []
         }
         self.assertEquals(returned_json, expected_json)
+
+    def _get_counting_queries(self, url):
+        use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        try:
+            start = len(connection.queries)
+            response = self.client.get(url)
+            return len(connection.queries) - start, json.loads(
+                response.content,
+            )
+        finally:
+            connection.use_debug_cursor = use_debug_cursor
+
+    def test_queries_dont_depend_on_rack_contents(self):
+        url = '/assets/api/rack/{0}/'.format(self.rack_1.id)
+        queries, _ = self._get_counting_queries(url)
+        chassis = DCAssetFactory(
+            device_info__rack=self.rack_1,
+            device_info__position=3,
+            device_info__slot_no='',
+        )
+        blades = [
+            DCAssetFactory(
+                device_info__rack=self.rack_1,
+                device_info__position=3,
+                model__category__is_blade=True,
+            ) for _ in range(5)
+        ]
+        for position in (1, 2, 3):
+            RackAccessoryFactory(rack=self.rack_1, position=position)
+        more_queries, returned_json = self._get_counting_queries(url)
+        self.assertEqual(more_queries, queries)
+        chassis_json = [
+            device for device in returned_json['front']
+            if device.get('id') == chassis.id
+        ][0]
+        self.assertEqual(
+            [child['id'] for child in chassis_json['children']],
+            [blade.id for blade in blades],
+        )
+        self.assertEqual(chassis_json['url'], chassis.url)
+        self.assertEqual(
+            returned_json['info']['free_u'], self.rack_1.get_free_u(),
+        )
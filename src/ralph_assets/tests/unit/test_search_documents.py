@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from django.core.management import call_command
+from django.test import TestCase
+from ralph.account.models import Region
+from ralph.cmdb.models import CI
+
+from ralph_assets.models_assets import Asset, AssetType
+from ralph_assets.models_search import (
+    AssetCounter,
+    AssetNgram,
+    AssetSearchDocument,
+    FUZZY_FIELD,
+    approximate_count,
+    change_asset_counter,
+    fuzzy_match,
+    fuzzy_ratio_key,
+    get_fuzzy_signature,
+    get_ngrams,
+    ngram_candidates,
+    rebuild_asset_counters,
+)
+from ralph_assets.tests.utils.assets import (
+    BOAssetFactory,
+    DCAssetFactory,
+    RackFactory,
+)
+
+
+class TestAssetSearchDocument(TestCase):
+
+    def test_document_is_created_with_asset(self):
+        asset = BOAssetFactory(
+            model__name='ThinkPad X1',
+            model__manufacturer__name='Lenovo',
+            budget_info__name='Budget 2014',
+        )
+        document = AssetSearchDocument.objects.get(asset=asset)
+        self.assertEqual(document.model, 'thinkpad x1')
+        self.assertEqual(document.manufacturer, 'lenovo')
+        self.assertEqual(document.budget_info, 'budget 2014')
+        self.assertEqual(document.sn, asset.sn.lower())
+        self.assertEqual(document.imei, asset.office_info.imei)
+        self.assertEqual(document.category_slug, asset.model.category.slug)
+
+    def test_document_follows_location(self):
+        rack = RackFactory(name='Rack A1', server_room__name='Room 7')
+        asset = DCAssetFactory(device_info__rack=rack)
+        document = AssetSearchDocument.objects.get(asset=asset)
+        self.assertEqual(document.rack, 'rack a1')
+        self.assertEqual(document.server_room, 'room 7')
+
+        rack.name = 'Rack B2'
+        rack.save()
+        document = AssetSearchDocument.objects.get(asset=asset)
+        self.assertEqual(document.rack, 'rack b2')
+
+    def test_document_follows_model_and_profile(self):
+        asset = BOAssetFactory()
+        asset.model.name = 'New Model Name'
+        asset.model.save()
+        profile = asset.owner.get_profile()
+        profile.company = 'ACME'
+        profile.save()
+        document = AssetSearchDocument.objects.get(asset=asset)
+        self.assertEqual(document.model, 'new model name')
+        self.assertEqual(document.company, 'acme')
+
+    def test_document_follows_service_and_environment(self):
+        asset = DCAssetFactory()
+        asset.service.name = 'New Service'
+        asset.service.save()
+        environment = CI.objects.get(pk=asset.device_environment_id)
+        environment.name = 'New Environment'
+        environment.save()
+        document = AssetSearchDocument.objects.get(asset=asset)
+        self.assertEqual(document.service, 'new service')
+        self.assertEqual(document.environment, 'new environment')
+
+    def test_document_follows_deleted_profile(self):
+        asset = BOAssetFactory()
+        profile = asset.owner.get_profile()
+        profile.company = 'ACME'
+        profile.save()
+        profile.delete()
+        document = AssetSearchDocument.objects.get(asset=asset)
+        self.assertEqual(document.company, '')
+
+    def test_rebuild_command(self):
+        assets = [DCAssetFactory() for _ in range(3)]
+        AssetSearchDocument.objects.all().delete()
+        call_command('rebuild_search_index', chunk_size=2)
+        self.assertEqual(
+            set(AssetSearchDocument.objects.values_list('asset', flat=True)),
+            set(asset.id for asset in assets),
+        )
+
+
+class TestAssetNgram(TestCase):
+
+    def test_get_ngrams(self):
+        self.assertEqual(get_ngrams('AbCd'), set(['abc', 'bcd']))
+        self.assertEqual(get_ngrams('ab'), set())
+        self.assertEqual(get_ngrams(None), set())
+
+    def test_candidates(self):
+        asset_1 = DCAssetFactory(sn='SN-12345')
+        asset_2 = DCAssetFactory(sn='SN-34512')
+        DCAssetFactory(sn='XYZ')
+        self.assertEqual(
+            set(ngram_candidates('sn', '345')), set([asset_1.id, asset_2.id]),
+        )
+        self.assertEqual(ngram_candidates('sn', '2345'), [asset_1.id])
+        self.assertEqual(ngram_candidates('sn', '999'), [])
+        self.assertIsNone(ngram_candidates('sn', '34'))
+
+    def test_ngrams_follow_asset(self):
+        asset = DCAssetFactory(sn='abcd')
+        asset.sn = 'wxyz'
+        asset.save()
+        self.assertEqual(
+            set(AssetNgram.objects.filter(
+                asset=asset, field='sn',
+            ).values_list('gram', flat=True)),
+            set(['wxy', 'xyz']),
+        )
+
+
+class TestFuzzyMatch(TestCase):
+
+    def setUp(self):
+        self.assets = [
+            DCAssetFactory(sn='SN-{}'.format(i), barcode='BC-{}'.format(i))
+            for i in range(100, 125)
+        ]
+
+    def _full_ranking(self, query, limit=10):
+        return [asset.id for asset in sorted(
+            Asset.objects.select_related('model'),
+            key=lambda asset: fuzzy_ratio_key(
+                get_fuzzy_signature(
+                    asset.sn, asset.barcode, asset.model.name,
+                ),
+                get_fuzzy_signature(query),
+            ),
+        )][:limit]
+
+    def test_ranking_matches_full_scan(self):
+        for query in ('sn-112', 'BC 12'):
+            self.assertEqual(
+                fuzzy_match(Asset.objects.all(), query),
+                self._full_ranking(query),
+            )
+
+    def test_only_candidates_are_scored(self):
+        asset = DCAssetFactory(sn='QQQQQ')
+        # too short to share n-grams with anything
+        self.assertEqual(fuzzy_match(Asset.objects.all(), 'x'), [])
+        # fewer candidates than the limit aren't topped up with other assets
+        self.assertEqual(fuzzy_match(Asset.objects.all(), 'qqqq'), [asset.id])
+
+    def test_signature_follows_model_name(self):
+        asset = self.assets[0]
+        asset.model.name = 'Qwerty'
+        asset.model.save()
+        self.assertIn('wer', AssetNgram.objects.filter(
+            asset=asset, field=FUZZY_FIELD,
+        ).values_list('gram', flat=True))
+
+
+class TestAssetCounter(TestCase):
+
+    def setUp(self):
+        self.region = Region.get_default_region()
+
+    def _count(self, types, include_deleted=False):
+        return approximate_count(
+            types.choices, [self.region], include_deleted=include_deleted,
+        )
+
+    def test_counters_follow_assets(self):
+        dc_asset = DCAssetFactory()
+        DCAssetFactory()
+        BOAssetFactory()
+        self.assertEqual(self._count(AssetType.DC), 2)
+        self.assertEqual(self._count(AssetType.BO), 1)
+
+        dc_asset.deleted = True
+        dc_asset.save()
+        self.assertEqual(self._count(AssetType.DC), 1)
+        self.assertEqual(self._count(AssetType.DC, include_deleted=True), 2)
+
+        dc_asset.delete()
+        self.assertEqual(self._count(AssetType.DC, include_deleted=True), 1)
+
+    def test_first_change_creates_counter(self):
+        type_id = AssetType.back_office.id
+        change_asset_counter(type_id, self.region.id, False, -1)
+        self.assertEqual(self._count(AssetType.BO), 0)
+        change_asset_counter(type_id, self.region.id, False, 2)
+        self.assertEqual(self._count(AssetType.BO), 1)
+
+    def test_rebuild(self):
+        for _ in range(3):
+            BOAssetFactory()
+        AssetCounter.objects.all().update(count=0)
+        rebuild_asset_counters()
+        self.assertEqual(self._count(AssetType.BO), 3)
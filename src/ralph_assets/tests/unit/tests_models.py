@@ -6,21 +6,42 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import datetime
+import json
+import os
+import sys
+import timeit
 from unittest import skip
 
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import pre_save
 from django.test import TestCase
 
 from ralph.business.models import Venture
 from ralph.discovery.models_device import Device, DeviceType
 
 from ralph_assets.api_pricing import get_assets, get_asset_parts
-from ralph_assets.models_assets import AssetStatus, PartInfo, Rack
+from ralph_assets.history import models as history_models
+from ralph_assets.history.models import (
+    History,
+    HistoryArchive,
+    buffered_history,
+)
+from ralph_assets.models_assets import (
+    Asset,
+    AssetStatus,
+    OfficeInfo,
+    PartInfo,
+    Rack,
+    get_deprecation_intervals,
+)
 from ralph_assets.licences.models import LicenceAsset, Licence, WrongModelError
+from ralph_assets.tests.utils import UserFactory
 from ralph_assets.tests.utils.assets import (
     AssetSubCategoryFactory,
     AssetModelFactory,
     AssetFactory,
     DCAssetFactory,
+    RackAccessoryFactory,
     RackFactory,
     ServiceFactory,
 )
@@ -74,6 +95,45 @@ class TestModelAsset(TestCase):
         dev2.id = 667
         dev2.save()
 
+    def test_effective_deprecation_end_date(self):
+        self.assertEqual(Asset.objects.get(
+            pk=self.asset2.pk,
+        ).effective_deprecation_end_date, datetime.date(2014, 11, 28))
+        self.assertIsNone(Asset.objects.get(
+            pk=self.asset3.pk,
+        ).effective_deprecation_end_date)
+        self.asset2.deprecation_end_date = datetime.date(2014, 12, 15)
+        self.asset2.save()
+        assets = Asset.objects.filter(pk__in=[
+            self.asset.pk, self.asset2.pk, self.asset3.pk,
+        ])
+        date = datetime.date(2014, 3, 29)
+        self.assertEqual(
+            set(assets.deprecated(date)), set([self.asset, self.asset3]),
+        )
+        self.assertEqual(list(assets.not_deprecated(date)), [self.asset2])
+
+    def test_deprecation_intervals(self):
+        start, end = datetime.date(2014, 12, 1), datetime.date(2014, 12, 31)
+        assets = Asset.objects.filter(pk__in=[
+            self.asset.pk, self.asset3.pk, self.asset_depr_date.pk,
+        ])
+        with self.assertNumQueries(1):
+            intervals = dict(get_deprecation_intervals(assets, start, end))
+        self.assertEqual(intervals, {
+            self.asset.pk: [(start, end, True)],
+            self.asset3.pk: [(start, end, True)],
+            self.asset_depr_date.pk: [
+                (start, datetime.date(2014, 12, 15), False),
+                (datetime.date(2014, 12, 16), end, True),
+            ],
+        })
+        for asset_id, asset_intervals in intervals.iteritems():
+            asset = Asset.objects.get(pk=asset_id)
+            for first, last, deprecated in asset_intervals:
+                self.assertEqual(asset.is_deprecated(first), deprecated)
+                self.assertEqual(asset.is_deprecated(last), deprecated)
+
     def test_is_discovered(self):
         self.assertEqual(self.asset.is_discovered, True)
         self.assertEqual(self.asset2.is_discovered, False)
@@ -106,6 +166,25 @@ class TestModelAsset(TestCase):
         self.assertEqual(self.asset2.venture, None)
         self.assertEqual(asset_without_device.venture, None)
 
+    def test_with_ralph_devices(self):
+        venture = Venture.objects.create(name='v1')
+        self.dev1.venture = venture
+        self.dev1.save()
+        ids = [self.asset.id, self.asset2.id, self.asset3.id]
+        # assets, device infos and devices
+        with self.assertNumQueries(3):
+            assets = {
+                asset.id: asset for asset in Asset.objects.filter(
+                    id__in=ids,
+                ).with_ralph_devices()
+            }
+        with self.assertNumQueries(0):
+            self.assertEqual(assets[self.asset.id].venture, venture)
+            self.assertEqual(assets[self.asset.id].linked_device, self.dev1)
+            self.assertTrue(assets[self.asset.id].is_discovered)
+            self.assertFalse(assets[self.asset2.id].is_discovered)
+            self.assertIsNone(assets[self.asset3.id].get_ralph_device())
+
     def test_in_use_status(self):
         self.assertEqual(AssetStatus.used.desc, 'in use')
 
@@ -257,6 +336,20 @@ class TestApiAssets(TestCase):
             self.assertEqual(item['sn'], self.asset.sn)
             self.assertEqual(item['barcode'], self.asset.barcode)
 
+    def tests_api_asset_parts_in_one_query(self):
+        AssetFactory()
+        with self.assertNumQueries(1):
+            parts = list(get_asset_parts())
+        self.assertEqual(
+            [part['asset_id'] for part in parts], [self.asset2.id],
+        )
+        self.assertEqual(
+            parts[0]['ralph_id'], self.asset.device_info.ralph_device_id,
+        )
+        self.assertEqual(
+            parts[0]['deprecation_rate'], self.asset.deprecation_rate,
+        )
+
 
 class TestModelHistory(TestCase):
 
@@ -281,10 +374,224 @@ class TestModelHistory(TestCase):
         self.assertEqual(0, history.count())
         history = asset.get_history()
 
-        for i in xrange(5):
-            self.assertEqual(i + 2, history.count())
+        licence.assign(asset, 1)
+        # quantity and licences of the asset
+        self.assertEqual(4, history.count())
+        for i in xrange(1, 5):
             licence.assign(asset, i + 1)
-            self.assertEqual(i + 3, history.count())
+            self.assertEqual(i + 4, history.count())
+
+    def test_asset_changes_from_snapshot(self):
+        asset = Asset.objects.get(pk=AssetFactory(barcode='loaded').pk)
+        # the snapshot taken on load is diffed, the row isn't re-read
+        Asset.objects.filter(pk=asset.pk).update(barcode='changed in db')
+        old_model = asset.model
+        asset.barcode = 'saved'
+        asset.model = AssetModelFactory()
+        asset.save()
+        changes = {
+            change.field_name: (change.old_value, change.new_value)
+            for change in asset.get_history()
+        }
+        self.assertEqual(changes['barcode'], ('loaded', 'saved'))
+        self.assertEqual(
+            changes['model'], (str(old_model), str(asset.model)),
+        )
+
+        asset.barcode = 'saved again'
+        asset.save()
+        self.assertEqual(
+            asset.get_history(field_name='barcode')[0].old_value, 'saved',
+        )
+
+    def test_nested_saves(self):
+        asset = Asset.objects.get(pk=AssetFactory(barcode='outer').pk)
+        licence = Licence.objects.get(pk=LicenceFactory(remarks='inner').pk)
+
+        def save_licence(sender, instance, **kwargs):
+            licence.remarks = 'inner changed'
+            licence.save()
+
+        # licence is saved in the middle of the asset save
+        pre_save.connect(save_licence, sender=Asset, dispatch_uid='nested')
+        try:
+            asset.barcode = 'outer changed'
+            asset.save()
+        finally:
+            pre_save.disconnect(sender=Asset, dispatch_uid='nested')
+        self.assertEqual(
+            asset.get_history(field_name='barcode')[0].new_value,
+            'outer changed',
+        )
+        self.assertEqual(
+            licence.get_history(field_name='remarks')[0].new_value,
+            'inner changed',
+        )
+
+    def test_buffered_history(self):
+        asset = AssetFactory()
+        licence = LicenceFactory()
+        history = asset.get_history()
+        with buffered_history():
+            asset.sn = 'buffered'
+            asset.save()
+            for quantity in (1, 2):
+                licence.assign(asset, quantity)
+            self.assertEqual(history.count(), 0)
+        self.assertEqual(history.count(), 4)
+
+        try:
+            with buffered_history():
+                asset.sn = 'rolled back'
+                asset.save()
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(history.count(), 4)
+
+    def test_m2m_changes(self):
+        assets = [AssetFactory() for _ in range(3)]
+        support = DCSupportFactory()
+        support.assets.add(*assets[:2])
+        support.assets.remove(assets[0])
+        assets[2].supports.add(support)
+        self.assertEqual(
+            support.get_history(field_name='assets')[0].new_value,
+            json.dumps(sorted([assets[1].id, assets[2].id])),
+        )
+        asset_history = assets[0].get_history(field_name='supports')[0]
+        self.assertEqual(
+            (asset_history.old_value, asset_history.new_value),
+            (json.dumps([support.id]), '[]'),
+        )
+
+        licence = LicenceFactory()
+        user = UserFactory()
+        assets[1].saving_user = user
+        licence.assign(assets[1])
+        licence.detach(assets[1])
+        licence_history = licence.get_history(field_name='assets')[0]
+        self.assertEqual(
+            (licence_history.old_value, licence_history.new_value),
+            (json.dumps([assets[1].id]), '[]'),
+        )
+        # history of through rows is logged with the saving user
+        self.assertEqual(licence_history.user, user)
+
+    def test_archive(self):
+        asset = AssetFactory()
+        for sn in ('sn-1', 'sn-2', 'sn-3'):
+            asset.sn = sn
+            asset.save()
+        moved = History.objects.archive(
+            datetime.datetime.now() + datetime.timedelta(days=1),
+            chunk_size=2,
+        )
+        self.assertEqual(moved, HistoryArchive.objects.count())
+        self.assertEqual(asset.get_history().count(), 0)
+        asset.sn = 'sn-4'
+        asset.save()
+
+        history = History.objects.get_history_with_archive(
+            ContentType.objects.get_for_model(Asset), asset.id,
+            field_name='sn',
+        )
+        # hot window doesn't touch the archive
+        with self.assertNumQueries(2):
+            self.assertEqual(
+                [change.new_value for change in history[0:1]], ['sn-4'],
+            )
+        self.assertEqual(history.count(), 4)
+        self.assertEqual(
+            [change.new_value for change in history[0:10]],
+            ['sn-4', 'sn-3', 'sn-2', 'sn-1'],
+        )
+
+        def get_history():
+            return History.objects.get_history_with_archive(
+                ContentType.objects.get_for_model(Asset), asset.id,
+                field_name='sn',
+            )
+        # archived changes are counted once
+        with self.assertNumQueries(1):
+            self.assertEqual(get_history().count(), 4)
+        History.objects.archive(
+            datetime.datetime.now() + datetime.timedelta(days=1),
+        )
+        history = get_history()
+        self.assertEqual(history.count(), 4)
+        self.assertEqual(history.history_count, 0)
+
+    def test_latest_history(self):
+        asset = AssetFactory()
+        for sn in ('sn-1', 'sn-2', 'sn-3'):
+            asset.sn = sn
+            asset.save()
+        latest = History.objects.get_latest_history(asset, 2)
+        self.assertEqual(
+            [change.new_value for change in latest], ['sn-3', 'sn-2'],
+        )
+        # cache is invalidated by new changes
+        asset.sn = 'sn-4'
+        asset.save()
+        latest = History.objects.get_latest_history(
+            asset, 2, field_name='sn',
+        )
+        self.assertEqual(
+            [change.new_value for change in latest], ['sn-4', 'sn-3'],
+        )
+
+
+class TestHistoryConstructionCost(TestCase):
+    """Micro-benchmark of constructing instances of models with history
+    (the way querysets do, from rows of field values)."""
+
+    instances = 1000
+
+    def setUp(self):
+        asset = AssetFactory()
+        self.row = [
+            getattr(asset, field.attname) for field in Asset._meta.fields
+        ]
+        office_info = OfficeInfo.objects.create()
+        self.baseline_row = [
+            getattr(office_info, field.attname)
+            for field in OfficeInfo._meta.fields
+        ]
+
+    def _construct(self, model=Asset, row=None):
+        row = self.row if row is None else row
+        for _ in xrange(self.instances):
+            model(*row)
+
+    def _time_per_field(self, model, row):
+        elapsed = min(timeit.repeat(
+            lambda: self._construct(model, row), repeat=5, number=1,
+        ))
+        return elapsed / (self.instances * len(row))
+
+    def test_history_code_isnt_called(self):
+        history_dir = os.path.dirname(history_models.__file__)
+        calls = []
+
+        def profile(frame, event, arg):
+            if event == 'call' and frame.f_code.co_filename.startswith(
+                history_dir,
+            ):
+                calls.append(frame.f_code.co_name)
+        sys.setprofile(profile)
+        try:
+            self._construct()
+        finally:
+            sys.setprofile(None)
+        self.assertEqual(calls, [])
+
+    def test_construction_time(self):
+        # OfficeInfo shares Asset's base mixins but has no history, so the
+        # per field cost of both should stay in the same range
+        asset_cost = self._time_per_field(Asset, self.row)
+        baseline_cost = self._time_per_field(OfficeInfo, self.baseline_row)
+        self.assertLess(asset_cost / baseline_cost, 3)
 
 
 class TestModelRack(TestCase):
@@ -309,6 +616,30 @@ class TestModelRack(TestCase):
             rack.free_u, rack_height - (asset_count * model_height)
         )
 
+    def test_free_u_in_bulk(self):
+        racks = [RackFactory() for _ in range(3)]
+        model = AssetModelFactory(height_of_device=2)
+        DCAssetFactory(
+            device_info__rack=racks[0], model=model, device_info__slot_no='',
+        )
+        DCAssetFactory(
+            device_info__rack=racks[0], model=model, device_info__slot_no='1',
+        )
+        for position in (1, 1, 2):
+            RackAccessoryFactory(rack=racks[1], position=position)
+        # racks, heights of assets and positions of accessories
+        with self.assertNumQueries(3):
+            free_u = {
+                rack.id: rack.get_free_u()
+                for rack in Rack.objects.with_free_u()
+            }
+        self.assertEqual(free_u, {
+            racks[0].id: 46,
+            racks[1].id: 46,
+            racks[2].id: 48,
+        })
+        self.assertEqual(racks[1].get_free_u(), 46)
+
     def test_get_child_for_blade_chasiss(self):
         position = 3
         rack = RackFactory()
@@ -15,6 +15,7 @@ from ralph.account.models import Region
 from ralph.discovery.tests.util import DeviceFactory
 
 from ralph_assets import models_assets
+from ralph_assets.models_util import get_choices_map
 from ralph_assets.others import get_assets_rows, get_licences_rows
 from ralph_assets.tests.utils import UserFactory
 from ralph_assets.tests.utils.assets import (
@@ -465,3 +466,25 @@ class TestDeviceInfoValidation(TestCase):
         with self.assertRaises(ValidationError) as exc:
             device_info.clean_fields()
         self.assertEqual(exc.exception.code, models_assets.INVALID_POSITION)
+
+
+class TestChoicesMap(TestCase):
+
+    def test_choices_class(self):
+        choices_map = get_choices_map(models_assets.AssetStatus)
+        self.assertIs(choices_map, get_choices_map(models_assets.AssetStatus))
+        self.assertEqual(
+            choices_map.from_id(models_assets.AssetStatus.in_progress.id),
+            models_assets.AssetStatus.in_progress,
+        )
+        self.assertRaises(ValueError, choices_map.from_id, -1)
+
+    def test_field(self):
+        field = models_assets.Asset._meta.get_field('status')
+        choices_map = get_choices_map(field)
+        status = models_assets.AssetStatus.in_progress
+        self.assertEqual(choices_map.get_label(status.id), status.desc)
+        self.assertEqual(
+            choices_map.get_id(' {} '.format(status.desc.upper())), status.id,
+        )
+        self.assertEqual(choices_map.get_id('no such status', 'x'), 'x')
@@ -12,6 +12,7 @@ from django.db import transaction
 from django.http import HttpResponseRedirect
 from django.utils.translation import ugettext_lazy as _
 
+from ralph_assets.history.models import buffered_history
 from ralph_assets.models import Asset
 from ralph_assets.models_assets import AssetType
 from ralph_assets.views.base import (
@@ -108,7 +109,7 @@ class AssetBulkEdit(
                     )
 
     def save_formset(self, instances, formset):
-        with transaction.commit_on_success():
+        with transaction.commit_on_success(), buffered_history():
             for idx, instance in enumerate(instances):
                 instance.modified_by = self.request.user.get_profile()
                 instance.save(user=self.request.user)
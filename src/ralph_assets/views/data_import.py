@@ -6,6 +6,7 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import logging
+from collections import defaultdict
 
 from django.conf import settings
 from django.core.files.storage import FileSystemStorage
@@ -33,6 +34,7 @@ from ralph_assets.forms_import import (
     get_model_by_name,
     get_amendment_model,
 )
+from ralph_assets.history.models import buffered_history
 from ralph_assets.models_assets import (
     MODE2ASSET_TYPE,
     ASSET_TYPE2MODE,
@@ -40,7 +42,11 @@ from ralph_assets.models_assets import (
     Sluggy,
     AssetType,
 )
-from ralph_assets.models_util import add_problem, ProblemSeverity
+from ralph_assets.models_util import (
+    add_problem,
+    get_choices_map,
+    ProblemSeverity,
+)
 from ralph_assets.views.asset import AssetsBase
 from ralph_assets.models import (
     Asset,
@@ -63,6 +69,77 @@ MODE2ASSET_CATEGORY_TYPE = {
 logger = logging.getLogger(__name__)
 
 
+class ImportLookupCache(object):
+    """Resolves related objects during one import.
+
+    All objects of a related model are fetched in one query on the first
+    lookup, next lookups (and objects created from strings) are served from
+    memory, so rows of an import don't query for their related objects.
+    """
+
+    def __init__(self):
+        self._objects = {}
+        self._found = {}
+
+    def _get_key_field(self, Model):
+        """Returns name of the field identifying objects of *Model* and
+        whether it's compared case insensitively."""
+        if issubclass(Model, User):
+            return 'username', True
+        if issubclass(Model, Sluggy):
+            return 'slug', False
+        return 'name', True
+
+    def _get_key(self, Model, value):
+        if self._get_key_field(Model)[1] and value:
+            return value.lower()
+        return value
+
+    def _get_objects(self, Model):
+        if Model not in self._objects:
+            field_name = self._get_key_field(Model)[0]
+            objects = defaultdict(list)
+            for obj in Model.objects.all():
+                objects[self._get_key(Model, getattr(obj, field_name))].append(
+                    obj,
+                )
+            self._objects[Model] = objects
+        return self._objects[Model]
+
+    def get(self, Model, value):
+        """Returns object of *Model* identified by *value*, raises
+        ``DoesNotExist`` or ``MultipleObjectsReturned`` like
+        ``Model.objects.get``."""
+        found = self._get_objects(Model).get(self._get_key(Model, value), [])
+        if not found:
+            raise Model.DoesNotExist(
+                '{} {!r} does not exist.'.format(Model.__name__, value),
+            )
+        if len(found) > 1:
+            raise Model.MultipleObjectsReturned(
+                'More than one {} {!r}.'.format(Model.__name__, value),
+            )
+        return found[0]
+
+    def add(self, Model, obj):
+        """Adds *obj* (created during the import) to objects of *Model*."""
+        field_name = self._get_key_field(Model)[0]
+        self._get_objects(Model)[
+            self._get_key(Model, getattr(obj, field_name))
+        ].append(obj)
+
+    def get_by(self, Model, create=False, **kwargs):
+        """Returns (and remembers) object of *Model* matching *kwargs*,
+        created if *create* is True and it doesn't exist."""
+        key = (Model, create, tuple(sorted(kwargs.iteritems())))
+        if key not in self._found:
+            if create:
+                self._found[key] = Model.objects.get_or_create(**kwargs)[0]
+            else:
+                self._found[key] = Model.objects.get(**kwargs)
+        return self._found[key]
+
+
 class XlsUploadView(SessionWizardView, AssetsBase):
     """The wizard view for xls/csv upload."""
     template_name = 'assets/xls_upload_wizard.html'
@@ -190,11 +267,7 @@ class XlsUploadView(SessionWizardView, AssetsBase):
         if isinstance(field, DateField):
             value = parse_datetime(value) or parse_date(value) or None
         if field.choices:
-            value_lower = value.lower().strip()
-            for k, v in field.choices:
-                if value_lower == v.lower().strip():
-                    value = k
-                    break
+            value = get_choices_map(field).get_id(value, value)
 
         if (
             isinstance(value, basestring) and
@@ -207,25 +280,22 @@ class XlsUploadView(SessionWizardView, AssetsBase):
             )
 
         ):
+            lookups = self.lookups
             try:
-                if issubclass(field.rel.to, User):
-                    value = field.rel.to.objects.get(username__iexact=value)
-                elif issubclass(field.rel.to, Region):
+                if issubclass(field.rel.to, Region):
                     try:
-                        value = field.rel.to.objects.get(name__iexact=value)
+                        value = lookups.get(field.rel.to, value)
                     except field.rel.to.DoesNotExist:
                         msg = 'Couldn\'t find value {!r} for key {!r}'.format(
                             value, field.name,
                         )
                         raise RequiredFieldError(msg)
-                elif issubclass(field.rel.to, Sluggy):
-                    value = field.rel.to.objects.get(slug=value)
                 elif (
                     issubclass(field.rel.to, ServiceCatalog)
                     or issubclass(field.rel.to, DeviceEnvironment)
                 ):
                     try:
-                        value = field.rel.to.objects.get(name__iexact=value)
+                        value = lookups.get(field.rel.to, value)
                     except field.rel.to.DoesNotExist:
                         msg = 'Couldn\'t find value {!r} for key {!r}'.format(
                             value, field.name,
@@ -237,7 +307,7 @@ class XlsUploadView(SessionWizardView, AssetsBase):
                         )
                         raise RequiredFieldError(msg)
                 else:
-                    value = field.rel.to.objects.get(name__iexact=value)
+                    value = lookups.get(field.rel.to, value)
             except field.rel.to.DoesNotExist:
                 if issubclass(field.rel.to, CreatableFromString):
                     value = field.rel.to.create_from_string(
@@ -245,6 +315,7 @@ class XlsUploadView(SessionWizardView, AssetsBase):
                         string_name=value
                     )
                     value.save()
+                    lookups.add(field.rel.to, value)
                 else:
                     raise
         if isinstance(field, ManyToManyField):
@@ -252,6 +323,7 @@ class XlsUploadView(SessionWizardView, AssetsBase):
         return value
 
     @transaction.commit_on_success
+    @buffered_history()
     def done(self, form_list):
         mappings = self.storage.data['mappings']
         names_per_sheet, update_per_sheet, add_per_sheet =\
@@ -260,6 +332,7 @@ class XlsUploadView(SessionWizardView, AssetsBase):
         errors = {}
         model = self.get_cleaned_data_for_step('upload')['model']
         self.Model = get_model_by_name(model)
+        self.lookups = ImportLookupCache()
 
         def get_or_create_asset_model(asset_data, asset=None):
             if model == 'ralph_assets.asset':
@@ -414,7 +487,8 @@ class XlsUploadView(SessionWizardView, AssetsBase):
         kwargs = {'name': model, 'type': MODE2ASSET_TYPE[self.mode]}
 
         if category:
-            category = AssetCategory.objects.get(
+            category = self.lookups.get_by(
+                AssetCategory,
                 name=category,
                 type=MODE2ASSET_CATEGORY_TYPE[self.mode],
             )
@@ -422,12 +496,14 @@ class XlsUploadView(SessionWizardView, AssetsBase):
             category = None
         kwargs['category'] = category
         if manufacturer:
-            manufacturer = AssetManufacturer.objects.get_or_create(
-                name=manufacturer,
-            )[0]
+            manufacturer = self.lookups.get_by(
+                AssetManufacturer, create=True, name=manufacturer,
+            )
         else:
             manufacturer = None
         kwargs['manufacturer'] = manufacturer
 
-        data[get_name('model')] = AssetModel.objects.get_or_create(**kwargs)[0]
+        data[get_name('model')] = self.lookups.get_by(
+            AssetModel, create=True, **kwargs
+        )
         return data
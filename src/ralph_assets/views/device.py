@@ -24,6 +24,7 @@ from ralph_assets.forms import (
     OfficeForm,
     SplitDevice,
 )
+from ralph_assets.history.models import buffered_history
 from ralph_assets.models import Asset, AssetModel, PartInfo
 from ralph_assets.models_assets import AssetType
 from ralph_assets.licences.models import Licence
@@ -274,16 +275,17 @@ class EditDevice(HardwareModeMixin, SubmoduleModeMixin, AssetsBase):
                 self.asset.save(
                     user=self.request.user, force_unlink=force_unlink,
                 )
-                self.asset.licences.clear()
-                for licence in self.asset_form.cleaned_data.get(
-                    'licences', []
-                ):
-                    Licence.objects.get(pk=licence).assign(self.asset)
-                self.asset.supports.clear()
-                for support in self.asset_form.cleaned_data.get(
-                    'supports', []
-                ):
-                    self.asset.supports.add(support)
+                with buffered_history():
+                    self.asset.licences.clear()
+                    for licence in self.asset_form.cleaned_data.get(
+                        'licences', []
+                    ):
+                        Licence.objects.get(pk=licence).assign(self.asset)
+                    self.asset.supports.clear()
+                    for support in self.asset_form.cleaned_data.get(
+                        'supports', []
+                    ):
+                        self.asset.supports.add(support)
                 messages.success(self.request, _("Assets edited."))
                 cat = self.request.path.split('/')[2]
                 return HttpResponseRedirect(
@@ -347,7 +349,7 @@ class SplitDeviceView(SubmoduleModeMixin, AssetsBase):
         )
         self.asset_formset = AssetFormSet(self.request.POST)
         if self.asset_formset.is_valid():
-            with transaction.commit_on_success():
+            with transaction.commit_on_success(), buffered_history():
                 for instance in self.asset_formset.forms:
                     form = instance.save(commit=False)
                     model_name = instance['model_user'].value()
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""Csv export of asset search results.
+
+Columns are planned once into ``values()`` paths, rows are fetched in
+pk-ordered chunks and related objects (foreign keys, Ralph devices and
+their ventures) are resolved in bulk per chunk, so the export runs a fixed
+number of queries per chunk and keeps only one chunk in memory.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import tempfile
+
+from bob.csvutil import UnicodeWriter
+from django.conf import settings
+from django.core.servers.basehttp import FileWrapper
+from django.db import models
+from django.db.models.fields import FieldDoesNotExist
+from django.http import Http404, HttpResponse
+from ralph.discovery.models_device import Device, DeviceType
+from ralph.util.reports import set_progress
+
+from ralph_assets.models_assets import Asset
+
+
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_ENCODING = 'cp1250'
+# joins needed by ``__unicode__`` of objects resolved in bulk
+EXPORT_RELATED = {
+    Asset: ('model__manufacturer',),
+}
+
+
+def get_value_field(model, path):
+    """Returns the model field at the end of *path* (``values()`` lookup) or
+    None if *path* doesn't point to a field."""
+    field = None
+    for name in path.split('__'):
+        if field is not None:
+            if not field.rel:
+                return None
+            model = field.rel.to
+        try:
+            field = model._meta.get_field_by_name(name)[0]
+        except FieldDoesNotExist:
+            return None
+        if not hasattr(field, 'attname') or isinstance(
+            field, models.ManyToManyField,
+        ):
+            # reverse or multi-valued relation
+            return None
+    return field
+
+
+def get_column_path(column):
+    """Returns ``values()`` path of asset search *column*."""
+    if column.field == 'pk':
+        return 'id'
+    if column.foreign_field_name == 'part_info':
+        return 'part_info__' + column.field
+    if column.foreign_field_name == 'ralph_device_id':
+        return 'device_info__ralph_device_id'
+    return column.field
+
+
+class AssetCsvExporter(object):
+    """Writes assets of *queryset* as csv rows of export *columns*.
+
+    Every row starts with the asset kind (``part`` or ``device``). Columns
+    which don't map to a field are filled with values computed from linked
+    Ralph devices (``venture``, ``department``, ``is_discovered``) or left
+    empty.
+    """
+
+    def __init__(self, queryset, columns, chunk_size=EXPORT_CHUNK_SIZE):
+        self.queryset = queryset
+        self.chunk_size = chunk_size
+        self.columns = [
+            column for column in columns if column.export and column.field
+        ]
+        self.paths = set(['id', 'part_info', 'part_info__device'])
+        self.cells = [self._plan_cell(column) for column in self.columns]
+
+    def _plan_cell(self, column):
+        if column.foreign_field_name == 'venture':
+            self.paths.add('device_info__ralph_device_id')
+            return 'venture', column.field
+        if column.field in ('venture', 'is_discovered'):
+            self.paths.add('device_info__ralph_device_id')
+            return column.field, None
+        path = get_column_path(column)
+        field = get_value_field(Asset, path)
+        if field is None:
+            return 'empty', None
+        self.paths.add(path)
+        if field.rel:
+            return 'related', (path, field.rel.to)
+        if field.choices:
+            return 'choice', (path, dict(field.flatchoices))
+        return 'value', path
+
+    def get_header(self):
+        return ['type'] + [column.header_name for column in self.columns]
+
+    def iter_chunks(self):
+        """Yields lists of asset values, chunks are ordered by pk."""
+        queryset = self.queryset.order_by('pk').values(*self.paths)
+        last_pk = None
+        while True:
+            chunk = queryset
+            if last_pk is not None:
+                chunk = chunk.filter(pk__gt=last_pk)
+            chunk = list(chunk[:self.chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            last_pk = chunk[-1]['id']
+
+    def _resolve_related(self, rows):
+        related = {}
+        for kind, spec in self.cells:
+            if kind != 'related':
+                continue
+            path, model = spec
+            ids = set(row[path] for row in rows if row[path] is not None)
+            if not ids:
+                related[path] = {}
+                continue
+            related[path] = model._base_manager.select_related(
+                *EXPORT_RELATED.get(model, ())
+            ).in_bulk(ids)
+        return related
+
+    def _resolve_devices(self, rows):
+        """Returns ralph devices linked to assets of *rows* (and to assets
+        their parts are installed in) by asset id."""
+        if 'device_info__ralph_device_id' not in self.paths:
+            return {}
+        device_ids = {
+            row['id']: row['device_info__ralph_device_id'] for row in rows
+        }
+        part_of = set(
+            row['part_info__device'] for row in rows
+            if row['part_info'] and row['part_info__device']
+        ) - set(device_ids)
+        if part_of:
+            device_ids.update(Asset.admin_objects.filter(
+                pk__in=part_of,
+            ).values_list('id', 'device_info__ralph_device_id'))
+        devices = Device.objects.select_related(
+            'model', 'venture__department',
+        ).in_bulk(set(filter(None, device_ids.values())))
+        return {
+            asset_id: devices.get(device_id)
+            for asset_id, device_id in device_ids.iteritems()
+        }
+
+    def _is_discovered(self, row, devices):
+        if row['part_info']:
+            device = devices.get(row['part_info__device'])
+        else:
+            device = devices.get(row['id'])
+        if not device or not device.model:
+            return False
+        return device.model.type != DeviceType.unknown.id
+
+    def _cell(self, kind, spec, row, related, devices):
+        if kind == 'value':
+            value = row[spec]
+        elif kind == 'choice':
+            path, choices = spec
+            value = choices.get(row[path], row[path])
+        elif kind == 'related':
+            path, _ = spec
+            value = related[path].get(row[path])
+        elif kind == 'venture':
+            device = devices.get(row['id'])
+            venture = device.venture if device else None
+            value = getattr(venture, spec) if spec and venture else venture
+        elif kind == 'is_discovered':
+            value = self._is_discovered(row, devices)
+        else:
+            value = None
+        return '' if value is None else unicode(value)
+
+    def iter_rows(self):
+        """Yields chunks of csv rows (header excluded)."""
+        for rows in self.iter_chunks():
+            related = self._resolve_related(rows)
+            devices = self._resolve_devices(rows)
+            yield [
+                ['part' if row['part_info'] else 'device'] + [
+                    self._cell(kind, spec, row, related, devices)
+                    for kind, spec in self.cells
+                ] for row in rows
+            ]
+
+    def write(self, stream, job=None):
+        """Writes csv to *stream*, updating progress of *job* once per
+        chunk."""
+        writer = UnicodeWriter(stream, encoding=EXPORT_ENCODING)
+        writer.writerow(self.get_header())
+        total = self.queryset.count()
+        processed = 0
+        for rows in self.iter_rows():
+            writer.writerows(rows)
+            processed += len(rows)
+            set_progress(job, processed / max(total, 1))
+        set_progress(job, 1)
+
+    def write_temp_file(self, job=None):
+        """Writes csv to a file in reports temp storage and returns its
+        path."""
+        with tempfile.NamedTemporaryFile(
+            dir=settings.ASSETS_REPORTS['TEMP_STORAGE_PATH'],
+            prefix='assets-export-',
+            suffix='.csv',
+            delete=False,
+        ) as stream:
+            self.write(stream, job)
+        return stream.name
+
+
+class TemporaryFileWrapper(FileWrapper):
+    """File wrapper removing the file when the response is closed."""
+
+    def __init__(self, path, blksize=8192):
+        FileWrapper.__init__(self, open(path, 'rb'), blksize)
+        self.path = path
+        # FileWrapper takes ``close`` of the wrapped file
+        self.close = self.close_and_remove
+
+    def close_and_remove(self):
+        self.filelike.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def make_csv_file_response(path, filename):
+    """Streams csv file from *path* as an attachment and removes the file
+    afterwards."""
+    if not os.path.exists(path):
+        # already downloaded
+        raise Http404
+    response = HttpResponse(
+        TemporaryFileWrapper(path), content_type='application/csv',
+    )
+    response['Content-Disposition'] = 'attachment; filename={}'.format(
+        filename,
+    )
+    return response
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""Keyset (seek) pagination.
+
+Instead of ``OFFSET`` the next/previous page is fetched by seeking past the
+(sort key, pk) pair of the last/first row of the current page. The pair is
+carried in the page link as an opaque *cursor*, so deep pages cost the same
+as the first one.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import base64
+import json
+
+from django.core.paginator import (
+    EmptyPage,
+    InvalidPage,
+    Page,
+    PageNotAnInteger,
+    Paginator,
+)
+from django.db import connection
+from django.db.models import Q
+
+
+CURSOR_VARIABLE_NAME = 'cursor'
+NEXT, PREVIOUS, LAST = 'n', 'p', 'l'
+
+
+def encode_cursor(data):
+    return base64.urlsafe_b64encode(json.dumps(data))
+
+
+def decode_cursor(value):
+    """Returns cursor data or None if *value* isn't a valid cursor."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(str(value)))
+    except (TypeError, ValueError, UnicodeError):
+        return None
+    if not isinstance(data, dict) or data.get('d') not in (
+        NEXT, PREVIOUS, LAST,
+    ):
+        return None
+    return data
+
+
+def nulls_are_lowest():
+    """MySQL and SQLite sort NULLs before any value, PostgreSQL and Oracle
+    after."""
+    return connection.vendor in ('mysql', 'sqlite')
+
+
+class CountedPaginator(Paginator):
+    """Paginator which can reuse a *count* already known to the view instead
+    of running its own ``COUNT`` query."""
+
+    def __init__(self, object_list, per_page, count=None, *args, **kwargs):
+        super(CountedPaginator, self).__init__(
+            object_list, per_page, *args, **kwargs
+        )
+        if count is not None:
+            self._count = count
+
+
+class KeysetPage(Page):
+    """Page which knows how to link to its neighbours by cursors.
+
+    When the count of the paginator is approximate, neighbours are found
+    from the fetched rows (*has_next*, *has_previous*) instead of from the
+    number of pages.
+    """
+
+    def __init__(self, object_list, number, paginator, has_next=None,
+                 has_previous=None):
+        super(KeysetPage, self).__init__(object_list, number, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def has_next(self):
+        if self._has_next is None:
+            return super(KeysetPage, self).has_next()
+        return self._has_next
+
+    def has_previous(self):
+        if self._has_previous is None:
+            return super(KeysetPage, self).has_previous()
+        return self._has_previous
+
+    def _cursor(self, row, direction, number):
+        return encode_cursor({
+            's': self.paginator.sort,
+            'd': direction,
+            'p': number,
+            'k': self.paginator.get_key_value(row),
+            'id': row.pk,
+        })
+
+    def next_cursor(self):
+        if not self.has_next() or not self.object_list:
+            return None
+        return self._cursor(self.object_list[-1], NEXT, self.number + 1)
+
+    def previous_cursor(self):
+        if not self.has_previous() or not self.object_list:
+            return None
+        return self._cursor(self.object_list[0], PREVIOUS, self.number - 1)
+
+    def last_cursor(self):
+        return encode_cursor({
+            's': self.paginator.sort,
+            'd': LAST,
+            'p': self.paginator.num_pages,
+        })
+
+
+class KeysetPaginator(CountedPaginator):
+    """Paginates *object_list* ordered by (*key*, pk).
+
+    :param key: name of the sort column (must be a concrete field)
+    :param ascending: sort direction
+    :param sort: value of the sort variable, stored in cursors to discard
+        cursors created for another sort
+    :param count: number of objects, if already known
+    :param count_is_exact: False if *count* is only an estimate - it's used
+        for page numbers then, but the end of the list is found by the data
+        (the last page is read in reverse order)
+    """
+
+    def __init__(self, object_list, per_page, key='pk', ascending=True,
+                 sort='', count=None, count_is_exact=True, *args, **kwargs):
+        self.key = key
+        self.ascending = ascending
+        self.sort = sort or ''
+        self.count_is_exact = count_is_exact
+        super(KeysetPaginator, self).__init__(
+            object_list.order_by(*self._ordering(ascending)),
+            per_page, count, *args, **kwargs
+        )
+
+    def _ordering(self, ascending):
+        prefix = '' if ascending else '-'
+        if self.key == 'pk':
+            return [prefix + 'pk']
+        return [prefix + self.key, prefix + 'pk']
+
+    def get_key_value(self, row):
+        if self.key == 'pk':
+            return row.pk
+        return getattr(row, self.key)
+
+    def _seek_q(self, value, pk, ascending):
+        """Rows placed after (*value*, *pk*) when iterating in *ascending*
+        order."""
+        after = 'gt' if ascending else 'lt'
+        if self.key == 'pk':
+            return Q(**{'pk__' + after: pk})
+        nulls_first = nulls_are_lowest() == ascending
+        if value is None:
+            query = Q(**{
+                self.key + '__isnull': True,
+                'pk__' + after: pk,
+            })
+            if nulls_first:
+                query |= Q(**{self.key + '__isnull': False})
+        else:
+            query = Q(**{self.key + '__' + after: value}) | Q(**{
+                self.key: value,
+                'pk__' + after: pk,
+            })
+            if not nulls_first:
+                query |= Q(**{self.key + '__isnull': True})
+        return query
+
+    def cursor_page(self, cursor):
+        """Returns the page pointed by *cursor* (decoded) or None if cursor
+        doesn't match this paginator."""
+        if not cursor or cursor.get('s', '') != self.sort:
+            return None
+        if not self.count_is_exact:
+            return self._approximate_cursor_page(cursor)
+        direction = cursor['d']
+        try:
+            number = self.validate_number(
+                self.num_pages if direction == LAST else cursor['p']
+            )
+        except (KeyError, InvalidPage):
+            return None
+        reverse = direction in (PREVIOUS, LAST)
+        ascending = self.ascending != reverse
+        queryset = self.object_list.order_by(*self._ordering(ascending))
+        if direction == LAST:
+            limit = self.count - (self.num_pages - 1) * self.per_page
+        else:
+            if 'id' not in cursor:
+                return None
+            queryset = queryset.filter(
+                self._seek_q(cursor.get('k'), cursor['id'], ascending),
+            )
+            limit = self.per_page
+        rows = list(queryset[:limit])
+        if reverse:
+            rows.reverse()
+        return KeysetPage(rows, number, self)
+
+    def _approximate_cursor_page(self, cursor):
+        """``cursor_page`` for approximate count, one more row is fetched to
+        find out whether the list goes on."""
+        direction = cursor['d']
+        reverse = direction in (PREVIOUS, LAST)
+        ascending = self.ascending != reverse
+        queryset = self.object_list.order_by(*self._ordering(ascending))
+        if direction == LAST:
+            number = self.num_pages
+        else:
+            try:
+                number = int(cursor['p'])
+                queryset = queryset.filter(
+                    self._seek_q(cursor.get('k'), cursor['id'], ascending),
+                )
+            except (KeyError, TypeError, ValueError):
+                return None
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = direction == PREVIOUS, more
+        else:
+            has_next, has_previous = more, True
+        # page numbers are estimated, but stay consistent with neighbours
+        number = max(number, 2) if has_previous else 1
+        return KeysetPage(rows, number, self, has_next, has_previous)
+
+    def page(self, number):
+        if not self.count_is_exact:
+            try:
+                number = max(int(number), 1)
+            except (TypeError, ValueError):
+                raise PageNotAnInteger('That page number is not an integer')
+            bottom = (number - 1) * self.per_page
+            rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+            if not rows and number > 1:
+                raise EmptyPage('That page contains no results')
+            return KeysetPage(
+                rows[:self.per_page], number, self,
+                len(rows) > self.per_page, number > 1,
+            )
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if top + self.orphans >= self.count:
+            top = self.count
+        return KeysetPage(list(self.object_list[bottom:top]), number, self)
+
+
+class CountedPaginationMixin(object):
+    """Data table pagination reusing ``items_count`` computed by the view,
+    so a search runs at most one ``COUNT`` query."""
+
+    items_count = None
+
+    def get_page_number(self):
+        try:
+            return int(self.request.GET.get(self.query_variable_name) or 1)
+        except ValueError:
+            return 1
+
+    def get_paginator(self, queryset):
+        return CountedPaginator(
+            queryset, self.rows_per_page, count=self.items_count,
+        )
+
+    def get_cursor_page(self):
+        """Page pointed by a cursor from the request, if paginator supports
+        cursors."""
+        return None
+
+    def _paginate(self, queryset):
+        self.paginator = self.get_paginator(queryset)
+        page_contents = self.get_cursor_page()
+        if page_contents is None:
+            try:
+                page_contents = self.paginator.page(self.get_page_number())
+            except EmptyPage:
+                page_contents = self.paginator.page(1)
+        self.page_number = page_contents.number
+        return page_contents
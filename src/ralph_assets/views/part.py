@@ -19,6 +19,7 @@ from ralph_assets.forms import (
     EditPartForm,
     OfficeForm,
 )
+from ralph_assets.history.models import buffered_history
 from ralph_assets.models import Asset
 from ralph_assets.views.base import (
     AssetsBase,
@@ -187,11 +188,12 @@ class EditPart(HardwareModeMixin, SubmoduleModeMixin, AssetsBase):
                 self.part_info_form.cleaned_data
             )
             self.asset.save(user=self.request.user)
-            self.asset.supports.clear()
-            for support in self.asset_form.cleaned_data.get(
-                'supports', []
-            ):
-                self.asset.supports.add(support)
+            with buffered_history():
+                self.asset.supports.clear()
+                for support in self.asset_form.cleaned_data.get(
+                    'supports', []
+                ):
+                    self.asset.supports.add(support)
             messages.success(self.request, _("Part of asset was edited."))
             cat = self.request.path.split('/')[2]
             return HttpResponseRedirect(
@@ -26,13 +26,14 @@ from ralph_assets.models_assets import (
     DeviceInfo,
     MODE2ASSET_TYPE,
 )
+from ralph_assets.models_util import get_choices_map
 
 
 logger = logging.getLogger(__name__)
 
 
 def get_desc(choices_class, key, default='------'):
-    return choices_class.from_id(key) if key else default
+    return get_choices_map(choices_class).from_id(key) if key else default
 
 
 class ReportNode(object):
@@ -16,14 +16,23 @@ from django.db.models import Q
 from django.contrib import messages
 from django.utils.translation import ugettext_lazy as _
 
-from ralph.util.reports import Report, set_progress
-from ralph.business.models import Venture
+from ralph import middleware
+from ralph.util.reports import Report
 from ralph_assets.forms import (
     BackOfficeSearchAssetForm,
     DataCenterSearchAssetForm,
 )
-from ralph_assets.models import Asset, AssetCategory, PartInfo, OfficeInfo
+from ralph_assets.models import Asset, AssetCategory, AssetType
+from ralph_assets.models_search import approximate_count, ngram_q, normalize
 from ralph_assets.views.base import AssetsBase, DataTableColumnAssets
+from ralph_assets.views.export import AssetCsvExporter, make_csv_file_response
+from ralph_assets.views.pagination import (
+    CURSOR_VARIABLE_NAME,
+    CountedPaginationMixin,
+    CountedPaginator,
+    KeysetPaginator,
+    decode_cursor,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -31,6 +40,7 @@ logger = logging.getLogger(__name__)
 
 QUOTATION_MARKS = re.compile(r"^\".+\"$")
 SEARCH_DELIMITERS = re.compile(r";|\|")
+EXACT_COUNT_VARIABLE_NAME = 'exact_count'
 
 
 class AssetsSearchQueryableMixin(object):
@@ -101,10 +111,9 @@ class AssetsSearchQueryableMixin(object):
                     elif field_value == 'part':
                         all_q &= Q(part_info__gte=0)
                 elif field == 'model':
-                    if exact:
-                        all_q &= Q(model__name=field_value)
-                    else:
-                        all_q &= Q(model__name__icontains=field_value)
+                    all_q &= self._search_document_q(
+                        'model', field_value, exact,
+                    )
                 elif field == 'category':
                     part = self.get_search_category_part(field_value)
                     if part:
@@ -113,12 +122,9 @@ class AssetsSearchQueryableMixin(object):
                     if field_value.lower() == 'on':
                         all_q &= Q(deleted__in=(True, False))
                 elif field == 'manufacturer':
-                    if exact:
-                        all_q &= Q(model__manufacturer__name=field_value)
-                    else:
-                        all_q &= Q(
-                            model__manufacturer__name__icontains=field_value
-                        )
+                    all_q &= self._search_document_q(
+                        'manufacturer', field_value, exact,
+                    )
                 elif field == 'barcode':
                     if exact:
                         all_q &= Q(barcode=field_value)
@@ -128,7 +134,7 @@ class AssetsSearchQueryableMixin(object):
                             re.split(SEARCH_DELIMITERS, field_value),
                         )
                     else:
-                        all_q &= Q(barcode__contains=field_value)
+                        all_q &= ngram_q('barcode', 'contains', field_value)
                 elif field == 'hostname':
                     if exact:
                         all_q &= Q(hostname=field_value)
@@ -138,7 +144,7 @@ class AssetsSearchQueryableMixin(object):
                             re.split(SEARCH_DELIMITERS, field_value),
                         )
                     else:
-                        all_q &= Q(hostname__contains=field_value)
+                        all_q &= ngram_q('hostname', 'contains', field_value)
                 elif field == 'sn':
                     if exact:
                         all_q &= Q(sn=field_value)
@@ -148,7 +154,7 @@ class AssetsSearchQueryableMixin(object):
                             re.split(SEARCH_DELIMITERS, field_value),
                         )
                     else:
-                        all_q &= Q(sn__icontains=field_value)
+                        all_q &= ngram_q('sn', 'icontains', field_value)
                 elif field == 'niw':
                     if exact:
                         all_q &= Q(niw=field_value)
@@ -158,7 +164,7 @@ class AssetsSearchQueryableMixin(object):
                             re.split(SEARCH_DELIMITERS, field_value),
                         )
                     else:
-                        all_q &= Q(niw__icontains=field_value)
+                        all_q &= ngram_q('niw', 'icontains', field_value)
                 elif field == 'provider':
                     if exact:
                         all_q &= Q(provider=field_value)
@@ -180,20 +186,12 @@ class AssetsSearchQueryableMixin(object):
                     all_q &= Q(owner__id=field_value)
                 elif field == 'location':
                     all_q &= Q(location__icontains=field_value)
-                elif field == 'employee_id':
-                    all_q &= Q(owner__profile__employee_id=field_value)
-                elif field == 'company':
-                    all_q &= Q(owner__profile__company__icontains=field_value)
-                elif field == 'segment':
-                    all_q &= Q(owner__profile__segment__icontains=field_value)
-                elif field == 'profit_center':
-                    all_q &= Q(owner__profile__profit_center=field_value)
-                elif field == 'cost_center':
-                    all_q &= Q(owner__profile__cost_center=field_value)
-                elif field == 'department':
-                    all_q &= Q(
-                        owner__profile__department__icontains=field_value
+                elif field in ('employee_id', 'profit_center', 'cost_center'):
+                    all_q &= self._search_document_q(
+                        field, field_value, exact=True,
                     )
+                elif field in ('company', 'segment', 'department'):
+                    all_q &= self._search_document_q(field, field_value)
                 elif field == 'remarks':
                     all_q &= Q(remarks__icontains=field_value)
                 elif field == 'user':
@@ -235,10 +233,9 @@ class AssetsSearchQueryableMixin(object):
                             id__in=[int(id) for id in field_value.split(",")],
                         )
                 elif field == 'imei':
-                    if exact:
-                        all_q &= Q(office_info__imei=field_value)
-                    else:
-                        all_q &= Q(office_info__imei__icontains=field_value)
+                    all_q &= self._search_document_q(
+                        'imei', field_value, exact,
+                    )
                 elif field == 'service_name':
                     all_q &= Q(service_name=field_value)
                 elif field == 'required_support':
@@ -249,23 +246,14 @@ class AssetsSearchQueryableMixin(object):
                     all_q &= Q(supports__isnull=user_choice)
                 elif field == 'purpose':
                     all_q &= Q(office_info__purpose=field_value)
-                elif field == 'budget_info':
-                    if exact:
-                        all_q &= Q(budget_info__name=field_value)
-                    else:
-                        all_q &= Q(budget_info__name__icontains=field_value)
-                elif field == 'service':
-                    if exact:
-                        all_q &= Q(service__name=field_value)
-                    else:
-                        all_q &= Q(service__name__icontains=field_value)
+                elif field in ('budget_info', 'service'):
+                    all_q &= self._search_document_q(
+                        field, field_value, exact,
+                    )
                 elif field == 'device_environment':
-                    if exact:
-                        all_q &= Q(device_environment__name=field_value)
-                    else:
-                        all_q &= Q(
-                            device_environment__name__icontains=field_value,
-                        )
+                    all_q &= self._search_document_q(
+                        'environment', field_value, exact,
+                    )
                 elif field == 'without_assigned_location':
                     empty_location = (
                         Q(device_info__data_center=None) |
@@ -293,11 +281,15 @@ class AssetsSearchQueryableMixin(object):
                     all_q &= Q(region__id=field_value)
                 elif field == 'location_name':
                     all_q &= (
-                        Q(device_info__rack__name=field_value) |
-                        Q(device_info__data_center__name=field_value) |
-                        Q(device_info__server_room__name=field_value) |
-                        Q(device_info__rack__server_room__name=field_value) |
-                        Q(device_info__rack__data_center__name=field_value)
+                        self._search_document_q(
+                            'rack', field_value, exact=True,
+                        ) |
+                        self._search_document_q(
+                            'data_center', field_value, exact=True,
+                        ) |
+                        self._search_document_q(
+                            'server_room', field_value, exact=True,
+                        )
                     )
                 else:
                     q = Q(**{field: field_value})
@@ -315,11 +307,19 @@ class AssetsSearchQueryableMixin(object):
                 all_q &= Q(**{date + '__gte': start})
             if end:
                 all_q &= Q(**{date + '__lte': end})
-        self.items_count = Asset.objects.filter(all_q).count()
         return all_q
 
+    def _search_document_q(self, field, value, exact=False):
+        """Matches *value* against *field* of the denormalized asset search
+        document instead of joining the related tables."""
+        lookup = 'search_document__{}'.format(field)
+        if not exact:
+            lookup += '__contains'
+        return Q(**{lookup: normalize(value)})
 
-class GenericSearch(Report, AssetsBase, DataTableMixin):
+
+class GenericSearch(Report, AssetsBase, CountedPaginationMixin,
+                    DataTableMixin):
     """A generic view that contains a bob grid and a search form"""
 
     sort_variable_name = 'sort'
@@ -373,8 +373,10 @@ class _AssetSearch(AssetsSearchQueryableMixin, AssetsBase):
         )
         pre_selected = ['device_info', 'model', 'warehouse']
         if mode == 'dc':
-            self.objects = Asset.objects_dc.select_related(*pre_selected)
-            self.admin_objects = Asset.admin_objects_dc
+            self.objects = Asset.objects_dc.select_related(
+                *pre_selected
+            ).with_ralph_devices()
+            self.admin_objects = Asset.admin_objects_dc.with_ralph_devices()
             search_form = DataCenterSearchAssetForm
         elif mode == 'back_office':
             self.objects = Asset.objects_bo.select_related(*pre_selected)
@@ -392,7 +394,7 @@ class _AssetSearch(AssetsSearchQueryableMixin, AssetsBase):
             category = AssetCategory.objects.get(slug=category_id)
             children = [x.slug for x in category.get_children()]
             categories = [category_id, ] + children
-            return Q(model__category_id__in=categories)
+            return Q(search_document__category_slug__in=categories)
 
     def get_all_items(self, query):
         include_deleted = self.request.GET.get('deleted')
@@ -411,7 +413,8 @@ class _AssetSearch(AssetsSearchQueryableMixin, AssetsBase):
         return q
 
 
-class AssetSearchDataTable(_AssetSearch, DataTableMixin):
+class AssetSearchDataTable(_AssetSearch, CountedPaginationMixin,
+                           DataTableMixin):
     """
         The main-screen search form for all type of assets.
         (version without async reports)
@@ -423,6 +426,9 @@ class AssetSearchDataTable(_AssetSearch, DataTableMixin):
     _ = DataTableColumnAssets
     sidebar_selected = 'search'
     template_name = 'assets/search_asset.html'
+    # sorts (besides the default one) paginated by keyset, have to be indexed
+    keyset_sort_columns = ('barcode', 'sn', 'hostname', 'invoice_no')
+    count_is_approximate = False
 
     def __init__(self, *args, **kwargs):
         super(AssetSearchDataTable, self).__init__(*args, **kwargs)
@@ -516,50 +522,62 @@ class AssetSearchDataTable(_AssetSearch, DataTableMixin):
                 AssetSearchDataTable, self,
             ).handle_search_data(*args, **kwargs)
             queryset = self.get_all_items(all_q)
-            self.assets_count = queryset.count() if all_q.children else None
             if get_csv:
                 return self.get_csv_data(queryset)
-            else:
-                self.data_table_query(queryset)
+            self.items_count = self.get_items_count(queryset, all_q)
+            self.assets_count = self.items_count if all_q.children else None
+            self.data_table_query(queryset)
         else:
             queryset = self.objects.none()
+            self.items_count = 0
             self.assets_count = None
             self.data_table_query(queryset)
             messages.error(self.request, _("Please correct the errors."))
 
-    def get_csv_header(self):
-        header = super(AssetSearchDataTable, self).get_csv_header()
-        return ['type'] + header
-
-    def get_csv_rows(self, queryset, type, model):
-        data = [self.get_csv_header()]
-        total = queryset.count()
-        processed = 0
-        job = get_current_job()
-        for asset in queryset:
-            row = ['part'] if asset.part_info else ['device']
-            for item in self.columns:
-                field = item.field
-                if field:
-                    nested_field_name = item.foreign_field_name
-                    if nested_field_name == type:
-                        cell = self.get_cell(
-                            getattr(asset, type), field, model
-                        )
-                    elif nested_field_name == 'part_info':
-                        cell = self.get_cell(asset.part_info, field, PartInfo)
-                    elif nested_field_name == 'venture':
-                        cell = self.get_cell(asset.venture, field, Venture)
-                    elif nested_field_name == 'is_discovered':
-                        cell = unicode(asset.is_discovered)
-                    else:
-                        cell = self.get_cell(asset, field, Asset)
-                    row.append(unicode(cell))
-            data.append(row)
-            processed += 1
-            set_progress(job, processed / total)
-        set_progress(job, 1)
-        return data
+    def approximate_count_allowed(self, all_q):
+        """Approximate count is used (if enabled) only for unfiltered
+        searches, which match whole asset counters."""
+        return (
+            getattr(settings, 'ASSETS_SEARCH_APPROXIMATE_COUNT', False) and
+            not all_q.children and
+            not self.request.GET.get(EXACT_COUNT_VARIABLE_NAME)
+        )
+
+    def get_items_count(self, queryset, all_q):
+        self.count_is_approximate = self.approximate_count_allowed(all_q)
+        if self.count_is_approximate:
+            types = {
+                'dc': AssetType.DC.choices,
+                'back_office': AssetType.BO.choices,
+            }[self.mode]
+            return approximate_count(types, middleware.get_actual_regions())
+        return queryset.count()
+
+    def get_paginator(self, queryset):
+        sort = self.request.GET.get(self.sort_variable_name) or ''
+        key = sort.lstrip('-') or 'pk'
+        if key != 'pk' and key not in self.keyset_sort_columns:
+            if self.count_is_approximate:
+                # offset pagination needs the exact count
+                return CountedPaginator(queryset, self.rows_per_page)
+            return super(AssetSearchDataTable, self).get_paginator(queryset)
+        return KeysetPaginator(
+            queryset,
+            self.rows_per_page,
+            key=key,
+            ascending=not sort.startswith('-'),
+            sort=sort,
+            count=self.items_count,
+            count_is_exact=not self.count_is_approximate,
+        )
+
+    def get_cursor_page(self):
+        if not isinstance(self.paginator, KeysetPaginator):
+            return None
+        # without a valid cursor it falls back to offset pagination
+        return self.paginator.cursor_page(
+            decode_cursor(self.request.GET.get(CURSOR_VARIABLE_NAME)),
+        )
 
     def get_context_data(self, *args, **kwargs):
         ret = super(
@@ -582,9 +600,17 @@ class AssetSearchDataTable(_AssetSearch, DataTableMixin):
             'asset_transitions_enable': settings.ASSETS_TRANSITIONS['ENABLE'],
             'asset_hide_action_search': settings.ASSET_HIDE_ACTION_SEARCH,
             'assets_count': self.assets_count,
+            'items_count': self.items_count,
+            'count_is_approximate': self.count_is_approximate,
+            'exact_count_url': self.get_exact_count_url(),
         })
         return ret
 
+    def get_exact_count_url(self):
+        query = self.request.GET.copy()
+        query[EXACT_COUNT_VARIABLE_NAME] = '1'
+        return '?' + query.urlencode()
+
     def get(self, *args, **kwargs):
         self.handle_search_data()
         if self.export_requested():
@@ -600,11 +626,17 @@ class AssetSearchDataTable(_AssetSearch, DataTableMixin):
         return self.handle_search_data(get_csv=True)
 
     def get_response(self, request, result):
-        return self.make_csv_response(result)
+        return make_csv_file_response(result, self.csv_file_name)
+
+    def do_csv_export(self, queryset):
+        return make_csv_file_response(
+            self.get_csv_data(queryset), self.csv_file_name,
+        )
 
     def get_csv_data(self, queryset):
-        return self.get_csv_rows(
-            queryset, type='office_info', model=OfficeInfo
+        """Writes the export to a temp file and returns its path."""
+        return AssetCsvExporter(queryset, self.columns).write_temp_file(
+            get_current_job(),
         )
 
     def get_columns_nested(self, mode):
@@ -7,6 +7,7 @@ from __future__ import unicode_literals
 
 from django.db import transaction
 
+from ralph_assets.history.models import buffered_history
 from ralph_assets.models import Asset, DeviceInfo, OfficeInfo, PartInfo
 
 
@@ -27,6 +28,7 @@ def update_management_ip(asset, data):
 
 
 @transaction.commit_on_success
+@buffered_history()
 def _create_assets(creator_profile, asset_form, additional_form, mode):
     asset_data = {}
     for f_name, f_value in asset_form.cleaned_data.items():